@@ -0,0 +1,98 @@
+"""
+Benchmarks of the measurement and export functions (without napari).
+
+The classes follow the airspeed velocity (asv) conventions: setup is
+called with the parameters before the time_* methods are timed.
+They can be run with asv or with benchmarks/run.py.
+"""
+
+import numpy as np
+
+import napari_filter_labels_by_prop.measure as msr
+import napari_filter_labels_by_prop.utils as uts
+
+from .fixtures import __sizes__, __sparsity__, make_intensity, make_labels
+
+
+class Measure:
+    """Measurement of the props table, like at widget initialisation."""
+
+    params = (__sizes__, [2, 3], __sparsity__)
+    param_names = ["n_objects", "ndim", "sparsity"]
+    timeout = 1800
+
+    def setup(self, n_objects, ndim, sparsity):
+        self.lbl = make_labels(n_objects, ndim, sparsity)
+        self.img = make_intensity(self.lbl.shape)
+        self.spacing = (1.0,) * ndim
+
+    def time_measure_props(self, n_objects, ndim, sparsity):
+        # Reduction properties only
+        msr.lazy_measure_props(
+            self.lbl,
+            intensity_image=self.img,
+            properties=msr.__reduction_props__,
+            spacing=self.spacing,
+        )
+
+    def time_shape_prop(self, n_objects, ndim, sparsity):
+        # Regionprops property, measured when it is first selected
+        table = msr.lazy_measure_props(
+            self.lbl, properties=["label", "extent"], spacing=self.spacing
+        )
+        table["extent"]
+
+
+class Compartments:
+    """Creation and measurement of the cell and cytoplasm masks."""
+
+    params = (__sizes__, [2, 3], __sparsity__)
+    param_names = ["n_objects", "ndim", "sparsity"]
+    timeout = 1800
+
+    def setup(self, n_objects, ndim, sparsity):
+        self.lbl = make_labels(n_objects, ndim, sparsity)
+        self.img = make_intensity(self.lbl.shape)
+        self.spacing = (1.0,) * ndim
+        self.cells, self.cyto = uts.create_cell_cyto_masks(
+            self.lbl, expansion=1, voxel_size=self.spacing
+        )
+
+    def time_create_cell_cyto_masks(self, n_objects, ndim, sparsity):
+        uts.create_cell_cyto_masks(
+            self.lbl, expansion=1, voxel_size=self.spacing
+        )
+
+    def time_measure_compartments(self, n_objects, ndim, sparsity):
+        msr.lazy_measure_compartments(
+            self.lbl,
+            self.cells,
+            self.cyto,
+            intensity_image=self.img,
+            properties=msr.__reduction_props__,
+            spacing=self.spacing,
+        )
+
+
+class Export:
+    """Creation of the filtered label images (half of the labels kept)."""
+
+    params = (__sizes__, [2, 3], __sparsity__)
+    param_names = ["n_objects", "ndim", "sparsity"]
+    timeout = 1800
+
+    def setup(self, n_objects, ndim, sparsity):
+        self.lbl = make_labels(n_objects, ndim, sparsity)
+        self.labels = np.unique(self.lbl)[1:]
+        self.keep = np.arange(len(self.labels)) % 2 == 0
+        # {label: label or 0}, as used by remove_labels
+        self.label_map = dict(
+            zip(self.labels.tolist(), np.where(self.keep, self.labels, 0))
+        )
+
+    def time_remove_labels(self, n_objects, ndim, sparsity):
+        uts.remove_labels(self.lbl, self.label_map)
+
+    def time_label_lut(self, n_objects, ndim, sparsity):
+        lut = uts.label_lut(self.labels, self.keep, relabel=True)
+        uts.apply_lut(self.lbl, lut)
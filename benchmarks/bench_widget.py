@@ -0,0 +1,81 @@
+"""
+Benchmarks of the widget stages (measurement, preview and export).
+
+Uses a napari ViewerModel (no canvas), so it runs headless with
+QT_QPA_PLATFORM=offscreen. Skipped if napari or Qt are not available.
+"""
+
+import os
+
+from .fixtures import __sizes__, __sparsity__, make_intensity, make_labels
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# Measure the tables, instead of loading them from the disk cache
+os.environ["NAPARI_FILTER_LABELS_CACHE_DIR"] = ""
+
+
+class Widget:
+    """Stages of the FilterByWidget, with an intensity image."""
+
+    params = (__sizes__, [2, 3], __sparsity__)
+    param_names = ["n_objects", "ndim", "sparsity"]
+    timeout = 1800
+
+    def setup(self, n_objects, ndim, sparsity):
+        try:
+            from napari.components import ViewerModel
+            from qtpy.QtWidgets import QApplication
+
+            from napari_filter_labels_by_prop._filter_by_widget import (
+                FilterByWidget,
+            )
+        except ImportError as e:
+            # asv skips benchmarks that raise NotImplementedError in setup
+            raise NotImplementedError(f"Widget not available: {e}") from e
+        lbl = make_labels(n_objects, ndim, sparsity)
+        if (int(lbl.max()) + 1) * 16 > 2**30:
+            # The widget keeps an RGBA float32 color per label value
+            raise NotImplementedError("Label colors larger than 1 GB")
+        self.app = QApplication.instance() or QApplication([])
+        self.viewer = ViewerModel()
+        self.viewer.add_image(make_intensity(lbl.shape), name="image")
+        self.viewer.add_labels(lbl, name="labels")
+        # Measures the props table (see time_update_properties)
+        self.widget = FilterByWidget(self.viewer)
+        self.widget.jobs.wait()
+        self.prop_filter = self.widget.filter_widget
+        self.widget.prop_combobox.setCurrentText("intensity_mean")
+        self.n_layers = len(self.viewer.layers)
+        self.n_color_map_updates = 0
+
+    def teardown(self, n_objects, ndim, sparsity):
+        self.widget.close()
+        self.viewer.layers.clear()
+
+    def time_update_properties(self, n_objects, ndim, sparsity):
+        # Measure again, instead of using the cached table
+        self.widget.props_cache.clear()
+        self.widget.update_properties()
+        # Measured in the background
+        self.widget.jobs.wait()
+
+    def time_update_color_map(self, n_objects, ndim, sparsity):
+        # Alternate the threshold, so that every repeat changes the kept
+        # labels (the colormap is not rebuilt for the same threshold)
+        self.n_color_map_updates += 1
+        fraction = 1 / 3 if self.n_color_map_updates % 2 else 2 / 3
+        slider = self.prop_filter.min_slider
+        slider.setValue(
+            slider.minimum() + fraction * (slider.maximum() - slider.minimum())
+        )
+        self.prop_filter.update_color_map()
+
+    def time_add_layer_properties(self, n_objects, ndim, sparsity):
+        self.widget.add_layer_properties()
+
+    def time_create_labels(self, n_objects, ndim, sparsity):
+        self.prop_filter.create_labels()
+        self.prop_filter.jobs.wait()
+        # Remove the new layers (added for every repeat)
+        while len(self.viewer.layers) > self.n_layers:
+            self.viewer.layers.pop()
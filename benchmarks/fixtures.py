@@ -0,0 +1,87 @@
+"""
+Synthetic label images for the benchmarks.
+
+Objects are boxes of random size (1 to cell - 1 voxels per axis), placed
+at random positions of a regular grid of cells. Objects never touch, so
+the number of objects is exact, and the image grows linearly with the
+number of objects.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+# Number of objects of the label images
+__sizes__ = [1_000, 10_000, 100_000, 1_000_000]
+# Mean gap between label values, 1 = sequential labels 1..n
+__sparsity__ = [1, 10, 1000]
+
+
+@lru_cache(maxsize=4)
+def make_labels(
+    n_objects: int,
+    ndim: int = 2,
+    sparsity: int = 1,
+    cell: int = 4,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Create a label image with n_objects objects.
+
+    The label values are increasing with random gaps of mean sparsity,
+    so the maximum label is about n_objects * sparsity.
+    Results are cached (do not modify them).
+    :param n_objects: number of objects
+    :param ndim: number of image dimensions (2 or 3)
+    :param sparsity: mean gap between label values
+    :param cell: grid cell size per axis (the object size is smaller)
+    :param seed: random seed
+    :return: label image (int32, or int64 for large label values)
+    """
+    rng = np.random.default_rng(seed)
+    grid = (int(np.ceil(n_objects ** (1 / ndim))),) * ndim
+    # Label values with random gaps
+    if sparsity > 1:
+        gaps = rng.integers(1, 2 * sparsity, size=n_objects)
+    else:
+        gaps = np.ones(n_objects, dtype=np.int64)
+    ids = np.cumsum(gaps)
+    dtype = np.int32 if ids[-1] < 2**31 else np.int64
+    # Objects at random grid cells
+    cells = np.zeros(int(np.prod(grid)), dtype=dtype)
+    cells[rng.permutation(cells.size)[:n_objects]] = ids
+    cells = cells.reshape(grid)
+    # Random object extent per cell and axis
+    extent = rng.integers(1, cell, size=grid + (ndim,), dtype=np.uint8)
+    lbl = _upsample(cells, cell)
+    for ax in range(ndim):
+        pos = np.arange(lbl.shape[ax]) % cell
+        pos = pos.reshape((-1,) + (1,) * (ndim - ax - 1))
+        lbl[pos >= _upsample(extent[..., ax], cell)] = 0
+    return lbl
+
+
+@lru_cache(maxsize=4)
+def make_intensity(shape: tuple, seed: int = 0) -> np.ndarray:
+    """
+    Create a random intensity image.
+
+    :param shape: image shape
+    :param seed: random seed
+    :return: float32 image
+    """
+    rng = np.random.default_rng(seed)
+    return rng.random(shape, dtype=np.float32)
+
+
+def _upsample(arr: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Repeat every element factor times along every axis.
+
+    :param arr: array
+    :param factor: repetitions per axis
+    :return: array with shape arr.shape * factor
+    """
+    for ax in range(arr.ndim):
+        arr = np.repeat(arr, factor, axis=ax)
+    return arr
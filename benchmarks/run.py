@@ -0,0 +1,327 @@
+"""
+Run the benchmarks without asv and compare them with a baseline.
+
+Every benchmark is timed (best of --repeat runs), and its peak memory
+is measured with tracemalloc (memory allocated during a run, numpy
+arrays included). Benchmarks that are slower or use more memory than
+the baseline (by more than --threshold) are reported as regressions,
+and the exit code is 1.
+
+Timings are only comparable on the same machine, so the baseline is
+measured in the same session: --against runs the same benchmarks on the
+package of another git revision (in a temporary worktree) first.
+Results saved with -o can be used as --baseline on the same machine.
+
+Usage (from the repository root):
+    python -m benchmarks.run                   # 1k and 10k objects
+    python -m benchmarks.run --param n_objects=100000,1000000 --param ndim=3
+    python -m benchmarks.run --bench Export    # benchmarks matching Export
+    python -m benchmarks.run --against main    # compare with a revision
+    python -m benchmarks.run -o results.json   # e.g. to compare engines
+"""
+
+import argparse
+import importlib
+import inspect
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Benchmark modules (asv style classes)
+__modules__ = ["bench_core", "bench_widget"]
+# Parameters used if not given on the command line
+__default_params__ = {"n_objects": [1_000, 10_000]}
+# Differences below these are not reported as regressions (noise)
+__min_time_diff__ = 1e-3  # seconds
+__min_memory_diff__ = 2**20  # bytes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def collect(
+    pattern: Optional[str] = None,
+    params: Optional[Dict[str, list]] = None,
+) -> List[tuple]:
+    """
+    Collect the benchmarks.
+
+    :param pattern: regular expression, only benchmarks with a matching
+                    name are collected
+    :param params: {parameter name: values} to run (instead of all the
+                   values of a benchmark class)
+    :return: list of (name, class, method name, parameter values)
+    """
+    params = {**__default_params__, **(params or {})}
+    benchmarks = []
+    for module_name in __modules__:
+        module = importlib.import_module(f"{__package__}.{module_name}")
+        for cls_name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+            names = getattr(cls, "param_names", [])
+            values = [
+                params.get(n, v)
+                for n, v in zip(names, getattr(cls, "params", []))
+            ]
+            for method in sorted(dir(cls)):
+                if not method.startswith("time_"):
+                    continue
+                for args in itertools.product(*values):
+                    args_str = ", ".join(
+                        f"{n}={a}" for n, a in zip(names, args)
+                    )
+                    name = f"{module_name}.{cls_name}.{method}({args_str})"
+                    if pattern is None or re.search(pattern, name):
+                        benchmarks.append((name, cls, method, args))
+    return benchmarks
+
+
+def run_benchmark(cls, method: str, args: tuple, repeat: int = 3) -> dict:
+    """
+    Time a benchmark and measure its peak memory.
+
+    :param cls: benchmark class
+    :param method: name of the time_* method
+    :param args: parameter values
+    :param repeat: number of timed runs (the fastest is kept)
+    :return: {'time': s, 'peak_memory': bytes}, {'skipped': reason} or
+             {'error': message}
+    """
+    bench = cls()
+    func = getattr(bench, method)
+    try:
+        if hasattr(bench, "setup"):
+            bench.setup(*args)
+    except NotImplementedError as e:
+        return {"skipped": str(e)}
+    except Exception as e:  # noqa: BLE001 report and go on with the others
+        return {"error": f"setup: {type(e).__name__}: {e}"}
+    try:
+        times = []
+        for _ in range(repeat):
+            start = perf_counter()
+            func(*args)
+            times.append(perf_counter() - start)
+        # Memory run (tracemalloc slows down the allocations)
+        tracemalloc.start()
+        try:
+            current = tracemalloc.get_traced_memory()[0]
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1] - current
+        finally:
+            tracemalloc.stop()
+    except Exception as e:  # noqa: BLE001 report and go on with the others
+        return {"error": f"{type(e).__name__}: {e}"}
+    finally:
+        if hasattr(bench, "teardown"):
+            bench.teardown(*args)
+    return {"time": min(times), "peak_memory": int(peak)}
+
+
+def compare(
+    results: Dict[str, dict],
+    baseline: Dict[str, dict],
+    threshold: float = 2.0,
+) -> List[str]:
+    """
+    Find regressions compared to a baseline.
+
+    :param results: benchmark results, see run_benchmark
+    :param baseline: baseline results
+    :param threshold: ratio to the baseline that is a regression
+    :return: list of regression descriptions
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or "time" not in base or "time" not in result:
+            continue
+        for key, min_diff, unit in (
+            ("time", __min_time_diff__, "s"),
+            ("peak_memory", __min_memory_diff__, "B"),
+        ):
+            new, old = result[key], base[key]
+            if new > threshold * old and new - old > min_diff:
+                regressions.append(
+                    f"{name}: {key} {_format(old, unit)} -> "
+                    f"{_format(new, unit)} ({new / max(old, 1e-12):.2f}x)"
+                )
+    return regressions
+
+
+def run_revision(revision: str, argv: Sequence[str]) -> Dict[str, dict]:
+    """
+    Run the benchmarks on the package of another git revision.
+
+    The revision is checked out in a temporary git worktree, and the
+    (current) benchmarks are run in a subprocess that imports the package
+    from there. Benchmarks of features missing in the revision fail there,
+    and are not compared.
+
+    :param revision: git revision, e.g. 'main' or 'HEAD~1'
+    :param argv: command line arguments of the run (without -o)
+    :return: benchmark results, see run_benchmark
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        worktree = os.path.join(tmp, "worktree")
+        subprocess.run(
+            ["git", "worktree", "add", "--detach", worktree, revision],
+            cwd=ROOT,
+            check=True,
+            capture_output=True,
+        )
+        try:
+            output = os.path.join(tmp, "results.json")
+            path = [os.path.join(worktree, "src")]
+            if os.environ.get("PYTHONPATH"):
+                path.append(os.environ["PYTHONPATH"])
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.run", *argv, "-o", output],
+                cwd=ROOT,
+                env={**os.environ, "PYTHONPATH": os.pathsep.join(path)},
+            )
+            with open(output) as f:
+                return json.load(f)["results"]
+        finally:
+            subprocess.run(
+                ["git", "worktree", "remove", "--force", worktree],
+                cwd=ROOT,
+                capture_output=True,
+            )
+
+
+def machine_info() -> dict:
+    """
+    Describe the machine, results are only comparable on the same one.
+
+    :return: dict
+    """
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def _format(value: float, unit: str) -> str:
+    if unit == "B":
+        return f"{value / 2**20:.1f} MB"
+    return f"{value:.4f} s"
+
+
+def _parse_params(items: Sequence[str]) -> Dict[str, list]:
+    """
+    Parse 'name=value1,value2' parameters (as int if possible).
+
+    :param items: list of strings
+    :return: {name: [values]}
+    """
+    params = {}
+    for item in items:
+        name, _, values = item.partition("=")
+        params[name] = [
+            int(v) if v.lstrip("-").isdigit() else v for v in values.split(",")
+        ]
+    return params
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="Run the benchmarks and compare them with a baseline.",
+    )
+    parser.add_argument(
+        "--bench", help="regular expression to select benchmarks by name"
+    )
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        help="parameter values, e.g. n_objects=1000,10000 (repeatable)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="timed runs per benchmark"
+    )
+    parser.add_argument(
+        "--against",
+        help="git revision to compare with, benchmarked first (e.g. main)",
+    )
+    parser.add_argument(
+        "--baseline",
+        help="results of an earlier run on this machine (see --output)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=2.0,
+        help="ratio to the baseline reported as regression (2.0)",
+    )
+    parser.add_argument("-o", "--output", help="write the results as json")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.against:
+        print(f"Baseline: {args.against}")
+        run_argv = [f"--repeat={args.repeat}"]
+        run_argv += [f"--param={p}" for p in args.param]
+        if args.bench:
+            run_argv.append(f"--bench={args.bench}")
+        baseline = run_revision(args.against, run_argv)
+        print("\nCurrent tree")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved["machine"] == machine_info():
+            baseline = saved["results"]
+        else:
+            print(
+                "The baseline was measured on a different machine, "
+                "it is not compared.\n"
+            )
+
+    benchmarks = collect(args.bench, _parse_params(args.param))
+    results = {}
+    for name, cls, method, params in benchmarks:
+        result = run_benchmark(cls, method, params, repeat=args.repeat)
+        results[name] = result
+        if "time" in result:
+            print(
+                f"{name:<90} {_format(result['time'], 's'):>12} "
+                f"{_format(result['peak_memory'], 'B'):>12}"
+            )
+        else:
+            status, message = next(iter(result.items()))
+            print(f"{name:<90} {status:>12}: {message}")
+    errors = [n for n, r in results.items() if "error" in r]
+
+    regressions = []
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s):")
+        print("\n".join(regressions))
+    if errors:
+        print(f"\n{len(errors)} benchmark(s) failed.")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"machine": machine_info(), "results": results}, f, indent=1
+            )
+    return int(bool(regressions or errors))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
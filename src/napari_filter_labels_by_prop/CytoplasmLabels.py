@@ -0,0 +1,63 @@
+from typing import Tuple
+
+import numpy as np
+
+
+class CytoplasmLabels:
+    """
+    Cytoplasm label image, computed from the cell and nuclei labels.
+
+    The cytoplasm is the cell mask without the nucleus, i.e. cells - nuclei.
+    Instead of storing it as a third label image, the values are computed
+    when they are read (e.g. cyto[10:20]), only for the requested region.
+    The cytoplasm is read block by block (see chunks), so the measurement
+    and the label creation never hold the whole cytoplasm in memory.
+    """
+
+    def __init__(
+        self, cells: np.ndarray, nuclei: np.ndarray, slab_bytes: int = 2**26
+    ):
+        if cells.shape != nuclei.shape:
+            raise ValueError(
+                f"Cell and nuclei shapes must be equal. "
+                f"Got: {cells.shape} and {nuclei.shape}"
+            )
+        self.cells = cells
+        self.nuclei = nuclei
+        # Blocks of whole slabs along the first axis (zarr style chunks)
+        row_bytes = int(np.prod(self.shape[1:])) * self.dtype.itemsize
+        rows = max(slab_bytes // max(row_bytes, 1), 1)
+        self.chunks = (min(rows, self.shape[0]),) + tuple(self.shape[1:])
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.cells.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.cells.dtype
+
+    @property
+    def ndim(self) -> int:
+        return self.cells.ndim
+
+    @property
+    def size(self) -> int:
+        return self.cells.size
+
+    def __getitem__(self, key) -> np.ndarray:
+        cells = np.asarray(self.cells[key])
+        nuclei = np.asarray(self.nuclei[key])
+        return np.where(nuclei == 0, cells, 0).astype(self.dtype, copy=False)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        cyto = self[...]
+        if dtype is not None:
+            cyto = cyto.astype(dtype, copy=False)
+        return cyto
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __repr__(self) -> str:
+        return f"CytoplasmLabels(shape={self.shape}, dtype={self.dtype})"
@@ -0,0 +1,131 @@
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+import napari_filter_labels_by_prop.utils as uts
+
+
+class FilterModel:
+    """
+    Range filters on several properties, combined with AND or OR.
+
+    Every filter keeps the labels with a property value within
+    [min, max]. NaN values are neutral: they pass a filter when combined
+    with AND, and do not when combined with OR (so that a NaN does not
+    keep a label that fails all other filters). The mask of the labels to
+    keep is evaluated over the columns of a props table, one vectorized
+    comparison per filter.
+    """
+
+    def __init__(self, combine: str = "and"):
+        # {property: (min, max)}, in order of creation
+        self.ranges: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        self._combine = None
+        self.combine = combine
+
+    @property
+    def combine(self) -> str:
+        """How the filters are combined: 'and' or 'or'."""
+        return self._combine
+
+    @combine.setter
+    def combine(self, combine: str):
+        combine = combine.lower()
+        if combine not in ("and", "or"):
+            raise ValueError(f"Combine must be 'and' or 'or'. Got: {combine}")
+        self._combine = combine
+
+    def set_range(
+        self,
+        prop: str,
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None,
+    ):
+        """
+        Add (or update) the filter of a property.
+
+        :param prop: property name (column of the props table)
+        :param min_value: minimum value, None for no minimum
+        :param max_value: maximum value, None for no maximum
+        :return:
+        """
+        self.ranges[prop] = (min_value, max_value)
+
+    def get_range(
+        self, prop: str
+    ) -> Optional[Tuple[Optional[float], Optional[float]]]:
+        """
+        The (min, max) filter of a property.
+
+        :param prop: property name
+        :return: (min, max) or None, if the property is not filtered
+        """
+        return self.ranges.get(prop)
+
+    def remove(self, prop: str):
+        """
+        Remove the filter of a property, if present.
+
+        :param prop: property name
+        :return:
+        """
+        self.ranges.pop(prop, None)
+
+    def clear(self):
+        """
+        Remove all filters.
+
+        :return:
+        """
+        self.ranges.clear()
+
+    def mask(self, table: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Evaluate the filters on a props table.
+
+        Without filters, all labels are kept.
+        :param table: props table (with a 'label' column)
+        :return: boolean array (same order as table['label']), True = keep
+        """
+        n = len(table["label"])
+        keep_nan = self.combine == "and"
+        masks = [
+            uts.keep_in_range(table[prop], min_value, max_value, keep_nan)
+            for prop, (min_value, max_value) in self.ranges.items()
+        ]
+        if len(masks) == 0:
+            return np.ones(n, dtype=bool)
+        if self.combine == "and":
+            return np.logical_and.reduce(masks)
+        return np.logical_or.reduce(masks)
+
+    def describe(self, decimals: int = 4) -> str:
+        """
+        Human readable description of the filters.
+
+        E.g. 'area: [10, 200] AND solidity: [0.9, 1]'
+        :param decimals: number of decimals of the values
+        :return: str
+        """
+
+        def _format(value):
+            if value is None:
+                return "-"
+            return f"{round(float(value), decimals):g}"
+
+        return f" {self.combine.upper()} ".join(
+            f"{prop}: [{_format(_min)}, {_format(_max)}]"
+            for prop, (_min, _max) in self.ranges.items()
+        )
+
+    def __contains__(self, prop: str) -> bool:
+        return prop in self.ranges
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.ranges))
+
+    def __len__(self) -> int:
+        return len(self.ranges)
+
+    def __repr__(self) -> str:
+        return f"FilterModel({self.describe() or 'no filters'})"
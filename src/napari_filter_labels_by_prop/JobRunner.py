@@ -0,0 +1,195 @@
+import inspect
+from time import monotonic, sleep
+from typing import Callable, Dict, Optional
+
+from napari.qt.threading import GeneratorWorker, create_worker
+from qtpy.QtWidgets import QApplication
+
+from napari_filter_labels_by_prop.ProgressStep import ProgressStep, exhaust
+
+
+class JobRunner:
+    """
+    Runs the long computations of the widget in background threads.
+
+    Jobs have a name (e.g. 'measure'), and a new job supersedes the running
+    job of the same name: the old job is asked to quit, and its result is
+    dropped. The on_done callback is only called (in the main thread) for
+    the current job of a name, so results of superseded jobs are never
+    applied to the widget.
+
+    Jobs should only use their arguments, not the state of the widget,
+    which can change while they run. The long jobs are generators:
+    they can be cancelled at every yield, and the ProgressSteps they yield
+    set the progress bar (see ProgressStep). A cancelled generator is
+    closed in its thread, so it stops right away and cleans up (e.g.
+    shuts its worker pool down). Function jobs can only be dropped, they
+    run until they are done. The other values yielded by generator jobs
+    can be applied with on_yield (e.g. partial results), like the results
+    with on_done.
+
+    With background=False, jobs run right away in the calling thread
+    (e.g. for scripting).
+    """
+
+    def __init__(self, background: bool = True):
+        self.background = background
+        # {name: worker} of the running jobs
+        self._workers: Dict[str, object] = {}
+
+    def submit(
+        self,
+        name: str,
+        func: Callable,
+        *args,
+        on_done: Optional[Callable] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        on_yield: Optional[Callable] = None,
+        desc: Optional[str] = None,
+        total: int = 0,
+        **kwargs,
+    ):
+        """
+        Run a job, superseding the running job of the same name.
+
+        :param name: job name
+        :param func: function or generator function
+        :param args: arguments of func
+        :param on_done: called with the result of func (main thread),
+                        if the job is still the current one
+        :param on_error: called with the exception raised by func (main
+                         thread), default is to raise it
+        :param on_yield: called with every value yielded by a generator
+                         job (main thread), if the job is still current,
+                         except the ProgressSteps
+        :param desc: progress bar description, default is no progress bar
+        :param total: number of yields of a generator job, 0 for an
+                      indeterminate progress bar (or one set by the
+                      ProgressSteps of the job)
+        :param kwargs: keyword arguments of func
+        :return: worker, or None if the job ran in the calling thread
+        """
+        self.cancel(name)
+        if on_error is None:
+            on_error = _raise
+        if not self.background:
+            result = func(*args, **kwargs)
+            if hasattr(result, "__next__"):
+                # Exhaust generator jobs, the result is their return value
+                result = exhaust(result, on_yield)
+            if on_done is not None:
+                on_done(result)
+            return None
+
+        progress = None
+        if desc is not None:
+            progress = {"total": total, "desc": desc}
+        # Errors are handled below (only raised for the current job)
+        worker = create_worker(
+            func,
+            *args,
+            _start_thread=False,
+            _progress=progress,
+            _ignore_errors=True,
+            _worker_class=(
+                _ClosingGeneratorWorker
+                if inspect.isgeneratorfunction(func)
+                else None
+            ),
+            **kwargs,
+        )
+
+        def _is_current():
+            return self._workers.get(name) is worker
+
+        def _returned(result):
+            if _is_current() and on_done is not None:
+                on_done(result)
+
+        def _yielded(value):
+            if isinstance(value, ProgressStep):
+                if worker.pbar is not None:
+                    worker.pbar.total = value.total
+                    worker.pbar.update(value.done - worker.pbar.n)
+            elif _is_current() and on_yield is not None:
+                on_yield(value)
+
+        def _errored(e):
+            if _is_current():
+                on_error(e)
+
+        def _finished():
+            if _is_current():
+                del self._workers[name]
+
+        worker.returned.connect(_returned)
+        worker.errored.connect(_errored)
+        if hasattr(worker, "yielded"):
+            worker.yielded.connect(_yielded)
+        worker.finished.connect(_finished)
+        self._workers[name] = worker
+        worker.start()
+        return worker
+
+    def cancel(self, name: Optional[str] = None):
+        """
+        Cancel a job (or all jobs), its result will not be applied.
+
+        :param name: job name, default is all jobs
+        :return:
+        """
+        names = list(self._workers) if name is None else [name]
+        for n in names:
+            worker = self._workers.pop(n, None)
+            if worker is not None:
+                worker.quit()
+
+    def is_running(self, name: Optional[str] = None) -> bool:
+        """
+        Whether a job (or any job) is running.
+
+        :param name: job name, default is any job
+        :return: bool
+        """
+        if name is None:
+            return len(self._workers) > 0
+        return name in self._workers
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for all jobs (including the ones started by on_done callbacks).
+
+        Processes the Qt events meanwhile, so that the callbacks are called.
+        :param timeout: maximum time in seconds, default no limit
+        :return: True if all jobs are done
+        """
+        app = QApplication.instance()
+        start = monotonic()
+        while self.is_running():
+            if timeout is not None and monotonic() - start >= timeout:
+                return False
+            app.processEvents()
+            sleep(0.001)
+        # Deliver the signals of the last job
+        app.processEvents()
+        return True
+
+
+class _ClosingGeneratorWorker(GeneratorWorker):
+    """
+    Generator worker that closes its generator when it stops.
+
+    GeneratorWorker stops iterating a cancelled generator, which would
+    only be closed when garbage collected (in any thread).
+    """
+
+    def work(self):
+        try:
+            return super().work()
+        finally:
+            # Runs the finally blocks of a cancelled job in its thread
+            self._gen.close()
+
+
+def _raise(e: Exception):
+    raise e
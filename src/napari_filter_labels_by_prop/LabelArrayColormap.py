@@ -0,0 +1,132 @@
+from typing import Union
+
+import numpy as np
+from napari.utils.colormaps import DirectLabelColormap
+from napari.utils.colormaps._accelerated_cmap import (
+    minimum_dtype_for_labels,
+)
+
+
+class LabelArrayColormap(DirectLabelColormap):
+    """
+    Direct labels colormap built from an RGBA array indexed by label.
+
+    napari's DirectLabelColormap maps labels with a dict of {label: color},
+    which is built (and mapped) label by label, and requires numba for
+    label values above 2**16. Here the labels are mapped to the unique
+    colors with an index array instead, so the colormap is vectorised
+    and works for any number of labels. Labels that are transparent or
+    outside of the array are not shown.
+    """
+
+    _label_colors: np.ndarray
+    _texture_map: np.ndarray
+    _texture_colors: np.ndarray
+
+    def __init__(self, label_colors: np.ndarray = None, **kwargs):
+        kwargs.setdefault(
+            "color_dict", {None: "transparent", 0: "transparent"}
+        )
+        super().__init__(**kwargs)
+        if label_colors is None:
+            label_colors = np.zeros((1, 4), dtype=np.float32)
+        self._set_label_colors(np.asarray(label_colors, dtype=np.float32))
+
+    def _set_label_colors(self, label_colors: np.ndarray):
+        """
+        Index the unique colors of the shown labels.
+
+        :param label_colors: RGBA array indexed by label
+        :return:
+        """
+        shown = np.flatnonzero(label_colors[:, 3] > 0)
+        shown = shown[shown != self.background_value]
+        # Unique rows (as bytes, which is faster than np.unique on rows)
+        rows = np.ascontiguousarray(label_colors[shown])
+        _, first, inverse = np.unique(
+            rows.view(np.dtype((np.void, rows.dtype.itemsize * 4))).ravel(),
+            return_index=True,
+            return_inverse=True,
+        )
+        # Texture value 0 is for unknown labels (transparent)
+        self._texture_colors = np.zeros((len(first) + 1, 4), np.float32)
+        self._texture_colors[1:] = rows[first]
+        # One more entry, for labels outside of the array
+        self._texture_map = np.zeros(
+            len(label_colors) + 1,
+            dtype=minimum_dtype_for_labels(self._num_unique_colors + 2),
+        )
+        self._texture_map[shown] = inverse.ravel() + 1
+        self._label_colors = label_colors
+
+    @property
+    def _num_unique_colors(self) -> int:
+        return len(self._texture_colors) - 1
+
+    def _texture_values(self, values: np.ndarray) -> np.ndarray:
+        """
+        Map labels to the index of their color.
+
+        :param values: label array
+        :return: array of texture values (same shape as values)
+        """
+        values = np.clip(values, 0, len(self._texture_map) - 1)
+        return self._texture_map[values]
+
+    def _data_to_texture(
+        self, values: Union[np.ndarray, np.integer]
+    ) -> Union[np.ndarray, np.integer]:
+        """Map labels to the texture values sent to the GPU."""
+        if values.itemsize <= 2:
+            # Small labels are mapped with a lookup texture by napari
+            return super()._data_to_texture(values)
+        if self.use_selection:
+            return (values == self.selection).astype(np.uint8)
+        return self._texture_values(values)
+
+    def _selection_as_minimum_dtype(self, dtype: np.dtype) -> int:
+        return int(self._data_to_texture(dtype.type(self.selection)))
+
+    def _map_without_cache(self, values: np.ndarray) -> np.ndarray:
+        return self._texture_colors[self._texture_values(values)]
+
+    def _values_mapping_to_minimum_values_set(self, apply_selection=True):
+        """
+        Mapping from labels to texture values, and from those to colors.
+
+        Only the colors are used by napari, as the labels are mapped
+        with _data_to_texture.
+        :param apply_selection: whether only the selected label is shown
+        :return: ({None: 0}, {texture value: color})
+        """
+        if self.use_selection and apply_selection:
+            return {self.selection: 1, None: 0}, {
+                0: np.zeros(4),
+                1: self.map(self.selection),
+            }
+        return {None: 0}, dict(enumerate(self._texture_colors))
+
+    def map(self, values: Union[np.ndarray, np.integer, int]) -> np.ndarray:
+        """
+        Map labels to colors.
+
+        :param values: label or label array
+        :return: RGBA array (values.shape + (4,))
+        """
+        values = np.asarray(values)
+        if values.dtype.kind not in "iu":
+            raise TypeError("LabelArrayColormap can only be used with int")
+        mapped = self._map_without_cache(values)
+        if self.use_selection:
+            mapped = np.where(
+                (values == self.selection)[..., None], mapped, 0
+            ).astype(np.float32)
+        return mapped
+
+    def _cmap_without_selection(self) -> "LabelArrayColormap":
+        if self.use_selection:
+            return LabelArrayColormap(
+                self._label_colors,
+                **{**self.model_dump(), "use_selection": False},
+            )
+        return self
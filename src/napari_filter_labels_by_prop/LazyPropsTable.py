@@ -0,0 +1,216 @@
+import threading
+from collections.abc import Mapping
+from types import GeneratorType
+from typing import Callable, Dict, Generator, Iterator, Sequence
+
+import numpy as np
+
+from napari_filter_labels_by_prop.ProgressStep import ProgressStep, exhaust
+
+
+class LazyPropsTable(Mapping):
+    """
+    Column store for props tables, which computes columns on demand.
+
+    Behaves like the dict returned by regionprops_table, but columns can
+    be registered with a loader, which is only called when one of its
+    columns is requested for the first time. The loaded columns are kept.
+    A loader can provide several columns at once (e.g. one per channel).
+
+    Columns can be computed in a background thread while the table is
+    read in the main thread. Loaders run outside of the lock, so the
+    other columns can still be read meanwhile. Loaders can be generator
+    functions that yield ProgressSteps (see iter_compute).
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray] = None):
+        self._keys = []
+        self._columns = {}
+        self._loaders = {}
+        self._lock = threading.Lock()
+        if columns is not None:
+            for k, v in columns.items():
+                self.set_column(k, v)
+
+    def set_column(self, key: str, values: np.ndarray):
+        """
+        Add (or replace) a computed column.
+
+        :param key: column name
+        :param values: column values
+        :return:
+        """
+        with self._lock:
+            if key not in self._keys:
+                self._keys.append(key)
+            self._loaders.pop(key, None)
+            self._columns[key] = values
+
+    def set_lazy(
+        self, keys: Sequence[str], loader: Callable[[], Dict[str, np.ndarray]]
+    ):
+        """
+        Add columns that are computed on first access.
+
+        :param keys: column names provided by the loader
+        :param loader: function returning a dict with (at least) the keys,
+                       or generator function yielding ProgressSteps and
+                       returning the dict
+        :return:
+        """
+        keys = list(keys)
+        with self._lock:
+            for k in keys:
+                if k not in self._keys:
+                    self._keys.append(k)
+                self._columns.pop(k, None)
+                self._loaders[k] = (keys, loader)
+
+    def is_computed(self, key: str) -> bool:
+        """
+        Check whether a column has been computed already.
+
+        :param key: column name
+        :return: boolean
+        """
+        return key in self._columns
+
+    def compute(self, keys: Sequence[str]) -> "LazyPropsTable":
+        """
+        Compute columns that are not computed yet (e.g. in a background job).
+
+        :param keys: column names
+        :return: this table
+        """
+        return exhaust(self.iter_compute(keys))
+
+    def iter_compute(
+        self, keys: Sequence[str]
+    ) -> Generator[ProgressStep, None, "LazyPropsTable"]:
+        """
+        Compute columns step by step (e.g. in a cancellable background job).
+
+        :param keys: column names
+        :return: yields the ProgressSteps of the loaders, returns this table
+        """
+        for k in keys:
+            yield from self._iter_load(k)
+        return self
+
+    def computed(self) -> Dict[str, np.ndarray]:
+        """
+        The columns computed so far, in column order.
+
+        :return: dict of {column: array}
+        """
+        with self._lock:
+            return {
+                k: self._columns[k] for k in self._keys if k in self._columns
+            }
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the computed columns."""
+        with self._lock:
+            columns = list(self._columns.values())
+        return int(sum(np.asarray(v).nbytes for v in columns))
+
+    def renamed(self, prefix: str, exclude: str = "label") -> "LazyPropsTable":
+        """
+        Create a table with prefixed column names (e.g. 'Nucleus: area').
+
+        The new table reads not yet computed columns from this table,
+        so they are still only computed once.
+        :param prefix: str prefix to use
+        :param exclude: single column name to keep as is
+        :return: LazyPropsTable
+        """
+        table = LazyPropsTable()
+        for k in self:
+            new_key = k if k == exclude else f"{prefix}: {k}"
+            table.link(new_key, self, k)
+        return table
+
+    def merge(self, other: Mapping, exclude: str = "label"):
+        """
+        Add the columns of another table.
+
+        :param other: (lazy) props table
+        :param exclude: column of other table to skip
+        :return:
+        """
+        for k in other:
+            if k == exclude:
+                continue
+            if k in self:
+                raise KeyError(f"The dictionary already contains the key {k}.")
+            self.link(k, other, k)
+
+    def link(self, key: str, source: Mapping, source_key: str):
+        """
+        Add a column that is read from another table.
+
+        :param key: column name in this table
+        :param source: (lazy) props table
+        :param source_key: column name in the source table
+        :return:
+        """
+        if not isinstance(source, LazyPropsTable) or source.is_computed(
+            source_key
+        ):
+            self.set_column(key, source[source_key])
+        else:
+
+            def _load():
+                values = yield from source._iter_load(source_key)
+                return {key: values}
+
+            self.set_lazy([key], _load)
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return exhaust(self._iter_load(key))
+
+    def _iter_load(
+        self, key: str
+    ) -> Generator[ProgressStep, None, np.ndarray]:
+        """
+        Get a column, computing it if needed.
+
+        :param key: column name
+        :return: yields the ProgressSteps of the loader, returns the column
+        """
+        with self._lock:
+            if key in self._columns:
+                return self._columns[key]
+            if key not in self._loaders:
+                raise KeyError(key)
+            keys, loader = self._loaders[key]
+        columns = loader()
+        if isinstance(columns, GeneratorType):
+            columns = yield from columns
+        with self._lock:
+            for k in keys:
+                # Unless the column was computed or replaced meanwhile
+                if k in self._loaders and self._loaders[k][1] is loader:
+                    del self._loaders[k]
+                    self._columns[k] = columns[k]
+            return self._columns.get(key, columns[key])
+
+    def __contains__(self, key) -> bool:
+        # Mapping's default would compute the column
+        with self._lock:
+            return key in self._columns or key in self._loaders
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._keys))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        computed = list(self.computed())
+        return (
+            f"LazyPropsTable({len(self)} columns, "
+            f"{len(computed)} computed: {computed})"
+        )
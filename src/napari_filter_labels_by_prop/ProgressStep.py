@@ -0,0 +1,34 @@
+from typing import Callable, Generator, NamedTuple, Optional
+
+
+class ProgressStep(NamedTuple):
+    """
+    Progress of a long computation, yielded by its generator.
+
+    The long computations (e.g. measuring block by block) are generators
+    that yield a ProgressStep per block (or tile, slab, batch of objects)
+    and return their result, so that background jobs can report their
+    progress and be cancelled between two steps (see JobRunner).
+    exhaust runs them to their end, e.g. for scripting.
+    """
+
+    done: int
+    total: int
+
+
+def exhaust(generator: Generator, on_yield: Optional[Callable] = None):
+    """
+    Run a generator to its end.
+
+    :param generator: generator
+    :param on_yield: optional function called with every yielded value,
+                     except the progress steps
+    :return: return value of the generator
+    """
+    try:
+        while True:
+            value = next(generator)
+            if on_yield is not None and not isinstance(value, ProgressStep):
+                on_yield(value)
+    except StopIteration as e:
+        return e.value
@@ -1,13 +1,21 @@
+import importlib.util
+import os
+import tempfile
+from functools import partial
+from typing import Generator, List, Optional, Union
+
 import napari.layers
 import numpy as np
 from matplotlib.backends.backend_qt5agg import (
     FigureCanvasQTAgg as Canvas,
 )
 from matplotlib.figure import Figure
-from napari.utils.colormaps import DirectLabelColormap, label_colormap
-from qtpy.QtCore import Qt
+from napari.utils.colormaps import CyclicLabelColormap, label_colormap
+from qtpy.QtCore import Qt, QTimer
 from qtpy.QtWidgets import (
     QCheckBox,
+    QComboBox,
+    QFileDialog,
     QGridLayout,
     QHBoxLayout,
     QLabel,
@@ -18,6 +26,24 @@ from qtpy.QtWidgets import (
 
 import napari_filter_labels_by_prop.utils as uts
 from napari_filter_labels_by_prop.DoubleSlider import DoubleSlider
+from napari_filter_labels_by_prop.FilterModel import FilterModel
+from napari_filter_labels_by_prop.JobRunner import JobRunner
+from napari_filter_labels_by_prop.LabelArrayColormap import LabelArrayColormap
+from napari_filter_labels_by_prop.ProgressStep import ProgressStep
+from napari_filter_labels_by_prop.StageProfiler import profiler
+
+# Minimum time between two colormap updates while moving a slider (ms),
+# i.e. a live preview with up to 30 updates per second
+__preview_interval__ = 33
+
+# Output targets of Create labels: {name: file extension}, outputs on disk
+# are written chunk by chunk and added as (lazily loaded) layers
+__output_targets__ = {
+    "In memory": None,
+    "Memory-mapped file (.npy)": ".npy",
+}
+if importlib.util.find_spec("zarr") is not None:
+    __output_targets__["Zarr store (.zarr)"] = ".zarr"
 
 
 class PropFilter(QWidget):
@@ -37,17 +63,50 @@ class PropFilter(QWidget):
         self.layer = None
         self.prop = None
         self.original_colormap = None
-        self.color_dict = None
+        # RGBA array indexed by label ID (row 0 is the background)
+        self.label_colors = None
         # Cell and cyto masks created in the filter_by_widget
         self.cell_img = None
         self.cyto_img = None
-        # Dictionary for labels with value: 0 for hidden or label # for shown
-        self.labels_to_hide_dict = {}
+        # Boolean array (same order as props_table["label"]), True = shown
+        self.keep = None
+        # Frame shown in the viewer, for time-lapse tables (with a 'frame'
+        # column), whose label colors are shown for this frame
+        self.frame = None
+        # Filters on several properties, which together define self.keep
+        self.filter_model = FilterModel()
+        # Avoids filter updates while the sliders are set up for a property
+        self._setting_sliders = False
+        # Live preview while moving the sliders: slider changes start the
+        # timer (if not running), so changes within an interval are merged
+        # into one colormap update (see update_min and update_max)
+        self.preview_timer = QTimer()
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(__preview_interval__)
+        self.preview_timer.timeout.connect(self.update_color_map)
+        # Colormap set by apply_label_colors (to skip unchanged updates)
+        self._colormap = None
+        # Background jobs (label creation)
+        self.jobs = JobRunner()
+        # Number of threads for creating the new label images
+        self.n_workers = os.cpu_count() or 1
         self.relabel_ckb = QCheckBox("")
         relabel_tip = (
             "Re-labels the objects, instead of keeping the same label IDs."
         )
         self.relabel_ckb.setToolTip(relabel_tip)
+        # Output target of the new label images, and folder of the
+        # outputs on disk
+        self.output_combobox = QComboBox()
+        self.output_combobox.addItems(list(__output_targets__))
+        self.output_combobox.setToolTip(
+            "Create the labels in memory, or on disk for images that do "
+            "not fit into memory."
+        )
+        self.output_dir = tempfile.gettempdir()
+        self.output_btn = QPushButton("Folder")
+        self.output_btn.setToolTip(f"Output folder: {self.output_dir}")
+        self.output_btn.clicked.connect(self.choose_output_dir)
 
         # Sliders
         self.min_slider = DoubleSlider()
@@ -62,6 +121,28 @@ class PropFilter(QWidget):
         self.ax = self.histo_canvas.figure.subplots()
         self.ax.axis("off")  # makes plot all white (hiding axes)
         self.barplot = None
+        # Histogram (counts, bin edges) per property of the props_table
+        self.histo_cache = {}
+        # Slider positions are drawn as lines over the histogram,
+        # which are updated by blitting (on the background of the plot)
+        self.min_line = None
+        self.max_line = None
+        self.histo_background = None
+        self.histo_canvas.mpl_connect("draw_event", self.on_histo_draw)
+
+        # Combination of the property filters, and reset button
+        self.combine_label = QLabel("Combine filters")
+        self.combine_combobox = QComboBox()
+        self.combine_combobox.addItems(["AND", "OR"])
+        self.combine_combobox.setToolTip(
+            "Keep labels matching all (AND) or any (OR) property filters."
+        )
+        self.combine_combobox.currentTextChanged.connect(self.on_combine)
+        self.reset_btn = QPushButton("Reset filters")
+        self.reset_btn.setToolTip("Remove the filters of all properties.")
+        self.reset_btn.clicked.connect(self.reset_filters)
+        self.filters_info = QLabel("")
+        self.filters_info.setWordWrap(True)
 
         # Create new label layer button
         self.create_btn = QPushButton("Create Labels")
@@ -73,7 +154,23 @@ class PropFilter(QWidget):
         self.layout.addWidget(self.histo_canvas, Qt.AlignHCenter)
         # 2) add sliders for adjusting min and max values
         self.setup_sliders()
-        # 3) add create new label layer button and checkbox for optional re-labelling
+        # and the filter combination
+        filters_widget = QWidget()
+        filters_widget.setLayout(QHBoxLayout())
+        filters_widget.layout().addWidget(self.combine_label)
+        filters_widget.layout().addWidget(self.combine_combobox)
+        filters_widget.layout().addStretch()
+        filters_widget.layout().addWidget(self.reset_btn)
+        self.layout.addWidget(filters_widget)
+        self.layout.addWidget(self.filters_info)
+        # 3) add the output target selection
+        output_widget = QWidget()
+        output_widget.setLayout(QHBoxLayout())
+        output_widget.layout().addWidget(QLabel("Output"))
+        output_widget.layout().addWidget(self.output_combobox)
+        output_widget.layout().addWidget(self.output_btn)
+        self.layout.addWidget(output_widget)
+        # 4) add create new label layer button and checkbox for optional re-labelling
         create_widget = QWidget()
         create_widget.setLayout(QHBoxLayout())
         create_widget.layout().addWidget(self.create_btn)
@@ -96,39 +193,77 @@ class PropFilter(QWidget):
         self.cell_img = cells
         self.cyto_img = cyto
 
+    @profiler.stage("histogram")
     def update_histo(self):
         """
         Updates the histogram plot in the widget.
 
+        The histogram counts are computed once per property (with a
+        bounded number of bins, see utils.histogram) and drawn as a single
+        step artist, so the plot does not depend on the number of labels.
         :return:
         """
-        values = self.props_table[self.prop]
-        # show log y-axis if min/max values difference > 100
-        # print("values min =", values.min(), "values max=", values.max())
-        counts, bins = np.histogram(values)
+        if self.prop not in self.histo_cache:
+            self.histo_cache[self.prop] = uts.histogram(
+                self.props_table[self.prop]
+            )
+        counts, bins = self.histo_cache[self.prop]
+        profiler.annotate(n_objects=len(self.props_table["label"]))
+        # show log y-axis if min/max counts difference > 100
         do_log = counts.max() - counts.min() > 100
+        self.ax.clear()
         self.ax.axis("on")
-        if self.barplot is None:
-            self.barplot = self.ax.hist(
-                x=values,
-                bins=len(self.props_table["label"]),
-                histtype="stepfilled",
-                log=do_log,
-            )
-        else:
-            self.ax.clear()
-            self.barplot = self.ax.hist(
-                x=values,
-                bins=len(self.props_table["label"]),
-                histtype="stepfilled",
-                log=do_log,
-            )
+        if do_log:
+            self.ax.set_yscale("log")
+            # empty bins cannot be shown on a log axis
+            counts = np.where(counts > 0, counts, np.nan)
+        self.barplot = self.ax.stairs(
+            counts, bins, fill=True, baseline=0.5 if do_log else 0
+        )
+        # Slider position lines (drawn in on_histo_draw)
+        self.min_line = self.ax.axvline(
+            self.min_slider.value(), color="k", lw=1, animated=True
+        )
+        self.max_line = self.ax.axvline(
+            self.max_slider.value(), color="k", lw=1, animated=True
+        )
 
         # Remove ticks from y-axis
         self.ax.set_yticks([])
+        self.ax.set_yticks([], minor=True)
         # update the canvas
         self.histo_canvas.draw()
 
+    def on_histo_draw(self, event=None):
+        """
+        Keep the plot background after a full canvas draw.
+
+        Used for blitting the slider position lines.
+        :param event: matplotlib draw event
+        :return:
+        """
+        self.histo_background = self.histo_canvas.copy_from_bbox(self.ax.bbox)
+        for line in (self.min_line, self.max_line):
+            if line is not None:
+                self.ax.draw_artist(line)
+
+    def update_histo_lines(self):
+        """
+        Move the slider position lines, without redrawing the histogram.
+
+        :return:
+        """
+        if self.histo_background is None or self.min_line is None:
+            return
+        self.histo_canvas.restore_region(self.histo_background)
+        for line, slider in (
+            (self.min_line, self.min_slider),
+            (self.max_line, self.max_slider),
+        ):
+            line.set_xdata([slider.value(), slider.value()])
+            self.ax.draw_artist(line)
+        self.histo_canvas.blit(self.ax.bbox)
+
     def update_property(self, prop: str):
         """
         Called when property is selected.
@@ -147,7 +282,7 @@ class PropFilter(QWidget):
         # Make sure to show the widget
         self.show_widget()
 
-        # Create histogram
+        # Create histogram (from the cache, if shown before)
         self.update_histo()
 
         # Update sliders
@@ -164,17 +299,28 @@ class PropFilter(QWidget):
         prop_values = self.props_table[self.prop]
 
         # For sliders the values should be of type int - not anymore since Double slider
-        _min = prop_values.min()
-        _max = prop_values.max()
+        # (NaN values, e.g. of empty cytoplasm, are ignored)
+        _min = np.nanmin(prop_values)
+        _max = np.nanmax(prop_values)
+        self._setting_sliders = True
         self.min_slider.setRange(_min, _max)
         self.max_slider.setRange(_min, _max)
+        # Restore the filter of this property, if it has one
+        prop_range = self.filter_model.get_range(self.prop)
+        if prop_range is not None:
+            _min, _max = prop_range
         self.min_slider.setValue(_min)
         self.max_slider.setValue(_max)
         # Make sure to update also the min/max value display
         self.update_min()
         self.update_max()
+        self._setting_sliders = False
         # Reset layer colormap
-        self.update_color_map()
+        if prop_range is None:
+            self.update_color_map()
+        else:
+            # keep the exact filter values (not rounded by the sliders)
+            self.update_filters()
 
     def update_widget(
         self,
@@ -197,26 +343,126 @@ class PropFilter(QWidget):
         self.layer = layer
         self.props_table = props_table
         self.prop = prop
+        # Histograms and filters of a previous table are not valid anymore
+        self.preview_timer.stop()
+        self.histo_cache.clear()
+        self.filter_model.clear()
 
         # remember the origianl colormap
         self.original_colormap = self.layer.colormap
-        # Create custom 'original' LUT / colormap
-        n_labels = self.layer.data.max() + 1
-        colormap = label_colormap(num_colors=n_labels)
-        color_dict = dict(enumerate(colormap.colors[1:n_labels], start=1))
-        color_dict[None] = "transparent"
-        color_dict[0] = "transparent"
-        colormap = DirectLabelColormap(color_dict=color_dict)
-        self.color_dict = colormap.color_dict
+        self.init_label_colors()
+        self.keep = np.ones(len(self.props_table["label"]), dtype=bool)
         # Apply the custom colormap to the labels layer
-        self.layer.colormap = colormap
+        self.apply_label_colors()
 
         # show the widget
         self.show_widget()
+        self.update_histo()
 
         # Update sliders
         self.update_sliders()
 
+    def update_table(self, props_table: dict):
+        """
+        Replace the props table, keeping the property and its filters.
+
+        E.g. when more frames of a time-lapse have been measured.
+        :param props_table: (dict) props table with the same columns
+        :return:
+        """
+        self.props_table = props_table
+        self.preview_timer.stop()
+        self.histo_cache.clear()
+        # Labels may have been added
+        self.init_label_colors()
+        self._colormap = None
+        self.update_histo()
+        # Evaluates the filters on the new table
+        self.update_sliders()
+
+    def update_rows(self, props_table: dict, labels: np.ndarray):
+        """
+        Replace the props table after some labels were measured again.
+
+        E.g. after painting: the cached histograms are patched with the
+        values of the labels (see utils.patch_histogram), and the filters
+        are evaluated on the new table, keeping the property and its
+        filters.
+        :param props_table: (dict) props table with the same columns
+        :param labels: labels with changed, new or removed rows
+        :return:
+        """
+        old_table = self.props_table
+        self.props_table = props_table
+        self.preview_timer.stop()
+        old_rows = np.isin(old_table["label"], labels)
+        new_rows = np.isin(props_table["label"], labels)
+        for prop, (counts, bins) in list(self.histo_cache.items()):
+            histo = uts.patch_histogram(
+                counts,
+                bins,
+                removed=np.asarray(old_table[prop])[old_rows],
+                added=np.asarray(props_table[prop])[new_rows],
+            )
+            if histo is None:
+                # Computed again when shown
+                del self.histo_cache[prop]
+            else:
+                self.histo_cache[prop] = histo
+        # Only new label values beyond the colors need new colors
+        if int(props_table["label"].max()) >= len(self.label_colors):
+            self.init_label_colors()
+            self._colormap = None
+        else:
+            # Erased labels are transparent (like unknown label IDs)
+            erased = labels[~np.isin(labels, props_table["label"])]
+            self.label_colors[erased, 3] = 0
+            self._colormap = None
+        self.update_histo()
+        # Evaluates the filters on the new table
+        self.update_sliders()
+
+    def init_label_colors(self):
+        """
+        Create the custom 'original' LUT as RGBA array indexed by label.
+
+        Label IDs that are not in the table (e.g. newly painted labels)
+        are transparent. Cyclic colormaps map IDs beyond their colors back
+        onto the first colors, so the LUT has 2**16 - 1 colors at least (the
+        most napari supports), i.e. IDs up to 2**16 - 2 are transparent
+        until they are measured.
+        :return:
+        """
+        # (the max label is known from the table, no need to scan the data)
+        max_label = int(self.props_table["label"].max())
+        # napari colormaps hold max 2**16 - 1 colors, cycle them for more
+        colormap = label_colormap(num_colors=min(max_label + 1, 2**16 - 1))
+        n_colors = len(colormap.colors) - 1
+        n_labels = max(max_label + 1, 2**16 - 1)
+        self.label_colors = np.zeros((n_labels, 4), dtype=np.float32)
+        self.label_colors[1:] = colormap.colors[
+            (np.arange(n_labels - 1) % n_colors) + 1
+        ]
+        self.label_colors[:, 3] = 0
+        self.label_colors[self.props_table["label"], 3] = 1
+
+    def set_frame(self, frame: int):
+        """
+        Show the filtered labels of another time-lapse frame.
+
+        :param frame: frame index
+        :return:
+        """
+        self.frame = frame
+        if (
+            self.layer is None
+            or self.props_table is None
+            or self.keep is None
+            or "frame" not in self.props_table
+        ):
+            return
+        self.show_kept()
+
     def hide_widget(self, clear: bool = False):
         """
         Hides the widget and it's content.
@@ -225,9 +471,13 @@ class PropFilter(QWidget):
                     plot cannot easily be hidden.
         :return:
         """
+        self.preview_timer.stop()
         if clear:
             # and clear the canvas (remove plot bars)
             self.ax.clear()
+            self.barplot = None
+            self.min_line = None
+            self.max_line = None
         # 'hide' histogram - makes it all white
         self.ax.axis("off")
         self.min_slider.setVisible(False)
@@ -237,6 +487,9 @@ class PropFilter(QWidget):
         self.min_label.setHidden(True)
         self.max_label.setHidden(True)
         self.create_btn.setDisabled(True)
+        self.combine_combobox.setDisabled(True)
+        self.reset_btn.setDisabled(True)
+        self.filters_info.setHidden(True)
         # Reset colormap
         if self.layer is not None:
             self.layer.colormap = self.original_colormap
@@ -254,7 +507,9 @@ class PropFilter(QWidget):
         self.min_label.setHidden(False)
         self.max_label.setHidden(False)
         self.create_btn.setDisabled(False)
-        self.update_histo()
+        self.combine_combobox.setDisabled(False)
+        self.reset_btn.setDisabled(False)
+        self.filters_info.setHidden(False)
 
     def on_min_slider_release(self):
         """
@@ -262,6 +517,7 @@ class PropFilter(QWidget):
 
         :return:
         """
+        self.preview_timer.stop()
         self.update_color_map()
 
     def on_max_slider_release(self):
@@ -270,46 +526,124 @@ class PropFilter(QWidget):
 
         :return:
         """
+        self.preview_timer.stop()
         self.update_color_map()
 
+    def schedule_preview(self):
+        """
+        Update the colormap preview at most once per preview interval.
+
+        Slider changes while the timer runs are merged, the update uses
+        the slider values at the time it runs.
+        :return:
+        """
+        if self._setting_sliders or self.props_table is None:
+            return
+        if not self.preview_timer.isActive():
+            self.preview_timer.start()
+
     def update_color_map(self):
         """
-        Modify the color_dict and create new colormap for labels layer.
+        Update the label alphas and refresh the labels layer colormap.
 
-        Sets the alpha of labels to hide or show to 0 or 1, respectively.
-        New colormap is generated each time.
+        The slider range is set as filter of the selected property
+        (or removed, if the sliders cover the whole range), and all filters
+        are evaluated (see FilterModel.mask).
+        Sets the alpha of labels to hide or show to 0 or 1, respectively,
+        in the label_colors array.
         :return:
         """
-        self.labels_to_hide_dict.clear()
+        if self._setting_sliders:
+            return
         _min = self.min_slider.value()
         _max = self.max_slider.value()
-        label_values = self.props_table[self.prop]
-        labels = self.props_table["label"]
-        for i in range(len(label_values)):
-            if label_values[i] < _min or label_values[i] > _max:
-                self.labels_to_hide_dict[labels[i]] = 0
-            else:
-                self.labels_to_hide_dict[labels[i]] = labels[i]
-
-        # Ignore the color_dict 'None' and '0' keys
-        for k, v in self.color_dict.items():
-            # skip color_dict labels that do not exist in the label image
-            if k not in self.labels_to_hide_dict:
-                continue
-            if self.labels_to_hide_dict[k] == 0:
-                v[3] = 0.0
-            else:
-                v[3] = 1.0
-        # Create and apply the colormap
-        colormap = DirectLabelColormap(color_dict=self.color_dict)
+        if (
+            _min <= self.min_slider.minimum()
+            and _max >= self.max_slider.maximum()
+        ):
+            self.filter_model.remove(self.prop)
+        else:
+            self.filter_model.set_range(self.prop, _min, _max)
+        self.update_filters()
+
+    @profiler.stage("colormap")
+    def update_filters(self):
+        """
+        Evaluate all property filters and update the labels layer colormap.
+
+        :return:
+        """
+        profiler.annotate(n_objects=len(self.props_table["label"]))
+        self.filters_info.setText(self.filter_model.describe())
+        # NaN values stay visible with AND, and are neutral with OR
+        self.keep = self.filter_model.mask(self.props_table)
+        self.show_kept()
+
+    def show_kept(self):
+        """
+        Show the kept labels (self.keep) in the labels layer colormap.
+
+        Only the alphas of labels that changed visibility are updated,
+        and the colormap is not rebuilt if no label changed.
+        For time-lapse tables, the labels of the current frame are shown.
+        :return:
+        """
+        rows = uts.frame_rows(self.props_table, self.frame)
+        labels = self.props_table["label"][rows]
+        keep = self.keep[rows]
+        changed = self.label_colors[labels, 3] != keep
+        if not changed.any() and self.layer.colormap is self._colormap:
+            return
+        self.label_colors[labels[changed], 3] = keep[changed]
+        self.apply_label_colors()
+
+    def on_combine(self, text: str):
+        """
+        Change how the property filters are combined (AND or OR).
+
+        :param text: 'AND' or 'OR'
+        :return:
+        """
+        self.filter_model.combine = text
+        if self.layer is not None and self.props_table is not None:
+            self.update_filters()
+
+    def reset_filters(self):
+        """
+        Remove the filters of all properties.
+
+        :return:
+        """
+        self.filter_model.clear()
+        if self.layer is not None and self.prop is not None:
+            self.update_sliders()
+
+    @profiler.stage("render")
+    def apply_label_colors(self):
+        """
+        Refresh the labels layer colormap from the label_colors array.
+
+        A CyclicLabelColormap with one color per label ID maps every label
+        onto its own color, so it can be built directly from the array.
+        napari limits those to 2**16 - 1 colors, for more labels the array
+        is indexed by a LabelArrayColormap.
+        :return:
+        """
+        if len(self.label_colors) < 2**16:
+            colormap = CyclicLabelColormap(
+                colors=self.label_colors, background_value=0
+            )
+        else:
+            colormap = LabelArrayColormap(self.label_colors)
         self.layer.colormap = colormap
+        self._colormap = colormap
 
     def update_min(self):
         """
         Updates on changes on the min_slider on value change.
 
-        Will update only the self.min field
-        Will update the color map if there is less than 100 labels.
+        Will update only the self.min field, and the colormap preview
+        (see schedule_preview).
         :return:
         """
         # Make sure that the value is not bigger than the max slider value
@@ -320,15 +654,15 @@ class PropFilter(QWidget):
             self.min.setText(str(round(self.min_slider.value(), 4)))
         else:
             self.min.setText(str(self.min_slider.value()))
-        if len(self.props_table[self.prop]) < 100:
-            self.update_color_map()
+        self.update_histo_lines()
+        self.schedule_preview()
 
     def update_max(self):
         """
         Updates on changes on the max_slider on value change.
 
-        Will update only the self.max field.
-        Will update the color map if there is less than 100 labels.
+        Will update only the self.max field, and the colormap preview
+        (see schedule_preview).
         :return:
         """
         # Make sure that the value is not smaller than the min slider value
@@ -338,53 +672,211 @@ class PropFilter(QWidget):
         if isinstance(_max, float):
             self.max.setText(str(round(self.max_slider.value(), 4)))
         else:
-            self.max.setText(str(self.max_slider.value(), 4))
-        if len(self.props_table[self.prop]) < 100:
-            self.update_color_map()
+            self.max.setText(str(self.max_slider.value()))
+        self.update_histo_lines()
+        self.schedule_preview()
 
     def create_labels(self):
         """
         Final function to create new labels layer.
 
+        The label images are created in the background ('create' job),
+        and added to the viewer when they are done.
         :return:
         """
-        # Create new label image
-        new_labels = uts.remove_labels(
-            img=self.layer.data,
-            label_map=self.labels_to_hide_dict,
-            relabel=self.relabel_ckb.isChecked(),
-        )
-        # Add it to the viewer
-        self.viewer.add_labels(
-            new_labels,
-            name=self.layer.name + "_1",
-            multiscale=False,
-            scale=self.layer.scale,
-        )
-        # Create new cell and cyto mask images
-        if self.cell_img is not None:
-            new_cells = uts.remove_labels(
-                img=self.cell_img,
-                label_map=self.labels_to_hide_dict,
+        if "frame" in self.props_table:
+            # Time-lapse: one lookup table per frame
+            lut = uts.frame_luts(
+                self.props_table["frame"],
+                self.props_table["label"],
+                self.keep,
                 relabel=self.relabel_ckb.isChecked(),
             )
-            new_cyto = uts.remove_labels(
-                img=self.cyto_img,
-                label_map=self.labels_to_hide_dict,
+        else:
+            # One lookup table for all outputs, so that relabelled
+            # nuclei, cells and cytoplasm keep matching label values
+            lut = uts.label_lut(
+                self.props_table["label"],
+                self.keep,
                 relabel=self.relabel_ckb.isChecked(),
             )
-            # Add them to the viewer
-            self.viewer.add_labels(
-                new_cells,
-                name=self.layer.name + "_1-Cells",
-                multiscale=False,
+        images = [self.layer.data]
+        measured = None
+        if self.layer.multiscale:
+            # All levels are filtered (at their resolution), labels that
+            # are not on the measured level are kept
+            images = [list(self.layer.data)]
+            measured = self.props_table["label"]
+        if self.cell_img is not None:
+            images += [self.cell_img, self.cyto_img]
+        self.jobs.submit(
+            "create",
+            self.create_label_images,
+            images,
+            lut,
+            n_kept=int(np.count_nonzero(self.keep)),
+            paths=self.output_paths(images),
+            measured=measured,
+            relabel=self.relabel_ckb.isChecked(),
+            on_done=partial(
+                self.add_label_layers,
+                name=self.layer.name,
                 scale=self.layer.scale,
-            )
+            ),
+            desc="Creating labels",
+        )
+
+    def choose_output_dir(self):
+        """
+        Choose the folder of the outputs on disk.
+
+        :return:
+        """
+        path = QFileDialog.getExistingDirectory(
+            self, "Output folder", self.output_dir
+        )
+        if path:
+            self.output_dir = path
+            self.output_btn.setToolTip(f"Output folder: {self.output_dir}")
+
+    def output_paths(self, images: list) -> list:
+        """
+        File paths of the new label images, for the selected output target.
+
+        :param images: label images (labels, and cells, cyto masks),
+                       multiscale images as list of levels
+        :return: list of paths (lists for multiscale images), None for
+                 outputs in memory
+        """
+        ext = __output_targets__[self.output_combobox.currentText()]
+        suffixes = ["_1", "_1-Cells", "_1-Cytoplasm"]
+        paths = []
+        for img, suffix in zip(images, suffixes):
+            name = os.path.join(self.output_dir, self.layer.name + suffix)
+            if ext is None:
+                path = None
+            elif isinstance(img, list):
+                path = [
+                    uts.unique_path(f"{name}-level{i}{ext}")
+                    for i in range(len(img))
+                ]
+            else:
+                path = uts.unique_path(name + ext)
+            paths.append(path)
+        return paths
+
+    def create_label_images(
+        self,
+        images: list,
+        lut: Union[np.ndarray, dict],
+        n_kept: int = None,
+        paths: Optional[List[Optional[Union[str, list]]]] = None,
+        measured: Optional[np.ndarray] = None,
+        relabel: bool = False,
+    ) -> Generator[ProgressStep, None, list]:
+        """
+        Create the new label images with a lookup table (generator job).
+
+        Outputs on disk are written chunk by chunk, so only a chunk per
+        thread (and the lookup table) is held in memory. A ProgressStep
+        is yielded per slab (or frame of every time-lapse image).
+        :param images: label images (labels, and cells, cyto masks),
+                       multiscale images as list of levels
+        :param lut: lookup table, see utils.label_lut, or dict of
+                    {frame: lookup table} for time-lapses
+        :param n_kept: number of kept labels (for the profiler)
+        :param paths: output files (one per image, lists for multiscale),
+                      see utils.create_output, default all in memory
+        :param measured: measured label values, to keep the labels of
+                         multiscale images that were not measured (see
+                         utils.keep_unmeasured), default is to remove them
+        :param relabel: whether lut relabels sequentially
+        :return: yields ProgressSteps, returns list of new label images
+                 (lists of levels for multiscale)
+        """
+        with profiler.stage("create"):
+            profiler.annotate(n_objects=n_kept)
+            if measured is not None and not isinstance(lut, dict):
+                # (the full resolution level has the largest label values)
+                lut = uts.keep_unmeasured(
+                    lut,
+                    measured,
+                    max(
+                        uts.max_label(img[0] if isinstance(img, list) else img)
+                        for img in images
+                    ),
+                    relabel=relabel,
+                )
+            if paths is None:
+                paths = [None] * len(images)
+            # The levels of multiscale images are mapped like single images
+            levels = [
+                img if isinstance(img, list) else [img] for img in images
+            ]
+            flat = [level for img_levels in levels for level in img_levels]
+            flat_paths = [
+                p
+                for img, path in zip(levels, paths)
+                for p in (
+                    path if isinstance(path, list) else [path] * len(img)
+                )
+            ]
+            frames = isinstance(lut, dict)
+            dtype = next(iter(lut.values())).dtype if frames else lut.dtype
+            # Chunks of one frame, or of one slab (see utils.apply_lut_many)
+            outs = [
+                uts.create_output(
+                    np.shape(img),
+                    dtype,
+                    path=path,
+                    chunks=(1 if frames else uts.slab_step(img),)
+                    + tuple(np.shape(img)[1:]),
+                )
+                for img, path in zip(flat, flat_paths)
+            ]
+            with profiler.stage("apply_lut"):
+                if frames:
+                    for i, img in enumerate(flat):
+                        outs[i] = yield from uts.iter_apply_frame_luts(
+                            img, lut, out=outs[i], n_workers=self.n_workers
+                        )
+                else:
+                    # Slabs of all images (and levels) in parallel
+                    outs = yield from uts.iter_apply_lut_many(
+                        flat, lut, outs=outs, n_workers=self.n_workers
+                    )
+            for out in outs:
+                if hasattr(out, "flush"):
+                    out.flush()
+            new_images = []
+            for img, img_levels in zip(images, levels):
+                new_levels, outs = (
+                    outs[: len(img_levels)],
+                    outs[len(img_levels) :],
+                )
+                new_images.append(
+                    new_levels if isinstance(img, list) else new_levels[0]
+                )
+            return new_images
+
+    @profiler.stage("add_layers")
+    def add_label_layers(self, new_images: list, name: str, scale=None):
+        """
+        Add the new label images to the viewer.
+
+        :param new_images: new labels (and cell and cyto masks),
+                           multiscale labels as list of levels
+        :param name: name of the original labels layer
+        :param scale: layer scale
+        :return:
+        """
+        suffixes = ["_1", "_1-Cells", "_1-Cytoplasm"]
+        for img, suffix in zip(new_images, suffixes):
             self.viewer.add_labels(
-                new_cyto,
-                name=self.layer.name + "_1-Cytoplasm",
-                multiscale=False,
-                scale=self.layer.scale,
+                img,
+                name=name + suffix,
+                multiscale=isinstance(img, list),
+                scale=scale,
             )
 
     def setup_sliders(self):
@@ -0,0 +1,474 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Sequence
+
+import numpy as np
+
+from napari_filter_labels_by_prop import __version__
+
+# Environment variable with the folder of the disk cache (see
+# default_cache_dir), an empty value disables the disk cache
+__cache_dir_env__ = "NAPARI_FILTER_LABELS_CACHE_DIR"
+
+# Version of the disk cache files and of the measured values: increase it
+# when the file format or the measurements change, so that older files are
+# not used anymore (the plugin version does not change in development)
+__cache_format__ = 1
+
+# Fingerprints of numpy arrays with a data version (see fingerprint):
+# {id(array): (weak reference to the array, version, fingerprint)}
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def default_cache_dir() -> Optional[str]:
+    """
+    Folder of the disk cache of the widget.
+
+    Read from the NAPARI_FILTER_LABELS_CACHE_DIR environment variable,
+    default is ~/.cache/napari-filter-labels-by-prop.
+
+    :return: folder path, or None if the disk cache is disabled
+    """
+    path = os.environ.get(__cache_dir_env__)
+    if path is None:
+        path = os.path.join(
+            os.path.expanduser("~"), ".cache", "napari-filter-labels-by-prop"
+        )
+    return path or None
+
+
+def fingerprint(data, version: Optional[Hashable] = None) -> Optional[str]:
+    """
+    Create a fingerprint of array data.
+
+    numpy arrays are hashed by content, so in-place modifications
+    (e.g. painting labels) result in a different fingerprint.
+    With a version (e.g. a counter of the changes of a layer's data),
+    the fingerprint of a numpy array is hashed once and reused for the
+    same array object and version.
+    Lazy arrays are not read: dask arrays have a deterministic name
+    (a hash of their task graph), for other chunked arrays (e.g. zarr)
+    the store location is used (see _store_fingerprint).
+
+    :param data: array-like or None
+    :param version: version of the array data, None to always hash it
+    :return: hex string, or None if data is None
+    """
+    if data is None:
+        return None
+    memo = version is not None and isinstance(data, np.ndarray)
+    if memo:
+        with _fingerprints_lock:
+            ref, memo_version, digest = _fingerprints.get(
+                id(data), (None, None, None)
+            )
+        if ref is not None and ref() is data and memo_version == version:
+            return digest
+    digest = _fingerprint(data)
+    if memo:
+        key = id(data)
+        ref = weakref.ref(data, lambda _: _forget_fingerprint(key))
+        with _fingerprints_lock:
+            _fingerprints[key] = (ref, version, digest)
+    return digest
+
+
+def _forget_fingerprint(key: int):
+    """
+    Remove the fingerprint of a deleted array (see fingerprint).
+
+    :param key: id of the array
+    :return:
+    """
+    with _fingerprints_lock:
+        entry = _fingerprints.get(key)
+        if entry is not None and entry[0]() is None:
+            del _fingerprints[key]
+
+
+def _fingerprint(data) -> str:
+    """
+    Hash array data, see fingerprint.
+
+    :param data: array-like
+    :return: hex string
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((type(data).__name__, data.shape, str(data.dtype))).encode())
+    if isinstance(data, np.ndarray):
+        h.update(np.ascontiguousarray(data).data)
+    elif hasattr(data, "dask"):
+        h.update(str(data.name).encode())
+    else:
+        h.update(_store_fingerprint(data).encode())
+    return h.hexdigest()
+
+
+def _store_fingerprint(data) -> str:
+    """
+    Describe a chunked array (e.g. zarr) by its storage location.
+
+    Arrays in a local folder are identified by the folder, and the
+    latest modification time, number and size of the files in the
+    folder of the array (i.e. the same in another session, until the
+    chunks are written again). Only the files are listed, not read.
+    Other arrays (e.g. in memory or remote stores) are only identified
+    within the session.
+
+    :param data: chunked array
+    :return: str
+    """
+    store = getattr(data, "store", None)
+    path = str(getattr(data, "path", "") or "")
+    # zarr 2 (DirectoryStore.path) and zarr 3 (LocalStore.root)
+    root = getattr(store, "path", None) or getattr(store, "root", None)
+    if root is None or not os.path.isdir(str(root)):
+        return str((repr(store), path, id(data)))
+    folder = os.path.join(os.path.abspath(str(root)), path)
+    mtime, n_files, size = os.stat(folder).st_mtime_ns, 0, 0
+    for dir_path, _, names in os.walk(folder):
+        for name in names:
+            stat = os.stat(os.path.join(dir_path, name))
+            mtime = max(mtime, stat.st_mtime_ns)
+            n_files += 1
+            size += stat.st_size
+    return str((folder, mtime, n_files, size))
+
+
+def table_nbytes(table: Dict[str, np.ndarray]) -> int:
+    """
+    Memory used by the arrays of a props table.
+
+    :param table: dict of {property: array}
+    :return: number of bytes
+    """
+    # Only count the computed columns of lazy tables
+    if hasattr(table, "computed"):
+        table = table.computed()
+    return int(sum(np.asarray(v).nbytes for v in table.values()))
+
+
+class PropsCache:
+    """
+    Least-recently-used cache of property tables.
+
+    The total size of the cached tables is limited by max_bytes, the least
+    recently used tables are removed first.
+    Hits and misses are counted for diagnostics (see info).
+    The cache can be used from background threads (e.g. measurement jobs).
+
+    With a cache_dir, the computed columns of the tables are also kept on
+    disk (one compressed .npz file per key, with a metadata header), so
+    they can be loaded in another session (see load). The files are
+    removed least recently used first, when they exceed max_disk_bytes.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 512 * 2**20,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: int = 2 * 2**30,
+    ):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._tables = OrderedDict()
+        # {key: column names} of the tables on disk, for the tables in
+        # memory that are kept on disk (see sync)
+        self._saved = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def make_key(
+        lbl,
+        intensity_image=None,
+        voxel_size: Optional[Sequence[float]] = None,
+        properties: Sequence[str] = (),
+        extra_properties: Optional[Sequence[Callable]] = None,
+        versions: Optional[Sequence[Hashable]] = None,
+    ) -> tuple:
+        """
+        Create a cache key for a measurement.
+
+        :param lbl: label image
+        :param intensity_image: intensity image or None
+        :param voxel_size: (Z)YX voxel size
+        :param properties: measured properties
+        :param extra_properties: extra property functions
+        :param versions: data versions of lbl and intensity_image, to
+                         reuse their fingerprints (see fingerprint),
+                         default is to hash the data
+        :return: tuple key
+        """
+        extra = tuple(f.__name__ for f in extra_properties or ())
+        voxel = None if voxel_size is None else tuple(map(float, voxel_size))
+        lbl_version, img_version = versions or (None, None)
+        return (
+            fingerprint(lbl, lbl_version),
+            fingerprint(intensity_image, img_version),
+            voxel,
+            tuple(properties),
+            extra,
+        )
+
+    def get(self, key: Hashable) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Get a cached table (and mark it as recently used).
+
+        :param key: cache key
+        :return: table or None
+        """
+        with self._lock:
+            if key not in self._tables:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._tables.move_to_end(key)
+            # Lazy tables may have grown since they were added
+            self._evict()
+            return self._tables[key]
+
+    def put(
+        self,
+        key: Hashable,
+        table: Dict[str, np.ndarray],
+        persist: bool = True,
+    ):
+        """
+        Add a table to the cache.
+
+        Tables bigger than max_bytes are not cached in memory.
+        :param key: cache key (see make_key)
+        :param table: props table
+        :param persist: whether to keep the table on disk too (if the
+                        cache has a cache_dir)
+        :return:
+        """
+        nbytes = table_nbytes(table)
+        with self._lock:
+            self._tables.pop(key, None)
+            if persist:
+                self.save(key, table)
+            else:
+                self._saved.pop(key, None)
+            if nbytes > self.max_bytes:
+                return
+            self._tables[key] = table
+            self._evict()
+
+    def load(self, key: Hashable) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Load the columns of a table from the disk cache.
+
+        Only files of the same key, plugin version and cache format are
+        used (see __cache_format__).
+        :param key: cache key (see make_key)
+        :return: dict of the computed columns, or None
+        """
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        with self._lock:
+            try:
+                with np.load(path, allow_pickle=False) as data:
+                    meta = json.loads(str(data["__meta__"]))
+                    if (
+                        meta["key"] != _key_json(key)
+                        or meta["version"] != __version__
+                        or meta.get("format") != __cache_format__
+                    ):
+                        return None
+                    columns = {k: data[k] for k in meta["columns"]}
+            except (OSError, ValueError, KeyError):
+                # e.g. incomplete or corrupt file
+                self._remove_file(path)
+                return None
+            # Mark the file as recently used
+            os.utime(path)
+            self._saved[key] = list(columns)
+            self.disk_hits += 1
+        return columns
+
+    def save(self, key: Hashable, table: Dict[str, np.ndarray]):
+        """
+        Write the computed columns of a table to the disk cache.
+
+        Only numeric columns are written (other columns are measured
+        again, see load). Tables that are on disk already with the same
+        columns are not written again.
+        :param key: cache key (see make_key)
+        :param table: props table
+        :return:
+        """
+        path = self._path(key)
+        if path is None:
+            return
+        if hasattr(table, "computed"):
+            table = table.computed()
+        columns = {
+            k: np.asarray(v)
+            for k, v in table.items()
+            if np.asarray(v).dtype.kind in "biuf"
+        }
+        with self._lock:
+            if self._saved.get(key) == list(columns):
+                return
+            meta = {
+                "key": _key_json(key),
+                "version": __version__,
+                "format": __cache_format__,
+                "columns": list(columns),
+            }
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first, so that no incomplete
+            # files are read
+            fd, tmp_path = tempfile.mkstemp(suffix=".npz", dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez_compressed(
+                        f,
+                        __meta__=np.array(json.dumps(meta)),
+                        **columns,
+                    )
+                os.replace(tmp_path, path)
+            except OSError:
+                self._remove_file(tmp_path)
+                return
+            self._saved[key] = list(columns)
+            self._evict_disk()
+
+    def sync(self):
+        """
+        Write the tables whose columns were computed since they were saved.
+
+        E.g. after a property of a LazyPropsTable was computed.
+        :return:
+        """
+        with self._lock:
+            for key, table in list(self._tables.items()):
+                if key in self._saved:
+                    self.save(key, table)
+
+    def remove(self, key: Hashable):
+        """
+        Remove a table from the cache, if present.
+
+        :param key: cache key
+        :return:
+        """
+        with self._lock:
+            self._tables.pop(key, None)
+            self._saved.pop(key, None)
+
+    def clear(self, disk: bool = False):
+        """
+        Remove all tables and reset the counters.
+
+        :param disk: whether to remove the files of the disk cache too
+        :return:
+        """
+        with self._lock:
+            self._tables.clear()
+            self._saved.clear()
+            self.hits = 0
+            self.misses = 0
+            self.disk_hits = 0
+            if disk:
+                for path in self._disk_files():
+                    self._remove_file(path)
+
+    @property
+    def nbytes(self) -> int:
+        # Not stored, since lazy tables grow when columns are computed
+        with self._lock:
+            return sum(table_nbytes(t) for t in self._tables.values())
+
+    def info(self) -> dict:
+        """
+        Cache statistics.
+
+        :return: dict with hits, misses, number of tables and memory usage
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "tables": len(self._tables),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "disk_nbytes": self.disk_nbytes,
+            "max_disk_bytes": self.max_disk_bytes,
+        }
+
+    @property
+    def disk_nbytes(self) -> int:
+        """Size of the files of the disk cache."""
+        return sum(os.path.getsize(p) for p in self._disk_files())
+
+    def _path(self, key: Hashable) -> Optional[str]:
+        # File of a key, None without disk cache
+        if self.cache_dir is None:
+            return None
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{_key_json(key)}{__version__}{__cache_format__}".encode())
+        return os.path.join(self.cache_dir, f"props-{h.hexdigest()}.npz")
+
+    def _disk_files(self) -> list:
+        # Files of the disk cache, least recently used first
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return []
+        paths = [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if name.startswith("props-") and name.endswith(".npz")
+        ]
+        return sorted(paths, key=os.path.getmtime)
+
+    def _evict_disk(self):
+        # Keep the most recently used file
+        paths = self._disk_files()
+        sizes = [os.path.getsize(p) for p in paths]
+        total = sum(sizes)
+        for path, size in zip(paths[:-1], sizes):
+            if total <= self.max_disk_bytes:
+                break
+            self._remove_file(path)
+            total -= size
+
+    @staticmethod
+    def _remove_file(path: str):
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+    def _evict(self):
+        # Keep the most recently used table
+        with self._lock:
+            while self.nbytes > self.max_bytes and len(self._tables) > 1:
+                key = next(iter(self._tables))
+                self.remove(key)
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __contains__(self, key: Hashable):
+        return key in self._tables
+
+
+def _key_json(key: Hashable) -> str:
+    """
+    Text of a cache key, e.g. for the metadata of the disk cache.
+
+    :param key: cache key (see PropsCache.make_key)
+    :return: JSON string
+    """
+    return json.dumps(key, default=str)
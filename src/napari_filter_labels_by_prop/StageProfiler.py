@@ -0,0 +1,230 @@
+import json
+import threading
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+class StageProfiler:
+    """
+    Records wall time, peak memory and object counts of pipeline stages.
+
+    Stages are recorded with a context manager, which can also be used as
+    decorator:
+        with profiler.stage("measure", n_objects=len(labels)):
+            ...
+        @profiler.stage("histogram")
+        def update_histo(self): ...
+
+    Stages can be nested, nested stages are recorded with their parent
+    (e.g. 'measure/calibrate'). Values known only inside the stage can be
+    added with annotate (e.g. profiler.annotate(n_objects=n)).
+    Peak memory (allocated during the stage, numpy arrays included) is
+    only recorded with trace_memory, as tracemalloc slows down Python.
+    tracemalloc has a single, process-wide peak: it is only recorded for
+    one (top-level) stage and its nested stages at a time, stages started
+    meanwhile in other threads (e.g. background jobs) have no peak memory.
+    The recorded peak includes the memory allocated by other threads
+    during the stage.
+    """
+
+    def __init__(self, trace_memory: bool = False, max_records: int = 10000):
+        self.enabled = True
+        # Functions called with every record (e.g. to show it in a widget)
+        self.callbacks: List[Callable[[dict], None]] = []
+        self._records = deque(maxlen=max_records)
+        self._local = threading.local()
+        # Thread whose stages record the peak memory (see stage)
+        self._memory_owner = None
+        self._memory_lock = threading.Lock()
+        self._started_tracemalloc = False
+        self._trace_memory = False
+        self.trace_memory = trace_memory
+
+    @property
+    def trace_memory(self) -> bool:
+        """Whether the peak memory of the stages is recorded."""
+        return self._trace_memory
+
+    @trace_memory.setter
+    def trace_memory(self, trace: bool):
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        elif not trace and self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self._trace_memory = trace
+
+    @contextmanager
+    def stage(self, name: str, **info) -> Iterator[dict]:
+        """
+        Record a stage.
+
+        :param name: stage name
+        :param info: additional values to record (e.g. n_objects)
+        :return: the record (dict), values can be added while in the stage
+        """
+        if not self.enabled:
+            yield dict(info)
+            return
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        record = {
+            "stage": name if parent is None else f"{parent['stage']}/{name}",
+            "start": time(),
+            "time": None,
+            "peak_memory": None,
+            **info,
+        }
+        trace = self._trace_memory and tracemalloc.is_tracing()
+        owner = False
+        if trace and parent is None:
+            # Only one stage (tree) at a time resets the peak
+            with self._memory_lock:
+                owner = self._memory_owner is None
+                if owner:
+                    self._memory_owner = threading.get_ident()
+            trace = owner
+        elif trace:
+            trace = "_peak" in parent
+        if trace:
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None and "_peak" in parent:
+                parent["_peak"] = max(parent["_peak"], peak)
+            # Peak memory since the start of the stage
+            tracemalloc.reset_peak()
+            record["_current"] = current
+            record["_peak"] = current
+        stack.append(record)
+        start = perf_counter()
+        try:
+            yield record
+        finally:
+            record["time"] = perf_counter() - start
+            stack.pop()
+            if trace and tracemalloc.is_tracing():
+                peak = max(record["_peak"], tracemalloc.get_traced_memory()[1])
+                record["peak_memory"] = peak - record["_current"]
+                if parent is not None and "_peak" in parent:
+                    parent["_peak"] = max(parent["_peak"], peak)
+            if owner:
+                with self._memory_lock:
+                    self._memory_owner = None
+            record.pop("_current", None)
+            record.pop("_peak", None)
+            self._records.append(record)
+            for callback in self.callbacks:
+                callback(record)
+
+    def annotate(self, **info):
+        """
+        Add values to the record of the current (innermost) stage.
+
+        :param info: values to record, e.g. n_objects=100
+        :return:
+        """
+        stack = self._stack()
+        if stack:
+            stack[-1].update(info)
+
+    def records(self, stage: Optional[str] = None) -> List[dict]:
+        """
+        The recorded stages, oldest first.
+
+        :param stage: only records of this stage, default all
+        :return: list of records
+        """
+        return [
+            dict(r)
+            for r in self._records
+            if stage is None or r["stage"] == stage
+        ]
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Statistics per stage.
+
+        :return: {stage: {'calls', 'total_time', 'mean_time', 'max_time',
+                 'last_time', 'peak_memory', 'n_objects'}}, the peak memory
+                 is the maximum of all calls, n_objects the last count
+        """
+        summary = {}
+        for r in self._records:
+            s = summary.setdefault(
+                r["stage"],
+                {
+                    "calls": 0,
+                    "total_time": 0.0,
+                    "max_time": 0.0,
+                    "peak_memory": None,
+                    "n_objects": None,
+                },
+            )
+            s["calls"] += 1
+            s["total_time"] += r["time"]
+            s["max_time"] = max(s["max_time"], r["time"])
+            s["last_time"] = r["time"]
+            if r["peak_memory"] is not None:
+                s["peak_memory"] = max(s["peak_memory"] or 0, r["peak_memory"])
+            if r.get("n_objects") is not None:
+                s["n_objects"] = r["n_objects"]
+        for s in summary.values():
+            s["mean_time"] = s["total_time"] / s["calls"]
+        return summary
+
+    def report(self) -> str:
+        """
+        Text summary of the last call of every stage.
+
+        :return: one line per stage
+        """
+        lines = []
+        for stage, s in self.summary().items():
+            line = f"{stage}: {s['last_time']:.3f} s"
+            if s["peak_memory"] is not None:
+                line += f", {s['peak_memory'] / 2**20:.1f} MB"
+            if s["n_objects"] is not None:
+                line += f", {s['n_objects']} objects"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """
+        Export the records and the summary as JSON.
+
+        :param path: optional file to write to
+        :return: JSON string
+        """
+        text = json.dumps(
+            {"records": self.records(), "summary": self.summary()},
+            indent=1,
+            default=str,
+        )
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def clear(self):
+        """
+        Remove all records.
+
+        :return:
+        """
+        self._records.clear()
+
+    def _stack(self) -> List[dict]:
+        """Stages in progress in the current thread."""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def __len__(self):
+        return len(self._records)
+
+
+# Profiler of the plugin (used by the widget and the measurement functions)
+profiler = StageProfiler()
@@ -1,6 +1,12 @@
+import os
+import weakref
+from functools import partial
+from time import monotonic
+from typing import Generator, Optional
+
 import napari.layers
 import numpy as np
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, QTimer, Signal
 from qtpy.QtGui import QDoubleValidator
 from qtpy.QtWidgets import (
     QCheckBox,
@@ -11,10 +17,25 @@ from qtpy.QtWidgets import (
     QPushButton,
     QWidget,
 )
-from skimage.measure import regionprops_table
 
+import napari_filter_labels_by_prop.measure as msr
 import napari_filter_labels_by_prop.utils as uts
+from napari_filter_labels_by_prop.JobRunner import JobRunner
+from napari_filter_labels_by_prop.ProgressStep import ProgressStep, exhaust
 from napari_filter_labels_by_prop.PropFilter import PropFilter
+from napari_filter_labels_by_prop.PropsCache import (
+    PropsCache,
+    default_cache_dir,
+)
+from napari_filter_labels_by_prop.StageProfiler import profiler
+
+# Minimum time between two updates of the widget with the frames of a
+# time-lapse measured so far (s), see add_frame_table
+__refresh_interval__ = 2.0
+
+# Maximum number of voxels of the multiscale level that is measured for the
+# preview by default (see utils.preview_level)
+__preview_voxels__ = 2**24
 
 
 class FilterByWidget(QWidget):
@@ -29,6 +50,9 @@ class FilterByWidget(QWidget):
 
     """
 
+    # Emitted (from any thread) when a stage was recorded by the profiler
+    profiler_record = Signal()
+
     def __init__(self, viewer: "napari.viewer.Viewer"):
         super().__init__()
         self.viewer = viewer
@@ -41,6 +65,9 @@ class FilterByWidget(QWidget):
         self.shape_match = QLabel("")
         self.projected_props_ckb = QCheckBox("")
         self.compartments_cbx = QCheckBox("")
+        self.timelapse_cbx = QCheckBox("")
+        self.profile_cbx = QCheckBox("")
+        self.profile_info = QLabel("")
         self.shape_match.setStyleSheet("color: red")
         self.props_binary = [
             "label",
@@ -80,6 +107,14 @@ class FilterByWidget(QWidget):
         self.prop_table = None
         self.lbl = None  # reference to label layer data
         self.img = None
+        # Levels of multiscale layers (None for single scale layers),
+        # self.lbl is the level measured for the preview
+        self.lbl_levels = None
+        self.img_levels = None
+        # Number of data changes of the label and image layers, {layer: n},
+        # so that the props cache only hashes changed data (see measure)
+        self.data_versions = weakref.WeakKeyDictionary()
+        self.level_combobox = QComboBox()
         self.prop_combobox = QComboBox()
         # Image calibration
         self.voxel_size = (1.0, 1.0, 1.0)
@@ -93,6 +128,36 @@ class FilterByWidget(QWidget):
         self.lbl_cells = None
         self.lbl_cyto = None
 
+        # Time-lapse props tables measured so far, {frame: table}
+        self.frame_tables = {}
+        # Whether the frames of the current measurement are shown yet,
+        # and when the shown table was last updated (see add_frame_table)
+        self._frames_shown = False
+        self._refresh_time = 0.0
+
+        # Labels layer whose edits are measured (see on_label_paint), the
+        # settings of the current measurement, and the bounding boxes of
+        # the labels (found on the first edit)
+        self.edited_layer = None
+        self.measure_args = None
+        self.label_boxes = None
+        # Edits are measured when napari is done with them (the data of
+        # single clicks is written after the paint event), edits until
+        # then are measured together
+        self._edits = []
+        self.edit_timer = QTimer()
+        self.edit_timer.setSingleShot(True)
+        self.edit_timer.setInterval(0)
+        self.edit_timer.timeout.connect(self.measure_edits)
+
+        # Cache of measured props tables, see self.measure(), which keeps
+        # the tables on disk too (for other sessions)
+        self.props_cache = PropsCache(cache_dir=default_cache_dir())
+        # Number of threads used to measure the shape properties
+        self.n_workers = os.cpu_count() or 1
+        # Background jobs (measurement and compartment creation)
+        self.jobs = JobRunner()
+
         # Create layout
         self.main_layout = QGridLayout()
         grid_row = self.setup_layout()
@@ -103,6 +168,7 @@ class FilterByWidget(QWidget):
         # Initialise combo boxes
         self.init_combo_boxes()
         self.main_layout.addWidget(self.filter_widget, grid_row, 0, 1, -1)
+        self.main_layout.addWidget(self.profile_info, grid_row + 1, 0, 1, -1)
 
         # Link combo-boxes to changes
         self.viewer.layers.events.inserted.connect(self.on_add_layer)
@@ -114,12 +180,21 @@ class FilterByWidget(QWidget):
             self.on_img_layer_selection
         )
         self.prop_combobox.currentIndexChanged.connect(self.on_prop_selection)
+        self.level_combobox.currentIndexChanged.connect(
+            self.on_level_selection
+        )
         # Connect the pixel size set button
         self.set_btn.clicked.connect(self.click_set_btn)
         # Connect the projected props checkbox
         self.projected_props_ckb.stateChanged.connect(self.update_properties)
         # Connect the compartment creation checkbox
         self.compartments_cbx.stateChanged.connect(self.create_compartments)
+        # Connect the time-lapse checkbox, and the frame changes
+        self.timelapse_cbx.stateChanged.connect(self.on_timelapse_toggle)
+        self.viewer.dims.events.current_step.connect(self.on_frame_change)
+        # Connect the stage timings checkbox
+        self.profile_cbx.stateChanged.connect(self.on_profile_toggle)
+        self.profiler_record.connect(self.update_profile_info)
 
     def create_compartments(self, force: bool = False):
         """
@@ -137,16 +212,41 @@ class FilterByWidget(QWidget):
         if self.lbl is None:
             return
         if not self.compartments_cbx.isChecked():
+            self.jobs.cancel("compartments")
             self.update_properties()
             return
+        # Expanding the labels requires the full label image in memory
+        if uts.is_lazy(self.lbl):
+            self.compartments_cbx.setChecked(False)
+            return
         # Only create the masks if they do not exist already
         if self.lbl_cells is None or force:
+            # The running measurement is outdated
+            self.jobs.cancel("measure")
             # scale changes? --> only considered when set button
-            self.lbl_cells, self.lbl_cyto = uts.create_cell_cyto_masks(
-                lbl=self.lbl, expansion=5, voxel_size=self.voxel_size
+            self.jobs.submit(
+                "compartments",
+                uts.iter_create_cell_cyto_masks,
+                lbl=self.lbl,
+                expansion=5,
+                voxel_size=self.voxel_size,
+                on_done=self.set_compartments,
+                desc="Expanding cells",
             )
+        else:
             self.update_properties()
 
+    def set_compartments(self, masks: tuple):
+        """
+        Set the created cell and cytoplasm masks, and measure them.
+
+        Called when the compartments job is done.
+        :param masks: cell mask, cytoplasm mask
+        :return:
+        """
+        self.lbl_cells, self.lbl_cyto = masks
+        self.update_properties()
+
     def on_prop_selection(self, index: int):
         """
         Callback function that updates the selected measurements.
@@ -157,75 +257,134 @@ class FilterByWidget(QWidget):
             return
         if index != -1:
             prop = self.prop_combobox.itemText(index)
-            # Update the prop_filter --> only the property name to filter on
-            self.filter_widget.update_property(prop)
+            if self.prop_table.is_computed(prop):
+                # Update the prop_filter --> only the property name
+                self.filter_widget.update_property(prop)
+                return
+            # Measure the property in the background
+            table = self.prop_table
+            self.jobs.submit(
+                "property",
+                partial(self.measure_property, table, prop),
+                on_done=partial(self.set_property, table, prop),
+                desc=f"Measuring {prop}",
+            )
+
+    def measure_property(
+        self, table: dict, prop: str
+    ) -> Generator[ProgressStep, None, np.ndarray]:
+        """
+        Measure a property of a props table (property generator job).
+
+        The property is kept in the disk cache too.
+        :param table: (lazy) props table
+        :param prop: property name
+        :return: yields ProgressSteps, returns property values
+        """
+        yield from table.iter_compute([prop])
+        values = table[prop]
+        self.props_cache.sync()
+        return values
+
+    def set_property(self, table: dict, prop: str, values=None):
+        """
+        Filter on a property that was just measured.
+
+        Called when the property job is done, the property is only
+        selected if its table and selection are still current.
+        :param table: props table the property was measured for
+        :param prop: property name
+        :param values: measured values (already added to the table)
+        :return:
+        """
+        if table is not self.prop_table:
+            return
+        if self.prop_combobox.currentText() != prop:
+            return
+        self.filter_widget.update_property(prop)
+        self.add_layer_properties()
 
     def click_set_btn(self):
         # set the scale in the layers
+        # (the time scale of time-lapses is kept)
+        scale = self.spatial_scale(
+            self.viewer.layers[self.lbl_layer_name].scale
+        )
         # 2D
-        if len(self.viewer.layers[self.lbl_layer_name].scale) == 2:
+        if len(scale) == 2:
             self.voxel_size = (
                 float(self.y_textbox.text()),
                 float(self.x_textbox.text()),
             )
-            self.viewer.layers[self.lbl_layer_name].scale = self.voxel_size
-            if self.img_layer_name is not None:
-                self.viewer.layers[self.img_layer_name].scale = self.voxel_size
         # 3D
-        elif len(self.viewer.layers[self.lbl_layer_name].scale) == 3:
+        elif len(scale) == 3:
             self.voxel_size = (
                 float(self.z_textbox.text()),
                 float(self.y_textbox.text()),
                 float(self.x_textbox.text()),
             )
-            self.viewer.layers[self.lbl_layer_name].scale = self.voxel_size
-            if self.img_layer_name is not None:
-                self.viewer.layers[self.img_layer_name].scale = self.voxel_size
         else:
             raise NotImplementedError(
                 f"Setting the scale for more than "
-                f"{len(self.viewer.layers[self.lbl_layer_name].scale)}D images "
+                f"{len(scale)}D images "
                 f"is not supported"
             )
-        # (Re-)create the masks for compartments (only happens if checkbox ticked)
+        for name in (self.lbl_layer_name, self.img_layer_name):
+            if name is not None:
+                layer = self.viewer.layers[name]
+                layer.scale = (
+                    tuple(layer.scale[: layer.ndim - len(scale)])
+                    + self.voxel_size
+                )
+        # (Re-)create the masks for compartments (only happens if checkbox
+        # ticked) and update the properties
         self.create_compartments(force=True)
-        # Update the properties
-        self.update_properties()
 
     def update_properties(self):
+        """
+        Measure the label properties and update the widget.
+
+        The measurement runs in the background, as 'measure' job: a new
+        measurement (e.g. of another layer) supersedes the running one,
+        and only the current measurement is set (see set_prop_table).
+        :return:
+        """
         if self.lbl is None:
             return
         # Ensure that the img and labels have the same shape for measurements
         intensity_image = None  # to use to measure
-        if self.img is None:
+        img = self.img
+        if self.img_levels is not None:
+            # (the level of the measured label level)
+            img = uts.matching_level(self.img_levels, self.lbl.shape)
+        if img is None:
             intensity_image = None
             props = self.props_binary.copy()
-        elif (
-            self.lbl.shape != self.img.shape
-            and self.lbl.shape != self.img.shape[:-1]
-        ):
+        elif self.lbl.shape != img.shape and self.lbl.shape != img.shape[:-1]:
             intensity_image = None
             props = self.props_binary.copy()
             # update info label about shape matching
             self.shape_match.setText("Label & Image shapes do not match.")
             self.shape_match.setToolTip(
                 f"Label shape = {self.lbl.shape}; "
-                f"Image shape = {self.img.shape}"
+                f"Image shape = {img.shape}"
             )
             self.img = None
+            self.img_levels = None
             self.img_layer_name = None
         else:
-            intensity_image = self.img
+            intensity_image = img
             props = self.props_intensity.copy()
             # update the info label about shape matching
             self.shape_match.setText("")
             self.shape_match.setToolTip("")
 
-        # Define extra properties
-        extra_props = None
+        # Measure projected properties
+        projected = False
 
-        # remove some properties for 3D images (no matter if Z or T)
-        if self.lbl.ndim > 2:
+        # remove some properties for 3D images (or 3D time-lapse frames)
+        ndim = self.lbl.ndim - 1 if self.is_timelapse() else self.lbl.ndim
+        if ndim > 2:
             props_to_remove = [
                 "axis_major_length",
                 "axis_minor_length",
@@ -239,27 +398,220 @@ class FilterByWidget(QWidget):
             for p in props_to_remove:
                 props.remove(p)
             # If >3D label image and projected_props checked
-            if self.projected_props_ckb.isChecked():
-                extra_props = (
-                    uts.projected_area,
-                    uts.projected_convex_area,
-                    uts.projected_circularity,
-                    uts.projected_perimeter,
-                )
+            # (all projected properties are measured in a single pass)
+            projected = self.projected_props_ckb.isChecked()
+
+        # The running property measurement is outdated
+        self.jobs.cancel("property")
+        self.jobs.cancel("refresh")
+        self.measure_args = None
+        if self.is_timelapse():
+            self.measure_timelapse(
+                intensity_image=intensity_image,
+                props=props,
+                projected=projected,
+            )
+            return
+        # The job only uses the current layers and settings
+        # (not the widget state, which may change while it runs)
+        versions = (
+            self.data_version(self.lbl_layer_name),
+            self.data_version(self.img_layer_name),
+        )
+        cells, cyto = None, None
+        if self.compartments_cbx.isChecked() and self.lbl_cyto is not None:
+            # Measure in nuclei, cells and cytoplasm
+            cells, cyto = self.lbl_cells, self.lbl_cyto
+            job = partial(
+                self.measure_compartment_props,
+                lbl=self.lbl,
+                cells=cells,
+                cyto=cyto,
+                versions=versions,
+            )
+        else:
+            job = partial(self.iter_measure, self.lbl, versions=versions)
+            # Edited labels are measured with the same settings
+            self.measure_args = {
+                "intensity_image": intensity_image,
+                "props": props,
+                "projected": projected,
+                "voxel_size": self.measure_voxel_size(),
+            }
+        self.jobs.submit(
+            "measure",
+            job,
+            intensity_image=intensity_image,
+            props=props,
+            projected=projected,
+            voxel_size=self.measure_voxel_size(),
+            on_done=partial(self.set_prop_table, cells=cells, cyto=cyto),
+            desc="Measuring label properties",
+        )
 
-        self.prop_table = regionprops_table(
+    def measure_timelapse(
+        self,
+        intensity_image: np.ndarray = None,
+        props: list = None,
+        projected: bool = False,
+    ):
+        """
+        Measure the frames of a time-lapse in the background.
+
+        The frame shown in the viewer is measured first (and shown right
+        away), the other frames are streamed by the 'measure' job and
+        added to the widget while they are measured (see add_frame_table).
+        :param intensity_image: intensity image or None
+        :param props: list of properties to measure
+        :param projected: whether to measure the projected properties
+        :return:
+        """
+        current = self.current_frame()
+        frames = [current] + [
+            t for t in range(self.lbl.shape[0]) if t != current
+        ]
+        self.frame_tables = {}
+        self._frames_shown = False
+        self.filter_widget.frame = current
+        self.jobs.submit(
+            "measure",
+            self.measure_frames,
             self.lbl,
+            frames,
             intensity_image=intensity_image,
-            properties=props,
-            extra_properties=extra_props,
-            spacing=self.voxel_size,
+            props=props,
+            projected=projected,
+            voxel_size=self.measure_voxel_size(),
+            on_yield=self.add_frame_table,
+            on_done=self.set_frame_tables,
+            desc="Measuring frames",
+            total=len(frames),
         )
-        self.calibrate_extra_props()
-        # Measure intensity props in compartments
-        self.measure_compartment_props(
-            intensity_image=intensity_image, props=props
+
+    def measure_frames(
+        self,
+        lbl: np.ndarray,
+        frames: list,
+        intensity_image: np.ndarray = None,
+        props: list = None,
+        projected: bool = False,
+        voxel_size: tuple = None,
+    ):
+        """
+        Measure time-lapse frames one by one (generator job).
+
+        Every frame is measured (and cached) like a label image of its
+        own, see self.measure().
+        :param lbl: time-lapse label image, time on the first axis
+        :param frames: frame indices, in the order to measure them
+        :param intensity_image: intensity image or None
+        :param props: list of properties to measure
+        :param projected: whether to measure the projected properties
+        :param voxel_size: (Z)YX voxel size of the frames
+        :return: yields (frame, table), returns dict of {frame: table}
+        """
+        tables = {}
+        for t in frames:
+            tables[t] = self.measure(
+                lbl[t],
+                intensity_image=(
+                    None if intensity_image is None else intensity_image[t]
+                ),
+                props=props,
+                projected=projected,
+                voxel_size=voxel_size,
+            )
+            yield t, tables[t]
+        return tables
+
+    def add_frame_table(self, frame_table: tuple):
+        """
+        Add a measured time-lapse frame.
+
+        Called for every frame of the measure job. The first frame (with
+        labels) is shown right away, later frames are added at most every
+        __refresh_interval__ seconds, and when all frames are measured.
+        :param frame_table: (frame, props table)
+        :return:
+        """
+        frame, table = frame_table
+        self.frame_tables[frame] = table
+        if (
+            not self._frames_shown
+            or monotonic() - self._refresh_time > __refresh_interval__
+        ):
+            self.set_frame_tables()
+
+    def set_frame_tables(self, tables: dict = None):
+        """
+        Show the time-lapse frames measured so far.
+
+        The frame tables are combined into one table, with a 'frame'
+        column (see measure.concat_frame_tables), which can be filtered
+        on like the other properties.
+        :param tables: dict of {frame: table} of all frames (when the
+                       measure job is done), default the frames so far
+        :return:
+        """
+        if tables is not None:
+            self.frame_tables = dict(tables)
+        table = msr.concat_frame_tables(self.frame_tables)
+        if len(table["label"]) == 0 and tables is None:
+            # Wait for frames with labels
+            return
+        self._refresh_time = monotonic()
+        if not self._frames_shown:
+            self._frames_shown = True
+            self.set_prop_table(table)
+            return
+        # Keep the selected property and the filters, whose columns
+        # are measured in the background if needed
+        props = [self.filter_widget.prop, *self.filter_widget.filter_model]
+        needed = [p for p in props if p in table and not table.is_computed(p)]
+        self.jobs.submit(
+            "refresh",
+            table.iter_compute,
+            needed,
+            on_done=self.refresh_prop_table,
+            desc=None if len(needed) == 0 else "Measuring frames",
         )
 
+    def refresh_prop_table(self, table: dict):
+        """
+        Replace the props table, keeping the selection and filters.
+
+        :param table: props table with the same columns
+        :return:
+        """
+        self.prop_table = table
+        self.filter_widget.update_table(table)
+        self.add_layer_properties()
+
+    def set_prop_table(
+        self,
+        table: dict,
+        cells: np.ndarray = None,
+        cyto: np.ndarray = None,
+    ):
+        """
+        Set a measured props table and update the widget.
+
+        Called when the measure job is done.
+        :param table: props table
+        :param cells: cell mask the table was measured with (or None)
+        :param cyto: cytoplasm mask the table was measured with (or None)
+        :return:
+        """
+        self.prop_table = table
+        self.label_boxes = None
+        if len(self.prop_table["label"]) == 0:
+            # e.g. lazy label layer without labels
+            self.prop_table = None
+            self.prop_combobox.clear()
+            self.filter_widget.hide_widget(clear=True)
+            self.lbl_combobox.setStyleSheet("color: red")
+            self.lbl_combobox.setToolTip("Label Layer has no labels.")
+            return
         # Update the prop_filter widget
         self.filter_widget.update_widget(
             lbl_name=self.lbl_layer_name,
@@ -268,99 +620,260 @@ class FilterByWidget(QWidget):
             prop="label",  # at initialisation this is always selected
         )
         # Set the compartment masks in the FilterProp
-        self.filter_widget.set_compartment_masks(
-            cells=self.lbl_cells, cyto=self.lbl_cyto
-        )
+        self.filter_widget.set_compartment_masks(cells=cells, cyto=cyto)
         self.prop_combobox.clear()
-        self.prop_combobox.addItems(self.prop_table.keys())
+        self.prop_combobox.addItems(list(self.prop_table.keys()))
         # Add the properties to the labels layer features data
         self.add_layer_properties()
 
-    def measure_compartment_props(
-        self, intensity_image: np.ndarray, props: list
-    ):
-        # Don't measure if checkbox is not ticked
-        if not self.compartments_cbx.isChecked():
-            return
-        # Make sure that the masks exist (check one is enough)
-        if self.lbl_cyto is None:
-            return
-        # Create the region prop tables
-        table_cyto = regionprops_table(
-            self.lbl_cyto,
-            intensity_image=intensity_image,
-            properties=props,
-            spacing=self.voxel_size,
+    def measure(
+        self,
+        lbl: np.ndarray,
+        intensity_image: np.ndarray = None,
+        props: list = None,
+        extra_props: tuple = None,
+        projected: bool = False,
+        voxel_size: tuple = None,
+        versions: tuple = None,
+    ) -> dict:
+        """
+        Measure the properties of a label image, using the props cache.
+
+        Revisiting a configuration (same label and intensity data,
+        voxel size and properties) returns the cached table, also in
+        another session (the properties measured so far are loaded from
+        the disk cache).
+        Only the cheap properties are measured right away, the others when
+        they are first selected (see LazyPropsTable).
+        :param lbl: label image
+        :param intensity_image: intensity image or None
+        :param props: list of properties to measure
+        :param extra_props: extra property functions or None
+        :param projected: whether to measure the projected properties
+        :param voxel_size: (Z)YX voxel size, default the current voxel size
+        :param versions: data versions of lbl and intensity_image (see
+                         PropsCache.make_key), default is to hash the data
+        :return: LazyPropsTable
+        """
+        return exhaust(
+            self.iter_measure(
+                lbl,
+                intensity_image=intensity_image,
+                props=props,
+                extra_props=extra_props,
+                projected=projected,
+                voxel_size=voxel_size,
+                versions=versions,
+            )
         )
-        table_cell = regionprops_table(
-            self.lbl_cells,
+
+    def iter_measure(
+        self,
+        lbl: np.ndarray,
+        intensity_image: np.ndarray = None,
+        props: list = None,
+        extra_props: tuple = None,
+        projected: bool = False,
+        voxel_size: tuple = None,
+        versions: tuple = None,
+    ) -> Generator[ProgressStep, None, dict]:
+        """
+        Measure the properties of a label image (measure generator job).
+
+        Same as self.measure(), yielding the ProgressSteps of the
+        measurement (see measure.iter_lazy_measure_props).
+        :return: yields ProgressSteps, returns LazyPropsTable
+        """
+        if voxel_size is None:
+            voxel_size = self.voxel_size
+        key_props = list(props)
+        if projected:
+            key_props += msr.__projected_props__
+        key = self.props_cache.make_key(
+            lbl,
             intensity_image=intensity_image,
-            properties=props,
-            spacing=self.voxel_size,
-        )
-        # Rename the table headers (to include compartments)
-        table_cyto = uts.rename_dict_keys(table_cyto, prefix="Cyto")
-        table_cell = uts.rename_dict_keys(table_cell, prefix="Cell")
-        self.prop_table = uts.rename_dict_keys(
-            self.prop_table, prefix="Nucleus"
+            voxel_size=voxel_size,
+            properties=key_props,
+            extra_properties=extra_props,
+            versions=versions,
         )
-        # Merge the 3 tables into self.prop_table
-        self.prop_table = uts.merge_dict(self.prop_table, table_cell)
-        self.prop_table = uts.merge_dict(self.prop_table, table_cyto)
+        table = self.props_cache.get(key)
+        if table is not None:
+            return table
+        columns = self.props_cache.load(key)
+        with profiler.stage(
+            "measure", lazy=uts.is_lazy(lbl), cached=columns is not None
+        ):
+            table = yield from msr.iter_lazy_measure_props(
+                lbl,
+                intensity_image=intensity_image,
+                properties=props,
+                extra_properties=extra_props,
+                spacing=voxel_size,
+                postprocess=partial(
+                    self.calibrate_extra_props, voxel_size=voxel_size
+                ),
+                n_workers=self.n_workers,
+                projected=projected,
+                columns=columns,
+            )
+            profiler.annotate(n_objects=len(table["label"]))
+        self.props_cache.put(key, table)
+        return table
 
-    def calibrate_extra_props(self):
-        # check that the keys are in the props table
-        from napari_filter_labels_by_prop.utils import (
-            __calibrated_extra_props__,
-        )
+    def measure_compartment_props(
+        self,
+        intensity_image: np.ndarray,
+        props: list,
+        projected: bool = False,
+        lbl: np.ndarray = None,
+        cells: np.ndarray = None,
+        cyto: np.ndarray = None,
+        voxel_size: tuple = None,
+        versions: tuple = None,
+    ) -> Generator[ProgressStep, None, dict]:
+        """
+        Measure the properties of the compartments (measure generator job).
 
-        for p in __calibrated_extra_props__:
-            if p not in self.prop_table:
-                return
-        # if x != y size, raise not implemented error
-        if self.voxel_size[-2] != self.voxel_size[-1]:
-            raise NotImplementedError(
-                f"Different XY pixel size is not implemented. Got "
-                f"({self.voxel_size[-2]}, {self.voxel_size[-1]})."
+        The reduction properties (area and intensities) of the three
+        compartments are measured in one pass, the others on demand.
+        The tables are merged, with 'Nucleus: ', 'Cell: ' and 'Cyto: '
+        prefixes, and cached like in self.measure() (in memory only,
+        the compartment masks are created again in another session).
+        :param intensity_image: intensity image or None
+        :param props: list of properties to measure
+        :param projected: whether to measure the projected nuclei properties
+        :param lbl: nuclei label image, default the current labels
+        :param cells: cell mask, default the current cell mask
+        :param cyto: cytoplasm mask, default the current cytoplasm mask
+        :param voxel_size: (Z)YX voxel size, default the current voxel size
+        :param versions: data versions of lbl and intensity_image (see
+                         PropsCache.make_key), default is to hash the data
+        :return: yields a ProgressStep, returns merged (lazy) props table
+        """
+        if lbl is None:
+            lbl, cells, cyto = self.lbl, self.lbl_cells, self.lbl_cyto
+        if voxel_size is None:
+            voxel_size = self.voxel_size
+        key_props = list(props) + ["compartments"]
+        if projected:
+            key_props += msr.__projected_props__
+        key = self.props_cache.make_key(
+            lbl,
+            intensity_image=intensity_image,
+            voxel_size=voxel_size,
+            properties=key_props,
+            versions=versions,
+        )
+        table = self.props_cache.get(key)
+        if table is not None:
+            return table
+        with profiler.stage("measure", compartments=True):
+            tables = msr.lazy_measure_compartments(
+                lbl,
+                cells,
+                cyto,
+                intensity_image=intensity_image,
+                properties=props,
+                spacing=voxel_size,
+                postprocess=partial(
+                    self.calibrate_extra_props, voxel_size=voxel_size
+                ),
+                n_workers=self.n_workers,
+                projected=projected,
             )
-        # multiply the values
-        for prop in __calibrated_extra_props__:
-            if "area" in prop:
-                self.prop_table[prop] = (
-                    self.prop_table[prop] * self.voxel_size[-1] ** 2
-                )
-            else:
-                self.prop_table[prop] = (
-                    self.prop_table[prop] * self.voxel_size[-1]
-                )
+            # Merge the 3 tables (headers include the compartments)
+            table = msr.merge_compartment_tables(tables)
+            profiler.annotate(n_objects=len(table["label"]))
+        # (one pass for the 3 compartments)
+        yield ProgressStep(1, 1)
+        self.props_cache.put(key, table, persist=False)
+        return table
 
+    def calibrate_extra_props(
+        self, table: dict, voxel_size: tuple = None
+    ) -> dict:
+        """
+        Calibrate the projected (extra) properties of a props table.
+
+        Used as postprocess of the measurement, i.e. applied once when the
+        extra properties are computed.
+        :param table: props table
+        :param voxel_size: voxel size the table was measured with,
+                           default is the current voxel size
+        :return: calibrated props table
+        """
+        if voxel_size is None:
+            voxel_size = self.voxel_size
+        return uts.calibrate_extra_props(table, voxel_size)
+
+    @profiler.stage("features")
     def add_layer_properties(self):
         """
         Create a set of measurements added to the label layer properties.
 
         This will show the measurements at the bottom of the viewer.
-        The way this function creates the property dictionary, allows for
-        having label images where not every label is present in the image.
+        The features table has one row per measured label, and an 'index'
+        column with the label values (which napari uses to look up the
+        row of a label). So label images where not every label is present
+        in the image do not need a row per label id.
 
         Note: as far as I have seen, the labels layer properties and
         features fields are the same...
         :return:
         """
-        # The properties are a dictionary with str measurement,
-        # and with value = array of length n (max) labels + 0-label
-        features = {}
-        label_max = self.prop_table["label"].max()
-        for k, v in self.prop_table.items():
+        # Typed columns, one row per label
+        # (only the columns computed so far are added,
+        # for time-lapses the rows of the current frame)
+        rows = uts.frame_rows(self.prop_table, self.filter_widget.frame)
+        features = {"index": np.asarray(self.prop_table["label"])[rows]}
+        profiler.annotate(n_objects=len(features["index"]))
+        for k, v in self.prop_table.computed().items():
             # skipp the 'label' feature
             if k == "label":
                 continue
-            # Per measurement create a dict entry, including label "0"
-            features[k] = ["none"] * (label_max + 1)
-            # Assign the proper value to the features values array
-            for i, label in enumerate(self.prop_table["label"]):
-                features[k][label] = v[i]
-        # Add the features to the properties
-        self.viewer.layers[self.lbl_layer_name].properties = features
+            features[k] = np.asarray(v)[rows]
+        # Set the whole table at once
+        self.viewer.layers[self.lbl_layer_name].features = features
+
+    def on_profile_toggle(self, state: int):
+        """
+        Show or hide the stage timings (see StageProfiler).
+
+        While shown, the peak memory of the stages is recorded too.
+        :param state: checkbox state
+        :return:
+        """
+        show = self.profile_cbx.isChecked()
+        profiler.trace_memory = show
+        self.profile_info.setVisible(show)
+        if show:
+            profiler.clear()
+            profiler.callbacks.append(self.on_profiler_record)
+        elif self.on_profiler_record in profiler.callbacks:
+            profiler.callbacks.remove(self.on_profiler_record)
+        self.profile_info.setText("")
+
+    def on_profiler_record(self, record: dict):
+        """
+        Update the stage timings when a (top level) stage is recorded.
+
+        Stages can be recorded in background jobs, so the label is updated
+        through a signal (in the main thread).
+        :param record: StageProfiler record
+        :return:
+        """
+        if "/" not in record["stage"]:
+            self.profiler_record.emit()
+
+    def update_profile_info(self):
+        """
+        Show the last call of every stage.
+
+        :return:
+        """
+        if self.profile_cbx.isChecked():
+            self.profile_info.setText(profiler.report())
 
     def check_and_set_scale(
         self,
@@ -388,7 +901,9 @@ class FilterByWidget(QWidget):
         # On label layer change and image_layer(_name) is available
         if not is_img_layer and self.img is not None:
             # Favor image layer scale
-            img_scale = self.viewer.layers[self.img_layer_name].scale
+            img_scale = self.spatial_scale(
+                self.viewer.layers[self.img_layer_name].scale
+            )
             # If label and image layer scales are not the same?
             if not np.array_equal(img_scale, scale):
                 # Check whether all values are 1,
@@ -460,6 +975,178 @@ class FilterByWidget(QWidget):
         self.y_textbox.setText(str(np.nan))
         self.x_textbox.setText(str(np.nan))
 
+    def set_label_data(self, layer: napari.layers.Labels):
+        """
+        Set the label data to measure.
+
+        Of multiscale layers, a low resolution level is measured (see
+        __preview_voxels__), which can be changed with the level selection.
+        The filter is applied to all levels by Create labels.
+        :param layer: labels layer
+        :return:
+        """
+        self.level_combobox.blockSignals(True)
+        self.level_combobox.clear()
+        if layer.multiscale:
+            self.lbl_levels = list(layer.data)
+            self.level_combobox.addItems(
+                [
+                    f"{i}: {' x '.join(map(str, level.shape))}"
+                    for i, level in enumerate(self.lbl_levels)
+                ]
+            )
+            level = uts.preview_level(
+                [level.shape for level in self.lbl_levels],
+                __preview_voxels__,
+            )
+            self.level_combobox.setCurrentIndex(level)
+            self.lbl = self.lbl_levels[level]
+        else:
+            self.lbl_levels = None
+            self.lbl = layer.data
+        self.level_combobox.setDisabled(self.lbl_levels is None)
+        self.level_combobox.blockSignals(False)
+
+    def set_image_data(self, layer: napari.layers.Image):
+        """
+        Set the intensity image data.
+
+        Of multiscale layers, the level matching the measured label level
+        is used (see update_properties).
+        :param layer: image layer
+        :return:
+        """
+        if layer.multiscale:
+            self.img_levels = list(layer.data)
+            self.img = self.img_levels[0]
+        else:
+            self.img_levels = None
+            self.img = layer.data
+
+    def on_level_selection(self, index: int):
+        """
+        Measure another level of a multiscale label layer.
+
+        :param index: level index
+        :return:
+        """
+        if index == -1 or self.lbl_levels is None:
+            return
+        self.lbl = self.lbl_levels[index]
+        self.update_properties()
+
+    def measure_voxel_size(self) -> tuple:
+        """
+        The voxel size of the measured labels.
+
+        For multiscale layers, the voxel size of the measured level,
+        i.e. the (full resolution) voxel size times the downsampling.
+        :return: (Z)YX voxel size
+        """
+        if self.lbl_levels is None:
+            return self.voxel_size
+        factors = uts.level_factors(
+            self.lbl_levels,
+            self.level_combobox.currentIndex(),
+            len(self.voxel_size),
+        )
+        return tuple(v * f for v, f in zip(self.voxel_size, factors))
+
+    def is_timelapse(self) -> bool:
+        """
+        Whether the label layer is measured as time-lapse (TYX or TZYX).
+
+        :return: bool
+        """
+        return (
+            self.lbl is not None
+            and self.lbl.ndim > 2
+            and self.timelapse_cbx.isChecked()
+        )
+
+    def spatial_scale(self, scale: tuple) -> tuple:
+        """
+        The (Z)YX part of a layer scale (without the time-lapse axis).
+
+        :param scale: layer scale
+        :return: tuple of (Z)YX scale
+        """
+        scale = tuple(scale)
+        if self.is_timelapse():
+            return scale[1:]
+        return scale
+
+    def update_timelapse_option(self):
+        """
+        Enable the time-lapse option for the current labels.
+
+        4D labels are always measured as TZYX time-lapse, 3D labels
+        as TYX if the option is checked.
+        Compartments are not supported for time-lapses (nor lazy data
+        and multiscale layers).
+        :return:
+        """
+        self.timelapse_cbx.blockSignals(True)
+        if self.lbl.ndim > 3:
+            self.timelapse_cbx.setChecked(True)
+        elif self.lbl.ndim < 3:
+            self.timelapse_cbx.setChecked(False)
+        self.timelapse_cbx.setDisabled(self.lbl.ndim != 3)
+        self.timelapse_cbx.blockSignals(False)
+        no_compartments = (
+            uts.is_lazy(self.lbl)
+            or self.is_timelapse()
+            or self.lbl_levels is not None
+        )
+        if no_compartments and self.compartments_cbx.isChecked():
+            # (without triggering a measurement)
+            self.compartments_cbx.blockSignals(True)
+            self.compartments_cbx.setChecked(False)
+            self.compartments_cbx.blockSignals(False)
+        self.compartments_cbx.setDisabled(no_compartments)
+
+    def on_timelapse_toggle(self, state: int):
+        """
+        Measure the labels as time-lapse, or as 3D image.
+
+        :param state: checkbox state
+        :return:
+        """
+        if self.lbl is None:
+            return
+        self.update_timelapse_option()
+        # The voxel size depends on the axes
+        self.reset_voxel_size()
+        scale = self.viewer.layers[self.lbl_layer_name].scale
+        self.check_and_set_scale(scale=self.spatial_scale(scale))
+        self.create_compartments()
+
+    def current_frame(self) -> int:
+        """
+        The time-lapse frame shown in the viewer.
+
+        :return: frame index
+        """
+        layer = self.viewer.layers[self.lbl_layer_name]
+        coords = layer.world_to_data(self.viewer.dims.point)
+        return int(np.clip(np.round(coords[0]), 0, self.lbl.shape[0] - 1))
+
+    def on_frame_change(self, event=None):
+        """
+        Show the filtered labels of the time-lapse frame shown in the viewer.
+
+        :param event: dims current_step event
+        :return:
+        """
+        if not self.is_timelapse() or self.lbl_layer_name is None:
+            return
+        frame = self.current_frame()
+        if frame == self.filter_widget.frame:
+            return
+        self.filter_widget.set_frame(frame)
+        if self.prop_table is not None and "frame" in self.prop_table:
+            self.add_layer_properties()
+
     def on_lbl_layer_selection(self, index: int):
         """
         Callback function that "updates stuff"
@@ -467,6 +1154,8 @@ class FilterByWidget(QWidget):
         :param index:
         :return:
         """
+        # Results of running jobs are for the previous layer
+        self.jobs.cancel()
         # reset the lbl_combobox style sheet
         self.lbl_combobox.setStyleSheet(self.img_combobox.styleSheet())
         self.lbl_combobox.setToolTip("")
@@ -478,30 +1167,231 @@ class FilterByWidget(QWidget):
             self.lbl_cyto = None
             # Load the layer to class variables
             self.lbl_layer_name = self.lbl_combobox.itemText(index)
-            self.lbl = self.viewer.layers[self.lbl_layer_name].data
+            self.set_label_data(self.viewer.layers[self.lbl_layer_name])
+            self.watch_label_layer(self.viewer.layers[self.lbl_layer_name])
             # check if there is any labels there...
-            if self.lbl.max() < 1:
+            # (lazy data is checked after measuring, to avoid an extra pass)
+            if not uts.is_lazy(self.lbl) and self.lbl.max() < 1:
                 self.lbl = None
                 self.filter_widget.hide_widget(clear=True)
                 self.lbl_combobox.setStyleSheet("color: red")
                 self.lbl_combobox.setToolTip("Label Layer has no labels.")
                 return
+            # Compartments are not supported for lazy (dask/zarr) data
+            # and time-lapses
+            self.update_timelapse_option()
             scale = self.viewer.layers[self.lbl_layer_name].scale
-            self.check_and_set_scale(scale=scale)
-            # Check whether the compartment check box is check to create masks
-            if self.compartments_cbx.isChecked():
-                self.create_compartments()
-            self.update_properties()
+            self.check_and_set_scale(scale=self.spatial_scale(scale))
+            # Create the masks if the compartment check box is checked,
+            # and measure the properties
+            self.create_compartments()
         else:
             # No labels selected, reset the widget...
+            self.watch_label_layer(None)
             self.lbl_layer_name = None
             self.lbl = None
+            self.lbl_levels = None
+            self.level_combobox.clear()
             self.lbl_cyto = None
             self.lbl_cells = None
             self.prop_combobox.clear()
             self.prop_table = None
             self.filter_widget.hide_widget(clear=True)
 
+    def watch_label_layer(self, layer: napari.layers.Labels = None):
+        """
+        Measure the edits of a labels layer (instead of the previous one).
+
+        :param layer: labels layer, or None
+        :return:
+        """
+        if self.edited_layer is not None:
+            self.edited_layer.events.paint.disconnect(self.on_label_paint)
+            self.edited_layer.events.data.disconnect(self.on_label_data)
+        self.edited_layer = layer
+        self.label_boxes = None
+        self.edit_timer.stop()
+        self._edits = []
+        if layer is not None:
+            layer.events.paint.connect(self.on_label_paint)
+            layer.events.data.connect(self.on_label_data)
+
+    def track_data_changes(self, layer: napari.layers.Layer):
+        """
+        Count the data changes of a labels or image layer.
+
+        Painting emits a paint event, replacing the data a data event
+        (undo and redo are found by data_version).
+        :param layer: labels or image layer
+        :return:
+        """
+        layer.events.data.connect(self.on_data_change)
+        if isinstance(layer, napari.layers.Labels):
+            layer.events.paint.connect(self.on_data_change)
+        self.data_versions.setdefault(layer, 0)
+
+    def untrack_data_changes(self, layer: napari.layers.Layer):
+        """
+        Stop counting the data changes of a (removed) layer.
+
+        :param layer: labels or image layer
+        :return:
+        """
+        layer.events.data.disconnect(self.on_data_change)
+        if isinstance(layer, napari.layers.Labels):
+            layer.events.paint.disconnect(self.on_data_change)
+        self.data_versions.pop(layer, None)
+
+    def on_data_change(self, event):
+        """
+        Increase the data version of a layer (see data_version).
+
+        :param event: layer event
+        :return:
+        """
+        layer = event.source
+        self.data_versions[layer] = self.data_versions.get(layer, 0) + 1
+
+    def data_version(self, layer_name: Optional[str]) -> Optional[tuple]:
+        """
+        Data version of a layer, to reuse the fingerprint of its data.
+
+        napari emits no event for undo and redo (of labels layers), which
+        change the lengths of the undo and redo history instead.
+        :param layer_name: name of a layer, or None
+        :return: (layer id, number of data changes, undo and redo history
+                 lengths), None if the layer is not tracked (see
+                 track_data_changes)
+        """
+        if layer_name is None or layer_name not in self.viewer.layers:
+            return None
+        layer = self.viewer.layers[layer_name]
+        if layer not in self.data_versions:
+            return None
+        return (
+            id(layer),
+            self.data_versions[layer],
+            len(getattr(layer, "_undo_history", ())),
+            len(getattr(layer, "_redo_history", ())),
+        )
+
+    def on_label_paint(self, event):
+        """
+        Measure the labels changed by painting, erasing or filling.
+
+        The edit is measured once the event loop runs again (see
+        measure_edits).
+        Note: napari does not emit an event for undo and redo.
+        :param event: labels layer paint event
+        :return:
+        """
+        self._edits += list(event.value)
+        self.edit_timer.start()
+
+    def measure_edits(self):
+        """
+        Measure the labels changed by the edits so far.
+
+        Only the changed labels are measured again (see remeasure_labels).
+        Time-lapses, compartments, lazy data and multiscale layers are
+        measured again as a whole (like a new label layer), as well as
+        edits during the measurement.
+        :return:
+        """
+        atoms, self._edits = self._edits, []
+        if len(atoms) == 0 or self.edited_layer is None:
+            return
+        if self.lbl is None or self.prop_table is None:
+            # e.g. the first labels painted in an empty layer
+            self.on_lbl_layer_selection(self.lbl_combobox.currentIndex())
+            return
+        if self.compartments_cbx.isChecked():
+            # The cell and cytoplasm masks depend on the labels
+            self.create_compartments(force=True)
+            return
+        if (
+            self.measure_args is None
+            or self.jobs.is_running("measure")
+            or uts.is_lazy(self.lbl)
+            or self.lbl_levels is not None
+        ):
+            self.update_properties()
+            return
+        region, labels = uts.painted_labels(atoms, self.lbl.shape)
+        if len(labels) > 0:
+            self.remeasure_labels(labels, region)
+
+    def on_label_data(self, event=None):
+        """
+        Measure the labels layer again when its data was replaced.
+
+        :param event: labels layer data event
+        :return:
+        """
+        self.on_lbl_layer_selection(self.lbl_combobox.currentIndex())
+
+    @profiler.stage("remeasure")
+    def remeasure_labels(self, labels: np.ndarray, region: tuple):
+        """
+        Measure edited labels again, and update the widget with their rows.
+
+        The labels are measured on the crop of their bounding boxes (and
+        the edited region), with the settings of the current table (see
+        msr.update_props). The histogram, the sliders and the layer
+        features are updated, keeping the selected property and the
+        filters (see PropFilter.update_rows).
+        :param labels: labels changed by the edit
+        :param region: bounding box of the edit (tuple of slices)
+        :return:
+        """
+        profiler.annotate(n_objects=len(labels))
+        if self.label_boxes is None:
+            # One pass over the label image, then updated on every edit
+            self.label_boxes = msr.label_bboxes(self.lbl)
+        region = uts.union_slices(
+            [region]
+            + [
+                self.label_boxes[label]
+                for label in labels.tolist()
+                if label in self.label_boxes
+            ],
+            self.lbl.shape,
+        )
+        args = self.measure_args
+        table = msr.update_props(
+            self.prop_table,
+            self.lbl,
+            labels,
+            region,
+            intensity_image=args["intensity_image"],
+            properties=args["props"],
+            spacing=args["voxel_size"],
+            postprocess=partial(
+                self.calibrate_extra_props, voxel_size=args["voxel_size"]
+            ),
+            n_workers=self.n_workers,
+            projected=args["projected"],
+        )
+        # Bounding boxes of the labels after the edit
+        crop = np.asarray(self.lbl[region])
+        for label in labels.tolist():
+            self.label_boxes.pop(label, None)
+        self.label_boxes.update(
+            msr.label_bboxes(
+                np.where(np.isin(crop, labels), crop, 0), offset=region
+            )
+        )
+        if len(table["label"]) == 0:
+            # All labels erased
+            self.set_prop_table(table)
+            return
+        self.prop_table = table
+        self.filter_widget.update_rows(table, labels)
+        self.add_layer_properties()
+        if self.jobs.is_running("property"):
+            # Its result is for the previous table
+            self.on_prop_selection(self.prop_combobox.currentIndex())
+
     def on_img_layer_selection(self, index: int):
         """
         Callback function that "updates stuff"
@@ -512,13 +1402,16 @@ class FilterByWidget(QWidget):
         if index != -1:
             layer_name = self.img_combobox.itemText(index)
             self.img_layer_name = layer_name
-            self.img = self.viewer.layers[layer_name].data
+            self.set_image_data(self.viewer.layers[layer_name])
             scale = self.viewer.layers[layer_name].scale
-            self.check_and_set_scale(scale=scale, is_img_layer=True)
+            self.check_and_set_scale(
+                scale=self.spatial_scale(scale), is_img_layer=True
+            )
             self.update_properties()
         else:
             self.img_layer_name = None
             self.img = None
+            self.img_levels = None
             self.shape_match.setText("")
             self.shape_match.setToolTip("")
 
@@ -529,6 +1422,8 @@ class FilterByWidget(QWidget):
         :return:
         """
         layer_name = event.value.name
+        if event.value in self.data_versions:
+            self.untrack_data_changes(event.value)
         if isinstance(event.value, napari.layers.Labels):
             index = self.lbl_combobox.findText(
                 layer_name, Qt.MatchExactly
@@ -564,6 +1459,8 @@ class FilterByWidget(QWidget):
         """
         layer_name = event.value.name
         layer = self.viewer.layers[layer_name]
+        if isinstance(layer, (napari.layers.Labels, napari.layers.Image)):
+            self.track_data_changes(layer)
         if isinstance(layer, napari.layers.Labels):
             self.lbl_combobox.addItem(layer_name)
             if self.lbl_layer_name is None:
@@ -578,6 +1475,9 @@ class FilterByWidget(QWidget):
             pass
 
     def init_combo_boxes(self):
+        for layer in self.viewer.layers:
+            if isinstance(layer, (napari.layers.Labels, napari.layers.Image)):
+                self.track_data_changes(layer)
         # label layer entries
         lbl_names = [
             layer.name
@@ -606,12 +1506,17 @@ class FilterByWidget(QWidget):
             self.img_combobox.setCurrentIndex(index)
         # Set the image layer data class variable
         if self.img_layer_name is not None:
-            self.img = self.viewer.layers[self.img_combobox.itemText(0)].data
+            self.set_image_data(
+                self.viewer.layers[self.img_combobox.itemText(0)]
+            )
         # Set the label layer data class variable and load measurements
         if self.lbl_layer_name is not None:
-            self.lbl = self.viewer.layers[self.lbl_combobox.itemText(0)].data
+            layer = self.viewer.layers[self.lbl_combobox.itemText(0)]
+            self.set_label_data(layer)
+            self.watch_label_layer(layer)
+            self.update_timelapse_option()
             scale = self.viewer.layers[self.lbl_combobox.itemText(0)].scale
-            self.check_and_set_scale(scale=scale)
+            self.check_and_set_scale(scale=self.spatial_scale(scale))
             self.update_properties()
 
     def setup_layout(self) -> int:
@@ -671,6 +1576,22 @@ class FilterByWidget(QWidget):
         self.main_layout.addWidget(self.x_textbox, row, 3)
         self.main_layout.addWidget(self.set_btn, row, 4)
         row += 1
+        # Level selection of multiscale label layers
+        level_title = QLabel("Preview level")
+        level_title.setToolTip(
+            "Multiscale labels are measured on a low resolution level, "
+            "Create labels filters all levels."
+        )
+        self.level_combobox.setToolTip(
+            "Resolution level to measure (level: shape), labels too small "
+            "to appear on the level are kept by Create labels."
+        )
+        self.level_combobox.setDisabled(True)
+        self.main_layout.addWidget(
+            level_title, row, 0, alignment=Qt.AlignmentFlag.AlignLeft
+        )
+        self.main_layout.addWidget(self.level_combobox, row, 1, 1, -1)
+        row += 1
         # Checkbox for compartment measurements
         comp_title = QLabel("Measure cytoplasm and cell compartments")
         comp_title.setToolTip(
@@ -705,6 +1626,41 @@ class FilterByWidget(QWidget):
             alignment=Qt.AlignmentFlag.AlignRight,
         )
         row += 1
+        # Checkbox for time-lapse measurements
+        timelapse_title = QLabel("Time-lapse (first axis is time)")
+        timelapse_title.setToolTip(
+            "Measure the labels frame by frame, the frame shown is "
+            "measured first."
+        )
+        self.timelapse_cbx.setToolTip(
+            "Adds a 'frame' property, e.g. to filter some frames only. "
+            "Always used for 4D labels."
+        )
+        self.timelapse_cbx.setChecked(False)
+        self.timelapse_cbx.setDisabled(True)
+        self.main_layout.addWidget(
+            timelapse_title, row, 0, 1, 4, alignment=Qt.AlignmentFlag.AlignLeft
+        )
+        self.main_layout.addWidget(
+            self.timelapse_cbx, row, 4, alignment=Qt.AlignmentFlag.AlignRight
+        )
+        row += 1
+        # Checkbox to show the stage timings
+        profile_title = QLabel("Show stage timings")
+        profile_title.setToolTip(
+            "Show the time and memory used by the last measurement, "
+            "histogram, colormap and label creation."
+        )
+        self.profile_cbx.setChecked(False)
+        self.profile_info.setVisible(False)
+        self.profile_info.setWordWrap(True)
+        self.main_layout.addWidget(
+            profile_title, row, 0, 1, 4, alignment=Qt.AlignmentFlag.AlignLeft
+        )
+        self.main_layout.addWidget(
+            self.profile_cbx, row, 4, alignment=Qt.AlignmentFlag.AlignRight
+        )
+        row += 1
         # Measurement/property selection entry
         prop_title = QLabel("Measurement")
         prop_title.setToolTip("Select the measurement to filter on.")
@@ -0,0 +1,49 @@
+import numpy as np
+import numpy.testing as nt
+import pytest
+from skimage.measure import regionprops_table
+
+import napari_filter_labels_by_prop.measure as msr
+import napari_filter_labels_by_prop.utils as uts
+from napari_filter_labels_by_prop.CytoplasmLabels import CytoplasmLabels
+
+
+def _nuclei():
+    nuclei = np.zeros((4, 30, 30), dtype=np.uint16)
+    nuclei[1:3, 5:10, 5:10] = 1
+    nuclei[1:3, 15:20, 12:18] = 2
+    nuclei[2:4, 22:26, 3:8] = 3
+    return nuclei
+
+
+def test_cytoplasm_labels():
+    nuclei = _nuclei()
+    cells = uts.cell_expansion(nuclei, expansion=2)
+    cyto = CytoplasmLabels(cells, nuclei, slab_bytes=cells[0].nbytes)
+    expected = np.subtract(cells, nuclei)
+    assert cyto.shape == expected.shape
+    assert cyto.dtype == expected.dtype
+    assert cyto.chunks == (1, 30, 30)
+    nt.assert_array_equal(np.asarray(cyto), expected)
+    nt.assert_array_equal(cyto[1:3, 10:20], expected[1:3, 10:20])
+    with pytest.raises(ValueError):
+        CytoplasmLabels(cells, nuclei[1:])
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_cytoplasm_labels_measure_and_filter():
+    nuclei = _nuclei()
+    cells = uts.cell_expansion(nuclei, expansion=2)
+    cyto = CytoplasmLabels(cells, nuclei, slab_bytes=cells[0].nbytes)
+    expected = np.subtract(cells, nuclei)
+    img = np.random.default_rng(0).random(nuclei.shape)
+    props = ["label", "area", "intensity_mean", "euler_number"]
+    table = msr.measure_props(cyto, intensity_image=img, properties=props)
+    expected_table = regionprops_table(
+        expected, intensity_image=img, properties=props
+    )
+    for k in props:
+        nt.assert_allclose(table[k], expected_table[k])
+    # label creation reads the cytoplasm slab by slab
+    lut = uts.label_lut([1, 2, 3], [True, False, True], relabel=True)
+    nt.assert_array_equal(uts.apply_lut(cyto, lut), lut[expected])
@@ -0,0 +1,42 @@
+import numpy as np
+import numpy.testing as nt
+import pytest
+
+from napari_filter_labels_by_prop.FilterModel import FilterModel
+
+
+def _table():
+    return {
+        "label": np.array([1, 2, 3, 4]),
+        "area": np.array([5.0, 50.0, 500.0, 80.0]),
+        "solidity": np.array([0.5, 0.95, 0.99, np.nan]),
+    }
+
+
+def test_filter_model_and_or():
+    model = FilterModel()
+    # no filters, keep everything
+    nt.assert_array_equal(model.mask(_table()), [True] * 4)
+    model.set_range("area", 10, 100)
+    model.set_range("solidity", 0.9, None)
+    assert len(model) == 2
+    assert "area" in model
+    # NaN values are kept
+    nt.assert_array_equal(model.mask(_table()), [False, True, False, True])
+    model.combine = "OR"
+    # NaN values are neutral: label 4 is kept by its area only
+    nt.assert_array_equal(model.mask(_table()), [False, True, True, True])
+    model.set_range("area", 10, 60)
+    nt.assert_array_equal(model.mask(_table()), [False, True, True, False])
+    model.set_range("area", 10, 100)
+    assert model.describe() == "area: [10, 100] OR solidity: [0.9, -]"
+    model.remove("solidity")
+    assert model.get_range("solidity") is None
+    nt.assert_array_equal(model.mask(_table()), [False, True, False, True])
+    model.clear()
+    assert len(model) == 0
+
+
+def test_filter_model_invalid_combine():
+    with pytest.raises(ValueError):
+        FilterModel(combine="xor")
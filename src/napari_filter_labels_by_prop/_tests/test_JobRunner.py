@@ -0,0 +1,146 @@
+import threading
+from time import sleep
+
+import pytest
+
+from napari_filter_labels_by_prop.JobRunner import JobRunner
+from napari_filter_labels_by_prop.ProgressStep import ProgressStep
+
+
+def test_run_in_calling_thread():
+    jobs = JobRunner(background=False)
+    results = []
+    jobs.submit("a", lambda x: x + 1, 1, on_done=results.append)
+
+    def _generator_job(n):
+        yield from range(n)
+        return n
+
+    jobs.submit("b", _generator_job, 3, on_done=results.append)
+    assert results == [2, 3]
+    assert not jobs.is_running()
+    with pytest.raises(ValueError):
+        jobs.submit("c", int, "x")
+
+
+def test_background_job(qtbot):
+    jobs = JobRunner()
+    results = []
+    jobs.submit(
+        "a", lambda: threading.current_thread().name, on_done=results.append
+    )
+    assert jobs.wait(timeout=10)
+    assert len(results) == 1
+    assert results[0] != threading.current_thread().name
+
+
+def test_superseded_job(qtbot):
+    jobs = JobRunner()
+    results = []
+    release = threading.Event()
+
+    def _slow(value):
+        release.wait(10)
+        return value
+
+    jobs.submit("measure", _slow, "old", on_done=results.append)
+    jobs.submit("measure", _slow, "new", on_done=results.append)
+    assert jobs.is_running("measure")
+    release.set()
+    assert jobs.wait(timeout=10)
+    # only the result of the current job is applied
+    assert results == ["new"]
+
+
+def test_cancelled_job(qtbot):
+    jobs = JobRunner()
+    results = []
+    errors = []
+    release = threading.Event()
+
+    def _slow():
+        release.wait(10)
+        raise ValueError("not current anymore")
+
+    jobs.submit("a", _slow, on_done=results.append, on_error=errors.append)
+    jobs.cancel()
+    assert not jobs.is_running()
+    release.set()
+    jobs.submit("b", lambda: 1, on_done=results.append)
+    assert jobs.wait(timeout=10)
+    assert results == [1]
+    assert errors == []
+
+
+def test_yielded_values(qtbot):
+    def _frames(n):
+        yield from range(n)
+        return n
+
+    for background in (False, True):
+        jobs = JobRunner(background=background)
+        values = []
+        results = []
+        jobs.submit(
+            "frames",
+            _frames,
+            3,
+            on_yield=values.append,
+            on_done=results.append,
+            total=3,
+        )
+        assert jobs.wait(timeout=10)
+        assert values == [0, 1, 2]
+        assert results == [3]
+
+
+def test_cancelled_generator_job(qtbot):
+    jobs = JobRunner()
+    steps = []
+    closed = []
+    started = threading.Event()
+    done = threading.Event()
+
+    def _blocks(n):
+        try:
+            for i in range(n):
+                started.set()
+                steps.append(i)
+                yield ProgressStep(i + 1, n)
+                sleep(0.01)
+        finally:
+            closed.append(threading.current_thread().name)
+            done.set()
+
+    jobs.submit("measure", _blocks, 10_000, desc="Measuring")
+    assert started.wait(10)
+    jobs.cancel("measure")
+    assert done.wait(10)
+    # stopped between two steps, and closed in the worker thread
+    assert len(steps) < 10_000
+    assert closed != [threading.current_thread().name]
+
+
+def test_progress_steps(qtbot):
+    def _blocks(n):
+        for i in range(n):
+            yield ProgressStep(i + 1, n)
+            yield i
+        return n
+
+    jobs = JobRunner()
+    values = []
+    results = []
+    worker = jobs.submit(
+        "measure",
+        _blocks,
+        4,
+        on_yield=values.append,
+        on_done=results.append,
+        desc="Measuring",
+    )
+    assert jobs.wait(timeout=10)
+    # the steps set the progress bar, only the other values are applied
+    assert (worker.pbar.n, worker.pbar.total) == (4, 4)
+    assert values == [0, 1, 2, 3]
+    assert results == [4]
@@ -0,0 +1,69 @@
+import numpy as np
+import numpy.testing as nt
+from napari.layers import Labels
+
+from napari_filter_labels_by_prop.LabelArrayColormap import LabelArrayColormap
+
+
+def _label_colors(n_labels):
+    colors = np.zeros((n_labels + 1, 4), dtype=np.float32)
+    colors[1:, 0] = (np.arange(n_labels) % 5) / 4
+    colors[1:, 3] = 1
+    return colors
+
+
+def test_map_labels():
+    colors = _label_colors(100_000)
+    colors[70_000, 3] = 0
+    colormap = LabelArrayColormap(colors)
+    # 5 colors, shown labels with the same color share a texture value
+    assert colormap._num_unique_colors == 5
+    values = np.array([0, 1, 6, 70_000, 99_999, 100_000, 100_001, 2**31 - 1])
+    mapped = colormap.map(values)
+    shown = colors[values[:6], 3:] > 0
+    nt.assert_array_equal(mapped[:6], colors[values[:6]] * shown)
+    # labels outside of the array are transparent
+    nt.assert_array_equal(mapped[6:], 0)
+    nt.assert_array_equal(colormap.map(99_999), colors[99_999])
+    # the texture values index the texture colors
+    texture = colormap._data_to_texture(values.astype(np.int32))
+    assert texture.dtype == np.uint8
+    texture_colors = colormap._values_mapping_to_minimum_values_set()[1]
+    nt.assert_array_equal(
+        np.array([texture_colors[t] for t in texture]), mapped
+    )
+
+
+def test_small_dtype():
+    colors = _label_colors(300)
+    colors[2, 3] = 0
+    colormap = LabelArrayColormap(colors)
+    values = np.array([0, 1, 2, 3, 300, 301, 65535], dtype=np.uint16)
+    # uint16 labels are mapped with a color per value
+    nt.assert_array_equal(colormap._data_to_texture(values), values)
+    lut = colormap._get_mapping_from_cache(np.dtype(np.uint16))
+    nt.assert_array_equal(lut[values], colormap.map(values))
+    nt.assert_array_equal(lut[values][:, 3], [0, 1, 0, 1, 1, 0, 0])
+
+
+def test_selection():
+    colors = _label_colors(70_000)
+    colormap = LabelArrayColormap(colors, use_selection=True, selection=3)
+    values = np.array([1, 3, 69_999])
+    nt.assert_array_equal(colormap.map(values)[:, 3], [0, 1, 0])
+    nt.assert_array_equal(
+        colormap._cmap_without_selection().map(values), colors[values]
+    )
+
+
+def test_labels_layer():
+    lbl = np.arange(70_000, dtype=np.int32).reshape(280, 250)
+    colors = _label_colors(70_000)
+    colors[::2, 3] = 0
+    layer = Labels(lbl)
+    layer.colormap = LabelArrayColormap(colors)
+    assert layer.colormap is layer._direct_colormap
+    texture = layer._raw_to_displayed(lbl)
+    texture_colors = layer.colormap._texture_colors
+    nt.assert_array_equal(texture_colors[texture][..., 3], colors[lbl, 3])
+    nt.assert_array_equal(layer.get_color(69_999), colors[69_999])
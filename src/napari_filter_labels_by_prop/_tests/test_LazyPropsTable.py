@@ -0,0 +1,103 @@
+import threading
+
+import numpy as np
+import numpy.testing as nt
+import pytest
+
+import napari_filter_labels_by_prop.utils as uts
+from napari_filter_labels_by_prop.LazyPropsTable import LazyPropsTable
+from napari_filter_labels_by_prop.ProgressStep import ProgressStep, exhaust
+
+
+def _lazy_table():
+    calls = []
+
+    def loader():
+        calls.append("b")
+        return {"b-0": np.array([3, 4]), "b-1": np.array([5, 6])}
+
+    table = LazyPropsTable({"label": np.array([1, 2])})
+    table.set_lazy(["b-0", "b-1"], loader)
+    return table, calls
+
+
+def test_columns_are_computed_once():
+    table, calls = _lazy_table()
+    assert list(table.keys()) == ["label", "b-0", "b-1"]
+    assert "b-0" in table
+    assert not table.is_computed("b-0")
+    assert list(table.computed()) == ["label"]
+    assert len(calls) == 0
+    # one loader provides several columns
+    nt.assert_array_equal(table["b-1"], [5, 6])
+    assert table.is_computed("b-0")
+    nt.assert_array_equal(table["b-0"], [3, 4])
+    assert len(calls) == 1
+    with pytest.raises(KeyError):
+        table["c"]
+
+
+def test_rename_and_merge():
+    nuclei, calls = _lazy_table()
+    cells, _ = _lazy_table()
+    merged = uts.rename_dict_keys(nuclei, prefix="Nucleus")
+    merged = uts.merge_dict(merged, uts.rename_dict_keys(cells, "Cell"))
+    assert list(merged.keys()) == [
+        "label",
+        "Nucleus: b-0",
+        "Nucleus: b-1",
+        "Cell: b-0",
+        "Cell: b-1",
+    ]
+    assert len(calls) == 0
+    nt.assert_array_equal(merged["Nucleus: b-0"], [3, 4])
+    # the source table is computed (and keeps the result)
+    assert nuclei.is_computed("b-0")
+    assert not cells.is_computed("b-0")
+    with pytest.raises(KeyError):
+        uts.merge_dict(merged, uts.rename_dict_keys(cells, "Cell"))
+
+
+def test_compute_in_background():
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        started.set()
+        release.wait(10)
+        return {"b": np.array([3, 4])}
+
+    table = LazyPropsTable({"label": np.array([1, 2])})
+    table.set_lazy(["b"], loader)
+    job = threading.Thread(target=table.compute, args=(["b"],))
+    job.start()
+    assert started.wait(10)
+    # the other columns can be read while the column is computed
+    nt.assert_array_equal(table["label"], [1, 2])
+    assert list(table.computed()) == ["label"]
+    assert "b" in table
+    release.set()
+    job.join(10)
+    assert table.is_computed("b")
+    nt.assert_array_equal(table["b"], [3, 4])
+
+
+def test_generator_loader():
+    def loader():
+        for i in range(3):
+            yield ProgressStep(i + 1, 3)
+        return {"b": np.array([3, 4])}
+
+    table = LazyPropsTable({"label": np.array([1, 2])})
+    table.set_lazy(["b"], loader)
+    renamed = table.renamed("Cell")
+    # the steps of the loader, also for linked columns
+    steps = list(renamed.iter_compute(["label", "Cell: b"]))
+    assert steps == [ProgressStep(i, 3) for i in (1, 2, 3)]
+    assert table.is_computed("b")
+    assert list(table.iter_compute(["b"])) == []
+    nt.assert_array_equal(renamed["Cell: b"], [3, 4])
+    # indexing exhausts the loader
+    table.set_lazy(["b"], loader)
+    nt.assert_array_equal(table["b"], [3, 4])
+    assert exhaust(table.iter_compute(["b"])) is table
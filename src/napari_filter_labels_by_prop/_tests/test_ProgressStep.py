@@ -0,0 +1,15 @@
+from napari_filter_labels_by_prop.ProgressStep import ProgressStep, exhaust
+
+
+def test_exhaust():
+    def _job(n):
+        for i in range(n):
+            yield ProgressStep(i + 1, n)
+            yield i
+        return n
+
+    values = []
+    assert exhaust(_job(3), values.append) == 3
+    # the progress steps are not passed to on_yield
+    assert values == [0, 1, 2]
+    assert exhaust(_job(0)) == 0
@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+import numpy.testing as nt
+
+import napari_filter_labels_by_prop.PropsCache as pc
+from napari_filter_labels_by_prop.LazyPropsTable import LazyPropsTable
+from napari_filter_labels_by_prop.PropsCache import PropsCache, fingerprint
+
+
+def _table(n):
+    return {"label": np.arange(1, n + 1), "area": np.ones(n)}
+
+
+def test_fingerprint():
+    a = np.zeros((10, 10), dtype=np.uint16)
+    b = a.copy()
+    assert fingerprint(a) == fingerprint(b)
+    assert fingerprint(None) is None
+    # content, dtype and shape changes
+    b[3, 3] = 1
+    assert fingerprint(a) != fingerprint(b)
+    assert fingerprint(a) != fingerprint(a.astype(np.uint8))
+    assert fingerprint(a) != fingerprint(a.reshape(5, 20))
+
+
+def test_fingerprint_version(monkeypatch):
+    hashed = []
+    _fingerprint = pc._fingerprint
+    monkeypatch.setattr(
+        pc, "_fingerprint", lambda data: hashed.append(1) or _fingerprint(data)
+    )
+    a = np.zeros((10, 10), dtype=np.uint16)
+    key = fingerprint(a, version=0)
+    # hashed once per array object and version
+    assert fingerprint(a, version=0) == key
+    assert len(hashed) == 1
+    assert fingerprint(a.copy(), version=0) == key
+    assert len(hashed) == 2
+    a[3, 3] = 1
+    assert fingerprint(a, version=1) != key
+    assert len(hashed) == 3
+    # forgotten with the array
+    n = len(pc._fingerprints)
+    del a
+    assert len(pc._fingerprints) == n - 1
+
+
+def test_fingerprint_on_disk(tmp_path):
+    class _Store:
+        path = str(tmp_path)
+
+    class _Array:
+        # like a zarr array in a local folder
+        shape = (10, 10)
+        dtype = np.dtype(np.uint16)
+        store = _Store()
+        path = "labels"
+
+    os.makedirs(tmp_path / "labels")
+    (tmp_path / "labels" / "0.0").write_bytes(b"chunk")
+    # the same in another session (i.e. for another array object)
+    key = fingerprint(_Array())
+    assert key == fingerprint(_Array())
+    # the chunks were written
+    (tmp_path / "labels" / "0.1").write_bytes(b"chunk")
+    assert fingerprint(_Array()) != key
+
+
+def test_make_key():
+    lbl = np.ones((4, 4), dtype=int)
+    key = PropsCache.make_key(lbl, None, (1, 1), ["label", "area"])
+    assert key == PropsCache.make_key(lbl, None, (1.0, 1.0), ("label", "area"))
+    assert key != PropsCache.make_key(lbl, None, (1, 2), ["label", "area"])
+    assert key != PropsCache.make_key(lbl, lbl, (1, 1), ["label", "area"])
+    assert key != PropsCache.make_key(
+        lbl, None, (1, 1), ["label", "area"], extra_properties=(np.max,)
+    )
+
+
+def test_cache_hits_and_misses():
+    cache = PropsCache()
+    assert cache.get("a") is None
+    table = _table(10)
+    cache.put("a", table)
+    assert cache.get("a") is table
+    info = cache.info()
+    assert info["hits"] == 1
+    assert info["misses"] == 1
+    assert info["tables"] == 1
+    assert info["nbytes"] == table["label"].nbytes + table["area"].nbytes
+
+
+def test_cache_memory_limit():
+    nbytes = _table(10)["label"].nbytes * 2
+    cache = PropsCache(max_bytes=2 * nbytes)
+    cache.put("a", _table(10))
+    cache.put("b", _table(10))
+    # mark 'a' as recently used, so that 'b' is evicted
+    cache.get("a")
+    cache.put("c", _table(10))
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.nbytes <= cache.max_bytes
+    # too big tables are not cached
+    cache.put("d", _table(100))
+    assert "d" not in cache
+    assert len(cache) == 2
+
+
+def test_disk_cache(tmp_path):
+    lbl = np.ones((4, 4), dtype=int)
+    key = PropsCache.make_key(lbl, None, (1, 1), ["label", "area"])
+    cache = PropsCache(cache_dir=str(tmp_path))
+    table = LazyPropsTable(_table(10))
+    table.set_lazy(["extent"], lambda: {"extent": np.full(10, 0.5)})
+    cache.put(key, table)
+    # another session
+    other = PropsCache(cache_dir=str(tmp_path))
+    assert other.get(key) is None
+    columns = other.load(key)
+    assert list(columns) == ["label", "area"]
+    nt.assert_array_equal(columns["area"], table["area"])
+    assert other.info()["disk_hits"] == 1
+    # computed columns are added to the file
+    table["extent"]
+    cache.sync()
+    assert list(other.load(key)) == ["label", "area", "extent"]
+    assert other.load(PropsCache.make_key(lbl, None, (1, 2), ["area"])) is None
+    # corrupt files are removed
+    path = cache._path(key)
+    with open(path, "wb") as f:
+        f.write(b"no npz")
+    assert other.load(key) is None
+    assert not os.path.exists(path)
+    cache.clear(disk=True)
+    assert cache.disk_nbytes == 0
+
+
+def test_disk_cache_format(tmp_path, monkeypatch):
+    cache = PropsCache(cache_dir=str(tmp_path))
+    cache.put("a", _table(10))
+    assert PropsCache(cache_dir=str(tmp_path)).load("a") is not None
+    # files of another cache format are not used
+    monkeypatch.setattr(pc, "__cache_format__", pc.__cache_format__ + 1)
+    assert PropsCache(cache_dir=str(tmp_path)).load("a") is None
+
+
+def test_disk_cache_size_limit(tmp_path):
+    cache = PropsCache(cache_dir=str(tmp_path))
+    cache.put("a", _table(1000))
+    cache.max_disk_bytes = cache.disk_nbytes * 2 + 100
+    cache.put("b", _table(1000))
+    # mark 'a' as recently used (mtime resolution), so that 'b' is evicted
+    os.utime(cache._path("b"), (1, 1))
+    cache.load("a")
+    cache.put("c", _table(1000))
+    assert cache.load("a") is not None
+    assert cache.load("b") is None
+    assert cache.load("c") is not None
+    # in memory only
+    cache.put("d", _table(10), persist=False)
+    assert cache.load("d") is None
+    assert "d" in cache
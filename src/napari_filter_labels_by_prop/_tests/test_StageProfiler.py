@@ -0,0 +1,123 @@
+import json
+import threading
+
+import numpy as np
+import pytest
+
+from napari_filter_labels_by_prop.StageProfiler import StageProfiler
+
+
+def test_stage_records():
+    profiler = StageProfiler()
+    with profiler.stage("measure", n_objects=3) as record:
+        record["cached"] = False
+        with profiler.stage("calibrate"):
+            pass
+    # nested stages are recorded first (when they end)
+    records = profiler.records()
+    assert [r["stage"] for r in records] == ["measure/calibrate", "measure"]
+    assert records[1]["n_objects"] == 3
+    assert records[1]["cached"] is False
+    assert records[1]["time"] >= records[0]["time"] >= 0
+    # without trace_memory the peak memory is not recorded
+    assert records[1]["peak_memory"] is None
+    assert len(profiler.records("measure")) == 1
+
+
+def test_stage_decorator_and_annotate():
+    profiler = StageProfiler()
+
+    @profiler.stage("histogram")
+    def _histo(values):
+        profiler.annotate(n_objects=len(values))
+        return np.histogram(values)
+
+    _histo(np.arange(10))
+    _histo(np.arange(20))
+    summary = profiler.summary()["histogram"]
+    assert summary["calls"] == 2
+    assert summary["n_objects"] == 20
+    assert summary["mean_time"] == pytest.approx(summary["total_time"] / 2)
+    # annotate outside of a stage is ignored
+    profiler.annotate(n_objects=1)
+    assert len(profiler) == 2
+
+
+def test_stage_error():
+    profiler = StageProfiler()
+    with pytest.raises(ValueError), profiler.stage("create"):
+        raise ValueError("failed")
+    # the stage is recorded anyway
+    assert profiler.records()[0]["stage"] == "create"
+
+
+def test_trace_memory():
+    profiler = StageProfiler(trace_memory=True)
+    try:
+        with profiler.stage("outer"):
+            with profiler.stage("inner"):
+                a = np.ones(2**20, dtype=np.uint8)
+                del a
+            b = np.ones(2**18, dtype=np.uint8)
+            del b
+    finally:
+        profiler.trace_memory = False
+    records = {r["stage"]: r for r in profiler.records()}
+    assert records["outer/inner"]["peak_memory"] >= 2**20
+    # the peak of the nested stage counts for the outer stage
+    assert records["outer"]["peak_memory"] >= 2**20
+
+
+def test_trace_memory_threads():
+    profiler = StageProfiler(trace_memory=True)
+    started = threading.Event()
+    done = threading.Event()
+
+    def _job():
+        with profiler.stage("job"):
+            started.set()
+            done.wait(timeout=10)
+
+    thread = threading.Thread(target=_job)
+    try:
+        thread.start()
+        assert started.wait(timeout=10)
+        # the job's peak is not reset by a stage of another thread
+        with profiler.stage("colormap"):
+            a = np.ones(2**20, dtype=np.uint8)
+            del a
+        done.set()
+        thread.join(timeout=10)
+        with profiler.stage("next"):
+            pass
+    finally:
+        done.set()
+        profiler.trace_memory = False
+    records = {r["stage"]: r for r in profiler.records()}
+    assert records["colormap"]["peak_memory"] is None
+    # (including the allocations of the other thread)
+    assert records["job"]["peak_memory"] >= 2**20
+    # recorded again once the job is done
+    assert records["next"]["peak_memory"] is not None
+
+
+def test_callbacks_and_json(tmp_path):
+    profiler = StageProfiler()
+    stages = []
+    profiler.callbacks.append(lambda r: stages.append(r["stage"]))
+    with profiler.stage("colormap", n_objects=5):
+        pass
+    assert stages == ["colormap"]
+    assert profiler.report().startswith("colormap: ")
+    path = tmp_path / "timings.json"
+    text = profiler.to_json(str(path))
+    data = json.loads(path.read_text())
+    assert data == json.loads(text)
+    assert data["summary"]["colormap"]["n_objects"] == 5
+    profiler.clear()
+    assert len(profiler) == 0
+    # disabled profiler does not record
+    profiler.enabled = False
+    with profiler.stage("colormap"):
+        pass
+    assert len(profiler) == 0
@@ -0,0 +1,113 @@
+import csv
+import os
+
+import numpy as np
+import numpy.testing as nt
+import pytest
+from skimage.io import imread, imsave
+from skimage.measure import label, regionprops_table
+
+import napari_filter_labels_by_prop.batch as batch
+import napari_filter_labels_by_prop.utils as uts
+
+
+def _label_image(seed=0):
+    rng = np.random.default_rng(seed)
+    return label(rng.random((40, 50)) > 0.6).astype(np.uint16)
+
+
+def test_filter_labels():
+    lbl = _label_image()
+    img = np.random.default_rng(1).random(lbl.shape)
+    images, table = batch.filter_labels(
+        lbl,
+        intensity_image=img,
+        prop="intensity_mean",
+        min_value=0.4,
+        max_value=0.7,
+        relabel=True,
+        properties=["solidity"],
+    )
+    expected = regionprops_table(
+        lbl, intensity_image=img, properties=["label", "intensity_mean"]
+    )
+    keep = (expected["intensity_mean"] >= 0.4) & (
+        expected["intensity_mean"] <= 0.7
+    )
+    nt.assert_array_equal(table["keep"], keep)
+    assert "solidity" in table
+    # same as removing the labels with the widget code
+    label_map = dict(
+        zip(expected["label"], np.where(keep, expected["label"], 0))
+    )
+    nt.assert_array_equal(
+        images["labels"], uts.remove_labels(lbl, label_map, relabel=True)
+    )
+    # compartment properties require compartments
+    with pytest.raises(ValueError):
+        batch.filter_labels(lbl, prop="Cyto: area")
+
+
+def test_filter_labels_compartments():
+    lbl = _label_image()
+    img = np.random.default_rng(1).random(lbl.shape)
+    images, table = batch.filter_labels(
+        lbl,
+        intensity_image=img,
+        prop="Cyto: area",
+        min_value=30,
+        compartments=True,
+        voxel_size=(2, 1, 1),
+    )
+    assert list(images) == ["labels", "cells", "cyto"]
+    kept = table["label"][table["keep"]]
+    for img in images.values():
+        assert set(np.unique(img)) <= set(kept) | {0}
+
+
+@pytest.mark.parametrize("n_processes", [1, 2])
+def test_run_batch(tmp_path, n_processes):
+    in_dir = tmp_path / "in"
+    in_dir.mkdir()
+    for i in range(3):
+        imsave(in_dir / f"img{i}.tif", _label_image(i), check_contrast=False)
+    out_dir = tmp_path / "out"
+    results = batch.run_batch(
+        str(in_dir),
+        str(out_dir),
+        n_processes=n_processes,
+        prop="area",
+        min_value=5,
+    )
+    assert [os.path.basename(r["labels"]) for r in results] == [
+        "img0.tif",
+        "img1.tif",
+        "img2.tif",
+    ]
+    for i, r in enumerate(results):
+        filtered = imread(out_dir / f"img{i}_filtered.tif")
+        areas = np.bincount(filtered.ravel())[1:]
+        assert areas[areas > 0].min() >= 5
+        with open(out_dir / f"img{i}_props.csv") as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == r["n_labels"]
+        assert sum(row["keep"] == "True" for row in rows) == r["n_kept"]
+
+
+def test_main(tmp_path, capsys):
+    imsave(tmp_path / "a.tif", _label_image(), check_contrast=False)
+    out_dir = tmp_path / "out"
+    batch.main(
+        [
+            str(tmp_path / "*.tif"),
+            str(out_dir),
+            "--max",
+            "10",
+            "--relabel",
+            "--processes",
+            "1",
+        ]
+    )
+    assert "kept" in capsys.readouterr().out
+    assert os.path.exists(out_dir / "a_filtered.tif")
+    assert os.path.exists(out_dir / "a_props.csv")
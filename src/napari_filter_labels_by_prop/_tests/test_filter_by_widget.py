@@ -0,0 +1,116 @@
+import numpy as np
+import numpy.testing as nt
+from napari.components import ViewerModel
+from skimage.measure import label
+
+import napari_filter_labels_by_prop.measure as msr
+import napari_filter_labels_by_prop.PropsCache as pc
+from napari_filter_labels_by_prop._filter_by_widget import FilterByWidget
+from napari_filter_labels_by_prop.LabelArrayColormap import LabelArrayColormap
+
+
+def test_paint_remeasures_open_layer(qtbot, monkeypatch):
+    # no disk cache
+    monkeypatch.setenv("NAPARI_FILTER_LABELS_CACHE_DIR", "")
+    rng = np.random.default_rng(0)
+    lbl = label(rng.random((60, 80)) > 0.6).astype(np.int32)
+    viewer = ViewerModel()
+    layer = viewer.add_labels(lbl, name="labels")
+    # the layer is open before the widget is created
+    widget = FilterByWidget(viewer)
+    qtbot.addWidget(widget)
+    assert widget.jobs.wait(timeout=10)
+    assert widget.edited_layer is layer
+    # erase a label and paint a new one
+    erased = int(lbl[lbl > 0][0])
+    layer.fill(tuple(np.argwhere(lbl == erased)[0]), 0)
+    layer.selected_label = 1000
+    layer.brush_size = 5
+    layer.paint((30, 40), 1000)
+    qtbot.waitUntil(lambda: 1000 in widget.prop_table["label"], timeout=5000)
+    expected = msr.measure_props(layer.data, properties=["label", "area"])
+    nt.assert_array_equal(widget.prop_table["label"], expected["label"])
+    nt.assert_allclose(widget.prop_table["area"], expected["area"])
+    assert erased not in widget.prop_table["label"]
+    nt.assert_array_equal(
+        layer.features["index"].to_numpy(), expected["label"]
+    )
+
+
+def test_data_versions(qtbot, monkeypatch):
+    monkeypatch.setenv("NAPARI_FILTER_LABELS_CACHE_DIR", "")
+    lbl = np.zeros((20, 20), dtype=np.int32)
+    lbl[2:8, 2:8] = 1
+    viewer = ViewerModel()
+    layer = viewer.add_labels(lbl, name="labels")
+    viewer.add_image(np.ones((20, 20)), name="image")
+    widget = FilterByWidget(viewer)
+    qtbot.addWidget(widget)
+    assert widget.jobs.wait(timeout=10)
+    version = widget.data_version("labels")
+    assert version is not None
+    # painting and undo change the data (undo emits no paint event)
+    layer.paint((15, 15), 2)
+    assert widget.data_version("labels") != version
+    version = widget.data_version("labels")
+    layer.undo()
+    assert widget.data_version("labels") != version
+    # (the paint is measured once the event loop runs)
+    qtbot.wait(50)
+    widget.update_properties()
+    assert widget.jobs.wait(timeout=10)
+    # the cached table for the same data, without hashing it again
+    hits = widget.props_cache.hits
+    hashed = []
+    monkeypatch.setattr(pc, "_fingerprint", lambda data: hashed.append(1))
+    widget.update_properties()
+    assert widget.jobs.wait(timeout=10)
+    assert widget.props_cache.hits == hits + 1
+    assert hashed == []
+    # removed layers are not tracked anymore
+    viewer.layers.remove("image")
+    assert widget.data_version("image") is None
+
+
+def test_unknown_labels_transparent(qtbot, monkeypatch):
+    monkeypatch.setenv("NAPARI_FILTER_LABELS_CACHE_DIR", "")
+    lbl = np.zeros((20, 20), dtype=np.int32)
+    lbl[2:8, 2:8] = 1
+    lbl[12:18, 2:8] = 2
+    lbl[2:8, 12:18] = 3
+    viewer = ViewerModel()
+    layer = viewer.add_labels(lbl, name="labels")
+    widget = FilterByWidget(viewer)
+    qtbot.addWidget(widget)
+    assert widget.jobs.wait(timeout=10)
+    alpha = layer.colormap.map(np.array([0, 1, 2, 3, 4, 5, 700]))[:, 3]
+    # label IDs beyond the table do not cycle onto the kept labels
+    nt.assert_array_equal(alpha, [0, 1, 1, 1, 0, 0, 0])
+    # erased labels are transparent
+    layer.fill((14, 4), 0)
+    qtbot.waitUntil(lambda: 2 not in widget.prop_table["label"])
+    nt.assert_array_equal(layer.colormap.map(np.array([1, 2]))[:, 3], [1, 0])
+
+
+def test_many_labels(qtbot, monkeypatch):
+    monkeypatch.setenv("NAPARI_FILTER_LABELS_CACHE_DIR", "")
+    # more labels than a CyclicLabelColormap holds (one pixel each)
+    lbl = np.arange(1, 70_001, dtype=np.int32).reshape(280, 250)
+    viewer = ViewerModel()
+    layer = viewer.add_labels(lbl, name="labels")
+    viewer.add_image(lbl.astype(np.float32), name="image")
+    widget = FilterByWidget(viewer)
+    qtbot.addWidget(widget)
+    assert widget.jobs.wait(timeout=60)
+    assert isinstance(layer.colormap, LabelArrayColormap)
+    values = np.array([0, 1, 30_000, 70_000, 70_001], dtype=np.int32)
+    nt.assert_array_equal(layer.colormap.map(values)[:, 3], [0, 1, 1, 1, 0])
+    # hide the labels with a mean intensity (= label) below 50000
+    widget.prop_combobox.setCurrentText("intensity_mean")
+    prop_filter = widget.filter_widget
+    prop_filter.min_slider.setValue(50_000)
+    prop_filter.update_color_map()
+    nt.assert_array_equal(layer.colormap.map(values)[:, 3], [0, 0, 0, 1, 0])
+    nt.assert_array_equal(
+        layer.colormap.map(np.array(70_000)), prop_filter.label_colors[70_000]
+    )
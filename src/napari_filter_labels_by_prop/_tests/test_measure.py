@@ -0,0 +1,407 @@
+import numpy as np
+import numpy.testing as nt
+import pytest
+from scipy.ndimage import find_objects
+from skimage.measure import label, regionprops_table
+
+import napari_filter_labels_by_prop.measure as msr
+import napari_filter_labels_by_prop.utils as uts
+
+
+def _label_image(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    return label(rng.random(shape) > 0.6)
+
+
+def _assert_tables_equal(result, expected):
+    assert list(result.keys()) == list(expected.keys())
+    for k in expected:
+        nt.assert_allclose(
+            result[k], expected[k], err_msg=f"Property {k} differs."
+        )
+        assert result[k].dtype == expected[k].dtype, f"Property {k} dtype."
+
+
+@pytest.mark.parametrize("shape", [(40, 50), (6, 30, 40)])
+def test_measure_props_like_regionprops(shape):
+    lbl = _label_image(shape)
+    img = np.random.default_rng(1).random(shape)
+    props = [
+        "label",
+        "area",
+        "euler_number",
+        "intensity_max",
+        "intensity_mean",
+        "intensity_min",
+        "intensity_std",
+        "extent",
+    ]
+    spacing = (2.0,) + (0.5,) * (len(shape) - 1)
+    expected = regionprops_table(
+        lbl, intensity_image=img, properties=props, spacing=spacing
+    )
+    result = msr.measure_props(
+        lbl, intensity_image=img, properties=props, spacing=spacing
+    )
+    _assert_tables_equal(result, expected)
+
+
+def test_measure_props_multichannel():
+    lbl = _label_image((30, 40))
+    img = np.random.default_rng(1).integers(0, 1000, (30, 40, 2))
+    img = img.astype(np.uint16)
+    props = [
+        "label",
+        "intensity_mean",
+        "area",
+        "intensity_min",
+        "intensity_max",
+    ]
+    expected = regionprops_table(lbl, intensity_image=img, properties=props)
+    result = msr.measure_props(lbl, intensity_image=img, properties=props)
+    _assert_tables_equal(result, expected)
+
+
+def test_reduce_props_sparse_labels():
+    lbl = np.zeros((10, 10), dtype=np.uint64)
+    lbl[1:3, 1:3] = 5
+    lbl[5:9, 5:6] = 2**40
+    table = msr.reduce_props(lbl, properties=["label", "area"])
+    nt.assert_array_equal(table["label"], [5, 2**40])
+    nt.assert_array_equal(table["area"], [4, 4])
+
+
+def test_reduce_props_invalid_property():
+    with pytest.raises(ValueError):
+        msr.reduce_props(np.ones((3, 3), dtype=int), properties=["solidity"])
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_measure_props_chunked_like_regionprops():
+    lbl = _label_image((8, 40, 50))
+    img = np.random.default_rng(1).random((8, 40, 50, 2))
+    props = [
+        "label",
+        "area",
+        "euler_number",
+        "intensity_mean",
+        "intensity_std",
+        "intensity_max",
+        "extent",
+    ]
+    spacing = (2.0, 0.5, 0.5)
+    expected = regionprops_table(
+        lbl, intensity_image=img, properties=props, spacing=spacing
+    )
+    # Small blocks, so that many objects span block boundaries
+    result = msr.measure_props_chunked(
+        lbl,
+        intensity_image=img,
+        properties=props,
+        spacing=spacing,
+        chunks=(3, 16, 16),
+    )
+    _assert_tables_equal(result, expected)
+    # a step per block (first pass), per block and spanning object (second)
+    steps = list(
+        msr.iter_measure_props_chunked(
+            lbl,
+            intensity_image=img,
+            properties=props,
+            spacing=spacing,
+            chunks=(3, 16, 16),
+        )
+    )
+    n_blocks = 3 * 3 * 4
+    assert steps[:n_blocks] == [(i, n_blocks) for i in range(1, n_blocks + 1)]
+    assert steps[-1].done == steps[-1].total > n_blocks
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_measure_props_dask():
+    da = pytest.importorskip("dask.array")
+    lbl = _label_image((6, 30, 40))
+    img = np.random.default_rng(1).random((6, 30, 40))
+    props = ["label", "area", "intensity_min", "solidity"]
+    expected = regionprops_table(lbl, intensity_image=img, properties=props)
+    result = msr.measure_props(
+        da.from_array(lbl, chunks=(2, 15, 15)),
+        intensity_image=da.from_array(img, chunks=(3, 10, 40)),
+        properties=props,
+    )
+    _assert_tables_equal(result, expected)
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_lazy_measure_props():
+    lbl = _label_image((6, 30, 40))
+    img = np.random.default_rng(1).random((6, 30, 40))
+    props = ["label", "solidity", "area", "intensity_mean"]
+    expected = regionprops_table(lbl, intensity_image=img, properties=props)
+    table = msr.lazy_measure_props(
+        lbl,
+        intensity_image=img,
+        properties=props,
+        extra_properties=(np.sum,),
+        postprocess=lambda t: {k: v * 1 for k, v in t.items()},
+    )
+    # reduction properties come first and are computed right away
+    assert list(table.keys()) == [
+        "label",
+        "area",
+        "intensity_mean",
+        "solidity",
+        "sum",
+    ]
+    assert list(table.computed()) == ["label", "area", "intensity_mean"]
+    for k in props:
+        nt.assert_allclose(table[k], expected[k])
+    assert not table.is_computed("sum")
+    # columns measured before (e.g. loaded from the disk cache)
+    columns = {k: table[k] for k in ["label", "solidity", "area"]}
+    columns["intensity_mean"] = table["intensity_mean"]
+    reloaded = msr.lazy_measure_props(
+        lbl,
+        intensity_image=img,
+        properties=props,
+        extra_properties=(np.sum,),
+        columns=columns,
+    )
+    assert list(reloaded.keys()) == list(table.keys())
+    assert list(reloaded.computed()) == list(table.keys())[:4]
+    nt.assert_allclose(reloaded["solidity"], expected["solidity"])
+
+
+def test_update_props():
+    lbl = _label_image((6, 30, 40))
+    img = np.random.default_rng(1).random((6, 30, 40))
+    props = ["label", "area", "intensity_mean", "solidity", "extent"]
+    table = msr.lazy_measure_props(
+        lbl, intensity_image=img, properties=props, projected=True
+    )
+    table.compute(["solidity", "projected_area"])
+    # edit: grow a label, erase another one and add a new one
+    boxes = msr.label_bboxes(lbl)
+    lbl[0, :5, :5] = 1
+    erased = int(lbl[3, 15, 20] or lbl.max())
+    lbl[lbl == erased] = 0
+    new_label = int(lbl.max()) + 10
+    lbl[5, 25:, 30:] = new_label
+    labels = np.array([1, erased, new_label])
+    region = uts.union_slices(
+        [boxes[1], boxes[erased], (slice(0, 1), slice(0, 5), slice(0, 5))]
+        + [(slice(5, 6), slice(25, 30), slice(30, 40))],
+        lbl.shape,
+    )
+    # labels overwritten by the new label
+    labels = np.union1d(labels, np.unique(lbl[region][lbl[region] > 0]))
+    region = uts.union_slices(
+        [region] + [boxes[i] for i in labels if i in boxes], lbl.shape
+    )
+    updated = msr.update_props(
+        table,
+        lbl,
+        labels,
+        region,
+        intensity_image=img,
+        properties=props,
+        projected=True,
+    )
+    expected = msr.measure_props(lbl, intensity_image=img, properties=props)
+    expected.update(msr.measure_projected_props(lbl))
+    assert list(updated.keys()) == list(table.keys())
+    # columns not computed before are still lazy
+    assert list(updated.computed()) == list(table.computed())
+    for k in updated:
+        nt.assert_allclose(updated[k], expected[k], err_msg=k)
+    assert erased not in updated["label"]
+    assert new_label in updated["label"]
+
+
+def test_crop_coordinates():
+    # objects away from the origin, measured on blocks and crops
+    lbl = np.zeros((30, 40), dtype=np.int32)
+    lbl[3:8, 20:35] = 1
+    lbl[12:25, 6:14] = 2
+    lbl[14:20, 18:22] = 3
+    img = np.random.default_rng(1).random((30, 40))
+    props = ["label", "centroid", "centroid_weighted", "bbox"]
+    spacing = (2.0, 0.5)
+    expected = regionprops_table(lbl, img, properties=props, spacing=spacing)
+    result = msr.measure_props_chunked(
+        lbl, img, properties=props, spacing=spacing, chunks=(10, 16)
+    )
+    _assert_tables_equal(result, expected)
+    # edited labels, measured on the edited region
+    table = msr.lazy_measure_props(
+        lbl, intensity_image=img, properties=props, spacing=spacing
+    )
+    # e.g. loaded from the disk cache
+    for k, v in expected.items():
+        table.set_column(k, v)
+    lbl[18:22, 20:24] = 3
+    updated = msr.update_props(
+        table,
+        lbl,
+        np.array([3]),
+        (slice(14, 22), slice(18, 24)),
+        intensity_image=img,
+        properties=props,
+        spacing=spacing,
+    )
+    _assert_tables_equal(
+        updated.computed(),
+        regionprops_table(lbl, img, properties=props, spacing=spacing),
+    )
+
+
+def test_label_bboxes():
+    lbl = _label_image((20, 30))
+    boxes = msr.label_bboxes(lbl)
+    assert len(boxes) == lbl.max()
+    for i, sl in enumerate(find_objects(lbl)):
+        assert boxes[i + 1] == sl
+    # sparse label values, in a crop of a larger image
+    crop = np.zeros((4, 5), dtype=np.uint64)
+    crop[1:3, 2] = 2**40
+    boxes = msr.label_bboxes(crop, offset=(slice(10, 14), slice(20, 25)))
+    assert boxes == {2**40: (slice(11, 13), slice(22, 23))}
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_measure_objects_like_regionprops(backend):
+    lbl = _label_image((60, 70))
+    # leave out a label
+    lbl[lbl == 3] = 0
+    img = np.random.default_rng(1).random((60, 70, 2))
+    props = [
+        "label",
+        "area",
+        "perimeter",
+        "solidity",
+        "eccentricity",
+        "euler_number",
+        "intensity_mean",
+        # coordinates, measured on the object crops
+        "centroid",
+        "centroid_weighted",
+        "bbox",
+    ]
+    expected = regionprops_table(
+        lbl, intensity_image=img, properties=props, spacing=(0.5, 0.5)
+    )
+    result = msr.measure_objects(
+        lbl,
+        intensity_image=img,
+        properties=props,
+        spacing=(0.5, 0.5),
+        n_workers=2,
+        backend=backend,
+    )
+    _assert_tables_equal(result, expected)
+    # a step per batch of objects, 4 per worker
+    steps = list(msr.iter_measure_objects(lbl, n_workers=2, backend=backend))
+    assert steps == [(i, 8) for i in range(1, 9)]
+
+
+def test_measure_objects_invalid_backend():
+    with pytest.raises(ValueError):
+        msr.measure_objects(np.ones((3, 3), dtype=int), backend="gpu")
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_measure_projected_props(n_workers):
+    lbl = _label_image((5, 30, 40))
+    extra = (
+        uts.projected_area,
+        uts.projected_convex_area,
+        uts.projected_circularity,
+        uts.projected_perimeter,
+    )
+    expected = regionprops_table(
+        lbl, properties=["label"], extra_properties=extra
+    )
+    result = msr.measure_projected_props(lbl, n_workers=n_workers)
+    _assert_tables_equal(result, expected)
+    # lazily loaded labels
+    da = pytest.importorskip("dask.array")
+    lazy_lbl = da.from_array(lbl, chunks=(2, 15, 15))
+    result = msr.measure_projected_props(lazy_lbl)
+    _assert_tables_equal(result, expected)
+    # with lazy_measure_props, the projected props are measured together
+    table = msr.lazy_measure_props(lbl, projected=True)
+    assert list(table.keys()) == ["label"] + msr.__projected_props__
+    nt.assert_allclose(table["projected_area"], expected["projected_area"])
+    assert table.is_computed("projected_perimeter")
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_lazy_measure_compartments():
+    nuclei = np.zeros((30, 40), dtype=np.int32)
+    nuclei[3:8, 3:8] = 1
+    nuclei[10:16, 20:30] = 2
+    # nucleus 3 fills its whole cell, so it has no cytoplasm
+    nuclei[25:30, 0:40] = 3
+    cells = uts.cell_expansion(nuclei, expansion=3)
+    cells[(cells == 3) & (nuclei == 0)] = 0
+    cyto = np.where(nuclei == 0, cells, 0)
+    img = np.random.default_rng(1).random((30, 40, 2))
+    props = [
+        "label",
+        "area",
+        "intensity_mean",
+        "intensity_std",
+        "intensity_max",
+        "intensity_min",
+        "solidity",
+    ]
+    tables = msr.lazy_measure_compartments(
+        nuclei,
+        cells,
+        cyto,
+        intensity_image=img,
+        properties=props,
+        spacing=(2, 2),
+    )
+    for name, lbl in (("Nucleus", nuclei), ("Cell", cells), ("Cyto", cyto)):
+        table = tables[name]
+        expected = regionprops_table(
+            lbl, intensity_image=img, properties=props, spacing=(2, 2)
+        )
+        nt.assert_array_equal(table["label"], [1, 2, 3])
+        rows = np.searchsorted(table["label"], expected["label"])
+        for k in expected:
+            nt.assert_allclose(table[k][rows], expected[k], err_msg=k)
+    # the cytoplasm of label 3 is empty
+    assert tables["Cyto"]["area"][2] == 0
+    assert np.isnan(tables["Cyto"]["intensity_mean-0"][2])
+    assert np.isnan(tables["Cyto"]["solidity"][2])
+
+
+def test_concat_frame_tables():
+    movie = np.stack([_label_image((20, 30), seed=t) for t in range(3)])
+    # the second frame has no labels
+    movie[1] = 0
+    tables = {
+        t: msr.lazy_measure_props(movie[t], properties=["label", "extent"])
+        for t in (2, 0, 1)
+    }
+    table = msr.concat_frame_tables(tables)
+    assert list(table.keys()) == ["label", "frame", "extent"]
+    # rows in frame order, labels repeat in every frame
+    n0, n2 = movie[0].max(), movie[2].max()
+    nt.assert_array_equal(table["frame"], [0] * n0 + [2] * n2)
+    nt.assert_array_equal(table["label"][n0:], np.arange(1, n2 + 1))
+    assert table["label"].dtype == tables[0]["label"].dtype
+    # shape properties are measured on demand, per frame
+    assert not table.is_computed("extent")
+    table.compute(["extent"])
+    assert tables[2].is_computed("extent")
+    expected = regionprops_table(movie[2], properties=["extent"])["extent"]
+    nt.assert_allclose(table["extent"][n0:], expected)
+    # no labels at all
+    empty = msr.concat_frame_tables({1: tables[1]})
+    assert len(empty["label"]) == 0
+    assert list(empty.keys())[:2] == ["label", "frame"]
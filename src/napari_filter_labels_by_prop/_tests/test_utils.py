@@ -1,3 +1,5 @@
+from typing import NamedTuple
+
 import numpy as np
 import numpy.testing as nt
 import pytest
@@ -78,6 +80,137 @@ def test_remove_labels():
     )
 
 
+def test_label_lut():
+    labels = np.array([2, 5, 300, 7])
+    keep = np.array([True, False, True, True])
+    lut = uts.label_lut(labels, keep)
+    assert lut.dtype == np.uint16
+    assert len(lut) == 302
+    nt.assert_array_equal(lut[labels], [2, 0, 300, 7])
+    # relabelled in label order, smallest dtype
+    lut = uts.label_lut(labels, keep, relabel=True)
+    assert lut.dtype == np.uint8
+    nt.assert_array_equal(lut[labels], [1, 0, 3, 2])
+    # labels missing from the table (or larger) are removed
+    img = np.array([[0, 2, 3], [5, 7, 1000]], dtype=np.uint64)
+    nt.assert_array_equal(uts.apply_lut(img, lut), [[0, 1, 0], [0, 2, 0]])
+    # into an output buffer
+    out = np.ones(img.shape, dtype=np.int32)
+    result = uts.apply_lut(img, lut, out=out)
+    assert result is out
+    nt.assert_array_equal(out, [[0, 1, 0], [0, 2, 0]])
+
+
+def test_keep_unmeasured():
+    # label 2 is too small to appear on the coarse level
+    full = np.zeros((20, 20), dtype=np.uint16)
+    full[2:18, 2:10] = 1
+    full[5, 13] = 2
+    full[14:18, 12:18] = 3
+    coarse = full[::2, ::2]
+    assert 2 not in coarse
+    table = regionprops_table(coarse, properties=["label"])
+    nt.assert_array_equal(table["label"], [1, 3])
+    assert uts.max_label(full) == 3
+    da = pytest.importorskip("dask.array")
+    assert uts.max_label(da.from_array(full, chunks=(7, 7))) == 3
+    # filtering out label 1 keeps the unmeasured label 2 on all levels
+    keep = np.array([False, True])
+    lut = uts.label_lut(table["label"], keep)
+    assert uts.apply_lut(full, lut)[5, 13] == 0
+    lut = uts.keep_unmeasured(lut, table["label"], uts.max_label(full))
+    nt.assert_array_equal(lut[[0, 1, 2, 3]], [0, 0, 2, 3])
+    nt.assert_array_equal(np.unique(uts.apply_lut(full, lut)), [0, 2, 3])
+    nt.assert_array_equal(np.unique(uts.apply_lut(coarse, lut)), [0, 3])
+    # relabelled, without colliding with the relabelled labels
+    keep = np.array([True, True])
+    lut = uts.label_lut(table["label"], keep, relabel=True)
+    new_lut = uts.keep_unmeasured(lut, table["label"], 3, relabel=True)
+    nt.assert_array_equal(new_lut[[0, 1, 2, 3]], [0, 1, 4, 2])
+    # labels beyond the table are kept too (larger dtype if needed)
+    new_lut = uts.keep_unmeasured(lut, table["label"], 300, relabel=True)
+    assert new_lut.dtype == np.uint16
+    assert len(new_lut) == 302
+    assert new_lut[300] == 302
+    assert uts.apply_lut(np.array([301]), lut)[0] == 0
+
+
+def test_apply_lut_many():
+    rng = np.random.default_rng(0)
+    nuclei = rng.integers(0, 20, (6, 10, 10))
+    cells = rng.integers(0, 20, (6, 10, 10))
+    keep = np.arange(1, 20) % 3 > 0
+    lut = uts.label_lut(np.arange(1, 20), keep, relabel=True)
+    outs = uts.apply_lut_many([nuclei, cells], lut, n_workers=3)
+    for img, out in zip([nuclei, cells], outs):
+        nt.assert_array_equal(out, lut[img])
+    # single threaded
+    out = uts.apply_lut_many([nuclei], lut)[0]
+    nt.assert_array_equal(out, lut[nuclei])
+    # a step per slab (of every image)
+    steps = list(uts.iter_apply_lut_many([nuclei, cells], lut))
+    assert steps == [(1, 2), (2, 2)]
+
+
+def test_frame_luts():
+    # label 2 is in both frames, but only kept in frame 1
+    frames = np.array([0, 0, 1, 1, 1])
+    labels = np.array([2, 3, 2, 5, 300])
+    keep = np.array([False, True, True, False, True])
+    luts = uts.frame_luts(frames, labels, keep)
+    assert sorted(luts) == [0, 1]
+    assert all(lut.dtype == np.uint16 for lut in luts.values())
+    nt.assert_array_equal(luts[0][[2, 3]], [0, 3])
+    nt.assert_array_equal(luts[1][[2, 5, 300]], [2, 0, 300])
+    # relabelled consistently in all frames
+    luts = uts.frame_luts(frames, labels, keep, relabel=True)
+    nt.assert_array_equal(luts[0][[2, 3]], [0, 2])
+    nt.assert_array_equal(luts[1][[2, 5, 300]], [1, 0, 3])
+    movie = np.array([[[2, 3]], [[2, 5]], [[2, 3]]])
+    out = uts.apply_frame_luts(movie, luts)
+    # the last frame has no table, and is removed
+    nt.assert_array_equal(out, [[[0, 2]], [[1, 0]], [[0, 0]]])
+    nt.assert_array_equal(uts.frame_rows({"frame": frames}, 1), [2, 3, 4])
+    assert uts.frame_rows({"label": labels}, 1) == slice(None)
+
+
+@pytest.mark.parametrize("ext", [".npy", ".zarr"])
+def test_apply_lut_to_disk(tmp_path, ext):
+    if ext == ".zarr":
+        pytest.importorskip("zarr")
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 20, (6, 10, 10))
+    lut = uts.label_lut(np.arange(1, 20), np.arange(1, 20) % 3 > 0)
+    path = str(tmp_path / f"labels{ext}")
+    # chunks of 2 slabs of 3 rows
+    out = uts.create_output(
+        img.shape, lut.dtype, path=path, chunks=(3, 10, 10)
+    )
+    out = uts.apply_lut_many([img], lut, outs=[out], n_workers=2)[0]
+    assert not isinstance(out, np.ndarray) or isinstance(out, np.memmap)
+    nt.assert_array_equal(out[:], lut[img])
+    # frame by frame
+    luts = uts.frame_luts(np.array([0, 1]), np.array([3, 4]), [True, True])
+    path = uts.unique_path(path)
+    assert path.endswith(f"labels-2{ext}")
+    out = uts.create_output(img.shape, np.uint8, path=path, chunks=(1, 10, 10))
+    out = uts.apply_frame_luts(img, luts, out=out)
+    nt.assert_array_equal(out[0], np.where(img[0] == 3, 3, 0))
+    nt.assert_array_equal(out[2:], 0)
+
+
+def test_remove_labels_sparse():
+    img = np.array([[0, 2**40, 3], [5, 2**40, 3]], dtype=np.uint64)
+    label_map = {3: 3, 5: 0, 2**40: 2**40}
+    nt.assert_array_equal(
+        uts.remove_labels(img, label_map), [[0, 2**40, 3], [0, 2**40, 3]]
+    )
+    nt.assert_array_equal(
+        uts.remove_labels(img, label_map, relabel=True),
+        [[0, 2, 1], [0, 2, 1]],
+    )
+
+
 @pytest.mark.skip(reason="Deprecated")
 def test_remove_label_objects():
     # Fixme: maybe I should have the same dtype as when loaded from napari?
@@ -187,7 +320,124 @@ def test_projected_extra_props():
     )
 
 
+def test_histogram():
+    values = np.random.default_rng(0).lognormal(size=100000)
+    values[:10] = np.nan
+    counts, bins = uts.histogram(values, max_bins=100)
+    # bounded number of bins, NaN values are ignored
+    assert len(counts) == 100
+    assert len(bins) == 101
+    assert counts.sum() == len(values) - 10
+    # few values, Sturges estimate
+    counts, bins = uts.histogram(np.arange(16))
+    assert len(counts) == 5
+    # no finite values
+    counts, bins = uts.histogram(np.full(3, np.nan))
+    assert counts.sum() == 0
+
+
+def test_patch_histogram():
+    values = np.random.default_rng(0).random(1000)
+    counts, bins = uts.histogram(values)
+    patched = values.copy()
+    patched[:10] = 0.5
+    patched[10] = np.nan
+    result = uts.patch_histogram(
+        counts, bins, removed=values[:11], added=patched[:11]
+    )
+    nt.assert_array_equal(result[0], np.histogram(patched, bins=bins)[0])
+    # values outside of the bins
+    assert uts.patch_histogram(counts, bins, values[:1], [2.0]) is None
+
+
+def test_painted_labels():
+    class Atom(NamedTuple):
+        slice_key: tuple
+        mask: np.ndarray
+        old_values: np.ndarray
+        new_value: int
+
+    atoms = [
+        Atom((slice(2, 4), slice(5, 9)), None, np.array([0, 3, 3, 1]), 7),
+        # data_setitem atom
+        (
+            (np.array([10, 12]), np.array([1, 0])),
+            np.array([0, 2]),
+            np.array([0, 0]),
+        ),
+    ]
+    region, labels = uts.painted_labels(atoms, (20, 30))
+    assert region == (slice(2, 13), slice(0, 9))
+    nt.assert_array_equal(labels, [1, 2, 3, 7])
+    region, labels = uts.painted_labels([], (20, 30))
+    assert len(labels) == 0
+
+
+@pytest.mark.parametrize("spacing", [(1, 1, 1), (2, 0.5, 0.5)])
+def test_tiled_cell_expansion(spacing):
+    rng = np.random.default_rng(0)
+    lbl = np.zeros((12, 40, 40), dtype=np.int32)
+    positions = rng.choice(lbl.size, 50, replace=False)
+    lbl.flat[positions] = np.arange(1, 51)
+    expected = uts.cell_expansion(lbl, spacing=spacing, expansion=3)
+    result = uts.cell_expansion(
+        lbl, spacing=spacing, expansion=3, tile_shape=(5, 16, 12)
+    )
+    nt.assert_array_equal(result, expected)
+    # tiled expansion via the maximum tile size
+    cells, cyto = uts.create_cell_cyto_masks(
+        lbl, expansion=3, voxel_size=spacing, max_tile_voxels=2000
+    )
+    nt.assert_array_equal(cells, expected)
+    # a step per tile
+    tile_shape = uts.expansion_tile_shape(lbl.shape, 2000)
+    n_tiles = len(list(uts.chunk_slices(lbl.shape, tile_shape)))
+    steps = list(
+        uts.iter_create_cell_cyto_masks(
+            lbl, expansion=3, voxel_size=spacing, max_tile_voxels=2000
+        )
+    )
+    assert steps == [(i, n_tiles) for i in range(1, n_tiles + 1)]
+
+
+def test_expansion_tile_shape():
+    assert uts.expansion_tile_shape((10, 100, 60), 10**6) == (10, 100, 60)
+    assert uts.expansion_tile_shape((10, 100, 60), 10000) == (10, 25, 30)
+
+
+def test_chunk_slices():
+    # zarr style chunk shape
+    slices = list(uts.chunk_slices((5, 4), (2, 4)))
+    assert slices == [
+        (slice(0, 2), slice(0, 4)),
+        (slice(2, 4), slice(0, 4)),
+        (slice(4, 5), slice(0, 4)),
+    ]
+    # dask style chunks
+    slices = list(uts.chunk_slices((5, 4), ((3, 2), (1, 3))))
+    assert len(slices) == 4
+    assert slices[-1] == (slice(3, 5), slice(1, 4))
+    # no chunks
+    assert list(uts.chunk_slices((5, 4))) == [(slice(0, 5), slice(0, 4))]
+
+
 if __name__ == "__main__":
     test_remove_labels()
 # test_remove_indices()
 # test_remove_labels()
+
+
+def test_multiscale_levels():
+    levels = [np.zeros((8, 400, 600)), np.zeros((8, 200, 300))]
+    levels.append(np.zeros((8, 100, 150)))
+    shapes = [level.shape for level in levels]
+    assert uts.preview_level(shapes, max_voxels=10**6) == 1
+    assert uts.preview_level(shapes, max_voxels=10**8) == 0
+    # the coarsest level, if all are too large
+    assert uts.preview_level(shapes, max_voxels=10) == 2
+    assert uts.level_factors(levels, 2, ndim=2) == (4.0, 4.0)
+    assert uts.level_factors(levels, 1, ndim=3) == (1.0, 2.0, 2.0)
+    # images with channels
+    images = [np.zeros(s + (2,)) for s in shapes]
+    assert uts.matching_level(images, shapes[1]) is images[1]
+    assert uts.matching_level(images, (8, 10, 10)) is images[0]
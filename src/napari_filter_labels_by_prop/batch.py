@@ -0,0 +1,332 @@
+"""
+Filter label images without napari, e.g. for many images at once.
+
+Uses the same measurement (measure.lazy_measure_props and
+lazy_measure_compartments) and label removal (utils.label_lut) as the
+widget, so that the results match the ones of the plugin.
+
+Python API:
+    filter_labels: filter a single label image (in memory)
+    process_file: filter a label image file and write the results
+    run_batch: process many files in a process pool
+
+Command line (see main):
+    filter-labels-by-prop LABELS OUT_DIR --prop area --min 50 --relabel
+"""
+
+import argparse
+import csv
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from skimage.io import imread, imsave
+
+import napari_filter_labels_by_prop.measure as msr
+import napari_filter_labels_by_prop.utils as uts
+
+# File extensions of images found in directories
+__image_extensions__ = (".tif", ".tiff", ".png")
+
+
+def filter_labels(
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    prop: str = "area",
+    min_value: Optional[float] = None,
+    max_value: Optional[float] = None,
+    relabel: bool = False,
+    compartments: bool = False,
+    voxel_size: Optional[Sequence[float]] = None,
+    properties: Optional[Sequence[str]] = None,
+    expansion: float = 5,
+    n_workers: int = 1,
+) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """
+    Filter a label image by a property range, like the widget does.
+
+    Labels with a property value outside [min_value, max_value] are
+    removed (NaN values are kept, like in the widget).
+
+    :param lbl: label image
+    :param intensity_image: intensity image of same shape as lbl,
+                            optionally with channels on the last axis
+    :param prop: property to filter on, with compartment prefix if
+                 compartments are used (e.g. 'Cyto: intensity_mean')
+    :param min_value: minimum value, None for no minimum
+    :param max_value: maximum value, None for no maximum
+    :param relabel: whether to relabel the kept labels sequentially
+    :param compartments: whether to create and measure cell and cytoplasm
+                         masks (the labels are nuclei)
+    :param voxel_size: (Z)YX voxel size, default 1 for all axes
+    :param properties: additional properties to measure (and to write)
+    :param expansion: expansion of nuclei to cells (calibrated units)
+    :param n_workers: number of threads
+    :return: dict of filtered images ('labels', and 'cells', 'cyto' with
+             compartments), props table (with a 'keep' column)
+    """
+    voxel_size = _voxel_size(voxel_size, lbl.ndim)
+    # Measure the default properties of the widget, the filter property
+    # and the requested properties (without compartment prefix)
+    props = ["label", "area"]
+    if intensity_image is not None:
+        props += [p for p in msr.__reduction_props__ if p not in props]
+    for p in list(properties or []) + [prop]:
+        p = p.split(": ")[-1]
+        if p not in props and p not in msr.__projected_props__:
+            props.append(p)
+    projected = any(
+        p.split(": ")[-1] in msr.__projected_props__
+        for p in list(properties or []) + [prop]
+    )
+    postprocess = partial(uts.calibrate_extra_props, voxel_size=voxel_size)
+
+    images = {"labels": lbl}
+    if compartments:
+        cells, cyto = uts.create_cell_cyto_masks(
+            lbl, expansion=expansion, voxel_size=voxel_size
+        )
+        images.update(cells=cells, cyto=cyto)
+        table = msr.merge_compartment_tables(
+            msr.lazy_measure_compartments(
+                lbl,
+                cells,
+                cyto,
+                intensity_image=intensity_image,
+                properties=props,
+                spacing=voxel_size,
+                postprocess=postprocess,
+                n_workers=n_workers,
+                projected=projected,
+            )
+        )
+    else:
+        table = msr.lazy_measure_props(
+            lbl,
+            intensity_image=intensity_image,
+            properties=props,
+            spacing=voxel_size,
+            postprocess=postprocess,
+            n_workers=n_workers,
+            projected=projected,
+        )
+    if prop not in table:
+        raise ValueError(
+            f"Property '{prop}' was not measured. "
+            f"Available properties: {list(table.keys())}"
+        )
+    # Same filtering as in the widget
+    keep = uts.keep_in_range(table[prop], min_value, max_value)
+    lut = uts.label_lut(table["label"], keep, relabel=relabel)
+    names = list(images)
+    filtered = uts.apply_lut_many(
+        [images[n] for n in names], lut, n_workers=n_workers
+    )
+    table = {k: table[k] for k in table}
+    table["keep"] = keep
+    return dict(zip(names, filtered)), table
+
+
+def process_file(
+    lbl_path: str,
+    out_dir: str,
+    intensity_path: Optional[str] = None,
+    **kwargs,
+) -> dict:
+    """
+    Filter a label image file and write the results to out_dir.
+
+    Writes <name>_filtered.tif (and <name>_cells.tif, <name>_cyto.tif with
+    compartments) and the props table as <name>_props.csv.
+    :param lbl_path: label image file
+    :param out_dir: output directory
+    :param intensity_path: optional intensity image file
+    :param kwargs: filter options, see filter_labels
+    :return: summary dict with the file names and label counts
+    """
+    lbl = imread(lbl_path)
+    intensity_image = None
+    if intensity_path is not None:
+        intensity_image = imread(intensity_path)
+    images, table = filter_labels(lbl, intensity_image, **kwargs)
+    name = os.path.splitext(os.path.basename(lbl_path))[0]
+    outputs = []
+    suffixes = {"labels": "filtered", "cells": "cells", "cyto": "cyto"}
+    for k, img in images.items():
+        path = os.path.join(out_dir, f"{name}_{suffixes[k]}.tif")
+        imsave(path, img, check_contrast=False)
+        outputs.append(path)
+    table_path = os.path.join(out_dir, f"{name}_props.csv")
+    write_table(table, table_path)
+    outputs.append(table_path)
+    return {
+        "labels": lbl_path,
+        "intensity": intensity_path,
+        "n_labels": len(table["label"]),
+        "n_kept": int(np.count_nonzero(table["keep"])),
+        "outputs": outputs,
+    }
+
+
+def run_batch(
+    labels: Union[str, Sequence[str]],
+    out_dir: str,
+    intensity: Union[str, Sequence[str], None] = None,
+    n_processes: Optional[int] = None,
+    **kwargs,
+) -> List[dict]:
+    """
+    Filter many label image files in a process pool.
+
+    Every file is read, filtered and written by one process, so only
+    the summaries are sent back.
+    :param labels: directory, glob pattern or list of label image files
+    :param out_dir: output directory (created if needed)
+    :param intensity: directory, glob pattern or list of intensity image
+                      files, matched to the label images in sorted order
+    :param n_processes: number of processes, default is the CPU count
+    :param kwargs: filter options, see filter_labels
+    :return: list of summaries (see process_file), in file order
+    """
+    lbl_paths = find_images(labels)
+    img_paths = [None] * len(lbl_paths)
+    if intensity is not None:
+        img_paths = find_images(intensity)
+        if len(img_paths) != len(lbl_paths):
+            raise ValueError(
+                f"Found {len(lbl_paths)} label images, "
+                f"but {len(img_paths)} intensity images."
+            )
+    os.makedirs(out_dir, exist_ok=True)
+    if n_processes is None:
+        n_processes = os.cpu_count() or 1
+    if n_processes <= 1:
+        return [
+            process_file(lbl_path, out_dir, img_path, **kwargs)
+            for lbl_path, img_path in zip(lbl_paths, img_paths)
+        ]
+    results = [None] * len(lbl_paths)
+    with ProcessPoolExecutor(max_workers=n_processes) as pool:
+        futures = {
+            pool.submit(process_file, lbl_path, out_dir, img_path, **kwargs): i
+            for i, (lbl_path, img_path) in enumerate(zip(lbl_paths, img_paths))
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+
+def find_images(pattern: Union[str, Sequence[str]]) -> List[str]:
+    """
+    Find image files.
+
+    :param pattern: directory, glob pattern or list of files
+    :return: sorted list of files
+    """
+    if not isinstance(pattern, str):
+        return list(pattern)
+    if os.path.isdir(pattern):
+        return sorted(
+            os.path.join(pattern, f)
+            for f in os.listdir(pattern)
+            if f.lower().endswith(__image_extensions__)
+        )
+    return sorted(glob.glob(pattern))
+
+
+def write_table(table: Dict[str, np.ndarray], path: str):
+    """
+    Write a props table as csv file (one row per label).
+
+    :param table: props table
+    :param path: csv file path
+    :return:
+    """
+    keys = list(table.keys())
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(keys)
+        writer.writerows(zip(*(np.asarray(table[k]).tolist() for k in keys)))
+
+
+def _voxel_size(
+    voxel_size: Optional[Sequence[float]], ndim: int
+) -> Tuple[float, ...]:
+    """
+    Voxel size with one entry per image axis.
+
+    :param voxel_size: (Z)YX voxel size or None
+    :param ndim: number of image dimensions
+    :return: voxel size tuple
+    """
+    if voxel_size is None:
+        return (1.0,) * ndim
+    # e.g. ZYX voxel size for 2D images
+    return tuple(float(v) for v in voxel_size)[-ndim:]
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    """
+    Command line interface, see filter-labels-by-prop --help.
+
+    :param argv: command line arguments, default sys.argv
+    :return:
+    """
+    parser = argparse.ArgumentParser(
+        prog="filter-labels-by-prop",
+        description="Filter label images by a property range.",
+    )
+    parser.add_argument(
+        "labels", help="label image directory, file or glob pattern"
+    )
+    parser.add_argument("out_dir", help="output directory")
+    parser.add_argument(
+        "--intensity",
+        help="intensity image directory or glob pattern "
+        "(matched to the label images in sorted order)",
+    )
+    parser.add_argument(
+        "--prop", default="area", help="property to filter on (area)"
+    )
+    parser.add_argument("--min", type=float, help="minimum property value")
+    parser.add_argument("--max", type=float, help="maximum property value")
+    parser.add_argument(
+        "--relabel", action="store_true", help="relabel the kept labels"
+    )
+    parser.add_argument(
+        "--compartments",
+        action="store_true",
+        help="measure (and filter) nuclei, cells and cytoplasm",
+    )
+    parser.add_argument(
+        "--voxel-size", type=float, nargs="+", help="(Z)YX voxel size"
+    )
+    parser.add_argument(
+        "--properties", nargs="+", help="additional properties to measure"
+    )
+    parser.add_argument(
+        "--processes", type=int, help="number of processes (CPU count)"
+    )
+    args = parser.parse_args(argv)
+    results = run_batch(
+        args.labels,
+        args.out_dir,
+        intensity=args.intensity,
+        n_processes=args.processes,
+        prop=args.prop,
+        min_value=args.min,
+        max_value=args.max,
+        relabel=args.relabel,
+        compartments=args.compartments,
+        voxel_size=args.voxel_size,
+        properties=args.properties,
+    )
+    for r in results:
+        print(f"{r['labels']}: kept {r['n_kept']} of {r['n_labels']} labels")
+
+
+if __name__ == "__main__":
+    main()
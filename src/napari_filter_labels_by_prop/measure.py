@@ -0,0 +1,1607 @@
+"""
+Measurement of label properties.
+
+regionprops_table creates a RegionProperties object for every label,
+which is slow when there are many labels. Properties that are simple
+reductions over the voxels of a label (size and intensity statistics)
+are computed here for all labels at once with bincount. Only the
+remaining (shape) properties are measured with regionprops.
+
+Lazily loaded (dask or zarr) arrays are measured block by block,
+see measure_props_chunked.
+
+lazy_measure_props only computes the reduction properties right away,
+other properties are computed when they are first accessed.
+
+Shape properties can be measured in parallel per object (on the
+bounding box crops of the objects), see measure_objects.
+
+The projected shape properties of 3D labels are measured together,
+with a single projection per object, see measure_projected_props.
+
+Time-lapse label images are measured frame by frame, the frame tables
+are combined with concat_frame_tables.
+
+Edited labels (e.g. painted in napari) are measured again on the crop
+of their bounding box, see update_props.
+
+The long measurements have generator versions (iter_*), which yield a
+ProgressStep per block or batch of objects, so that background jobs can
+report their progress and be cancelled.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import (
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from scipy.ndimage import find_objects
+from skimage.measure import regionprops, regionprops_table
+
+import napari_filter_labels_by_prop.utils as uts
+from napari_filter_labels_by_prop.LazyPropsTable import LazyPropsTable
+from napari_filter_labels_by_prop.ProgressStep import ProgressStep, exhaust
+from napari_filter_labels_by_prop.StageProfiler import profiler
+
+# Properties that can be computed as reductions over the label voxels
+__reduction_props__ = [
+    "label",
+    "area",
+    "intensity_max",
+    "intensity_mean",
+    "intensity_min",
+    "intensity_std",
+]
+
+# Properties in image coordinates, which are shifted to the image when
+# measured on a crop (see _offset_coordinates): {property: whether the
+# values are scaled by the voxel size}
+__coordinate_props__ = {
+    "bbox": False,
+    "centroid": True,
+    "centroid_weighted": True,
+    "coords": False,
+    "coords_scaled": True,
+    "slice": False,
+}
+
+# Properties of the Z-projected labels (see measure_projected_props)
+__projected_props__ = [
+    "projected_area",
+    "projected_convex_area",
+    "projected_circularity",
+    "projected_perimeter",
+]
+
+
+def measure_props(
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label",),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    n_workers: int = 1,
+) -> Dict[str, np.ndarray]:
+    """
+    Measure label properties, like skimage's regionprops_table.
+
+    Reduction properties (see __reduction_props__) are computed with
+    bincount, all other properties and the extra_properties are measured
+    with regionprops_table (or measure_objects if n_workers > 1).
+    Returns the same dict layout as regionprops_table, i.e. keys in order
+    of the properties, with '-<channel>' suffixes for multichannel
+    intensity images, followed by the extra properties.
+
+    :param lbl: label image
+    :param intensity_image: intensity image of same shape as lbl,
+                            optionally with channels on the last axis
+    :param properties: list of properties to measure
+    :param extra_properties: functions passed to regionprops_table
+    :param spacing: (Z)YX voxel size
+    :param n_workers: number of threads for the shape properties
+    :return: dict of {property: array}
+    """
+    return exhaust(
+        iter_measure_props(
+            lbl,
+            intensity_image=intensity_image,
+            properties=properties,
+            extra_properties=extra_properties,
+            spacing=spacing,
+            n_workers=n_workers,
+        )
+    )
+
+
+def iter_measure_props(
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label",),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    n_workers: int = 1,
+) -> Generator[ProgressStep, None, Dict[str, np.ndarray]]:
+    """
+    Measure label properties step by step.
+
+    Generator version of measure_props, which yields a ProgressStep per
+    block of lazy arrays, or per batch of objects for the shape properties.
+    :return: yields ProgressSteps, returns dict of {property: array}
+    """
+    with profiler.stage("measure_props"):
+        # Do not load lazy arrays into memory as a whole
+        if uts.is_lazy(lbl) or uts.is_lazy(intensity_image):
+            return (
+                yield from iter_measure_props_chunked(
+                    lbl,
+                    intensity_image=intensity_image,
+                    properties=properties,
+                    extra_properties=extra_properties,
+                    spacing=spacing,
+                )
+            )
+        # Which properties can use the fast path
+        fast, slow = _split_props(properties, intensity_image)
+
+        fast_table = reduce_props(
+            lbl,
+            intensity_image=intensity_image,
+            properties=fast,
+            spacing=spacing,
+        )
+        if len(slow) == 0 and not extra_properties:
+            return fast_table
+
+        # Shape descriptors need the per-object geometry
+        if n_workers is not None and n_workers > 1:
+            slow_table = yield from iter_measure_objects(
+                lbl,
+                intensity_image=intensity_image,
+                properties=["label"] + slow,
+                extra_properties=extra_properties,
+                spacing=spacing,
+                n_workers=n_workers,
+            )
+        else:
+            slow_table = regionprops_table(
+                lbl,
+                intensity_image=intensity_image,
+                properties=["label"] + slow,
+                extra_properties=extra_properties,
+                spacing=spacing,
+            )
+            yield ProgressStep(1, 1)
+        return _ordered_table(properties, fast_table, slow_table)
+
+
+def lazy_measure_props(
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label",),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    postprocess: Optional[Callable[[dict], dict]] = None,
+    n_workers: int = 1,
+    projected: bool = False,
+    columns: Optional[Dict[str, np.ndarray]] = None,
+) -> LazyPropsTable:
+    """
+    Measure label properties on demand.
+
+    The reduction properties are computed right away (in one pass),
+    every other property is measured when its column is first requested.
+    The extra properties are measured together.
+    Columns are ordered with the (cheap) reduction properties first.
+    Columns measured before (e.g. in another session) can be passed
+    as columns, only the missing properties are measured then.
+
+    :param lbl: label image
+    :param intensity_image: intensity image of same shape as lbl,
+                            optionally with channels on the last axis
+    :param properties: list of properties to measure
+    :param extra_properties: functions passed to regionprops_table
+    :param spacing: (Z)YX voxel size
+    :param postprocess: optional function applied to every computed
+                        table (e.g. to calibrate the extra properties)
+    :param n_workers: number of threads for the shape properties
+    :param projected: whether to add the projected properties of 3D labels
+                      (see measure_projected_props)
+    :param columns: measured (and postprocessed) columns of the same
+                    label image and properties, including the reduction
+                    properties (see PropsCache.load)
+    :return: LazyPropsTable
+    """
+    return exhaust(
+        iter_lazy_measure_props(
+            lbl,
+            intensity_image=intensity_image,
+            properties=properties,
+            extra_properties=extra_properties,
+            spacing=spacing,
+            postprocess=postprocess,
+            n_workers=n_workers,
+            projected=projected,
+            columns=columns,
+        )
+    )
+
+
+def iter_lazy_measure_props(
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label",),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    postprocess: Optional[Callable[[dict], dict]] = None,
+    n_workers: int = 1,
+    projected: bool = False,
+    columns: Optional[Dict[str, np.ndarray]] = None,
+) -> Generator[ProgressStep, None, LazyPropsTable]:
+    """
+    Measure label properties on demand, step by step.
+
+    Generator version of lazy_measure_props, which yields the
+    ProgressSteps of the reduction properties (see iter_measure_props).
+    The lazy columns are measured step by step with
+    LazyPropsTable.iter_compute.
+    :return: yields ProgressSteps, returns LazyPropsTable
+    """
+    fast, slow = _split_props(properties, intensity_image)
+    if columns is not None:
+        # The reduction properties first (intensities with channel suffix)
+        table = {
+            k: v
+            for k, v in columns.items()
+            if k in fast or k.rsplit("-", 1)[0] in fast
+        }
+    else:
+        table = yield from iter_measure_props(
+            lbl,
+            intensity_image=intensity_image,
+            properties=fast,
+            spacing=spacing,
+        )
+        if postprocess is not None:
+            table = postprocess(table)
+    table = LazyPropsTable(table)
+    _set_lazy_props(
+        table,
+        lbl,
+        intensity_image=intensity_image,
+        properties=slow,
+        extra_properties=extra_properties,
+        spacing=spacing,
+        postprocess=postprocess,
+        n_workers=n_workers,
+        projected=projected,
+    )
+    if columns is not None:
+        # Not measured again
+        for k, v in columns.items():
+            table.set_column(k, v)
+    return table
+
+
+@profiler.stage("update_props")
+def update_props(
+    table: LazyPropsTable,
+    lbl: np.ndarray,
+    labels: Sequence[int],
+    region: Tuple[slice, ...],
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label",),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    postprocess: Optional[Callable[[dict], dict]] = None,
+    n_workers: int = 1,
+    projected: bool = False,
+) -> LazyPropsTable:
+    """
+    Measure some labels again, e.g. after they were edited.
+
+    Only the labels are measured, on the crop of the region, and their
+    rows are replaced in a new table (rows of labels that are not in the
+    label image anymore are removed, new labels are added in label
+    order). Columns that are not computed yet stay lazy.
+    The region must contain all voxels of the labels.
+
+    :param table: (lazy) props table of the label image before the edit,
+                  measured with the other arguments (see
+                  lazy_measure_props)
+    :param lbl: label image (after the edit)
+    :param labels: labels to measure again
+    :param region: bounding box of the labels (tuple of slices)
+    :param intensity_image: intensity image of same shape as lbl,
+                            optionally with channels on the last axis
+    :param properties: list of properties to measure
+    :param extra_properties: functions passed to regionprops_table
+    :param spacing: (Z)YX voxel size
+    :param postprocess: optional function applied to every computed
+                        table (e.g. to calibrate the extra properties)
+    :param n_workers: number of threads for the shape properties
+    :param projected: whether to add the projected properties of 3D labels
+    :return: LazyPropsTable
+    """
+    computed = dict(table.computed())
+    labels = np.asarray(labels)
+    # Only the properties computed so far are measured
+    props = ["label"] + [
+        p
+        for p in properties
+        if p != "label"
+        and any(k == p or k.rsplit("-", 1)[0] == p for k in computed)
+    ]
+    extra = None
+    if extra_properties and all(
+        f.__name__ in computed for f in extra_properties
+    ):
+        extra = extra_properties
+    # Crop without the other labels
+    crop = np.asarray(lbl[region])
+    crop = np.where(np.isin(crop, labels), crop, 0)
+    img_crop = None
+    if intensity_image is not None:
+        img_crop = np.asarray(intensity_image[region])
+    measured = measure_props(
+        crop,
+        intensity_image=img_crop,
+        properties=props,
+        extra_properties=extra,
+        spacing=spacing,
+    )
+    _offset_coordinates(
+        measured,
+        np.broadcast_to(
+            [sl.start for sl in region], (len(measured["label"]), lbl.ndim)
+        ),
+        spacing,
+    )
+    if projected and __projected_props__[0] in computed:
+        projected_table = measure_projected_props(crop)
+        for p in __projected_props__:
+            measured[p] = projected_table[p]
+    if postprocess is not None:
+        measured = postprocess(measured)
+
+    # Replace the rows of the labels, keeping the label order
+    kept = ~np.isin(computed["label"], labels)
+    if len(measured["label"]) == 0:
+        columns = {k: np.asarray(v)[kept] for k, v in computed.items()}
+    else:
+        new_labels = np.concatenate(
+            [np.asarray(computed["label"])[kept], measured["label"]]
+        )
+        order = np.argsort(new_labels, kind="stable")
+        columns = {
+            k: np.concatenate([np.asarray(v)[kept], measured[k]])[order]
+            for k, v in computed.items()
+        }
+    return lazy_measure_props(
+        lbl,
+        intensity_image=intensity_image,
+        properties=properties,
+        extra_properties=extra_properties,
+        spacing=spacing,
+        postprocess=postprocess,
+        n_workers=n_workers,
+        projected=projected,
+        columns=columns,
+    )
+
+
+def lazy_measure_compartments(
+    nuclei: np.ndarray,
+    cells: np.ndarray,
+    cyto: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label",),
+    spacing: Union[float, tuple] = None,
+    postprocess: Optional[Callable[[dict], dict]] = None,
+    n_workers: int = 1,
+    projected: bool = False,
+) -> Dict[str, LazyPropsTable]:
+    """
+    Measure label properties of nuclei, cells and cytoplasm on demand.
+
+    The reduction properties of the three compartments are computed in a
+    single pass (see reduce_compartment_props), the other properties are
+    measured per compartment when their column is first requested.
+    All tables have the same rows (the cell labels), compartments without
+    voxels for a label have an area of 0 and NaN for the other properties.
+
+    :param nuclei: nuclei label image
+    :param cells: cell label image (nuclei expanded, same label values)
+    :param cyto: cytoplasm label image (cells without nuclei)
+    :param intensity_image: intensity image of same shape as the labels,
+                            optionally with channels on the last axis
+    :param properties: list of properties to measure
+    :param spacing: (Z)YX voxel size
+    :param postprocess: optional function applied to every computed
+                        table (e.g. to calibrate the extra properties)
+    :param n_workers: number of threads for the shape properties
+    :param projected: whether to add the projected properties of 3D
+                      nuclei (see measure_projected_props)
+    :return: dict of {'Nucleus' | 'Cell' | 'Cyto': LazyPropsTable}
+    """
+    fast, slow = _split_props(properties, intensity_image)
+    fast_tables = reduce_compartment_props(
+        nuclei,
+        cells,
+        intensity_image=intensity_image,
+        properties=["label"] + [p for p in fast if p != "label"],
+        spacing=spacing,
+    )
+    labels = fast_tables["Cell"]["label"]
+    tables = {}
+    for name, lbl in (("Nucleus", nuclei), ("Cell", cells), ("Cyto", cyto)):
+        table = fast_tables[name]
+        if postprocess is not None:
+            table = postprocess(table)
+        table = LazyPropsTable(table)
+        _set_lazy_props(
+            table,
+            lbl,
+            intensity_image=intensity_image,
+            properties=slow,
+            spacing=spacing,
+            postprocess=postprocess,
+            n_workers=n_workers,
+            projected=projected and name == "Nucleus",
+            labels=labels,
+        )
+        tables[name] = table
+    return tables
+
+
+def merge_compartment_tables(
+    tables: Dict[str, Dict[str, np.ndarray]],
+) -> Dict[str, np.ndarray]:
+    """
+    Merge the nucleus, cell and cytoplasm tables into one table.
+
+    The column names get the compartment as prefix, e.g. 'Cyto: area'
+    (see lazy_measure_compartments).
+    :param tables: dict of {'Nucleus' | 'Cell' | 'Cyto': props table}
+    :return: merged props table
+    """
+    table = uts.rename_dict_keys(tables["Nucleus"], prefix="Nucleus")
+    for name in ("Cell", "Cyto"):
+        table = uts.merge_dict(
+            table, uts.rename_dict_keys(tables[name], prefix=name)
+        )
+    return table
+
+
+def concat_frame_tables(
+    tables: Dict[int, Dict[str, np.ndarray]],
+) -> LazyPropsTable:
+    """
+    Combine the props tables of time-lapse frames into one table.
+
+    The rows are ordered by frame, and a 'frame' column (after 'label')
+    holds the frame of every row. So a label value can have a row in
+    every frame. Columns that are not computed in all frame tables are
+    computed (per frame) when first requested.
+    :param tables: dict of {frame: (lazy) props table}, all measured with
+                   the same properties
+    :return: LazyPropsTable
+    """
+    frames = sorted(tables)
+    # Frames without labels do not add rows (nor their column dtypes)
+    non_empty = [t for t in frames if len(tables[t]["label"]) > 0]
+    if len(non_empty) > 0:
+        frames = non_empty
+    table = LazyPropsTable()
+    if len(frames) == 0:
+        table.set_column("label", np.zeros(0, dtype=int))
+        table.set_column("frame", np.zeros(0, dtype=int))
+        return table
+    frame_tables = [tables[t] for t in frames]
+    for k in frame_tables[0]:
+        if all(
+            not isinstance(ft, LazyPropsTable) or ft.is_computed(k)
+            for ft in frame_tables
+        ):
+            table.set_column(k, np.concatenate([ft[k] for ft in frame_tables]))
+        else:
+            table.set_lazy(
+                [k],
+                lambda k=k: {
+                    k: np.concatenate([ft[k] for ft in frame_tables])
+                },
+            )
+        if k == "label":
+            table.set_column(
+                "frame",
+                np.repeat(
+                    np.asarray(frames, dtype=int),
+                    [len(ft["label"]) for ft in frame_tables],
+                ),
+            )
+    return table
+
+
+def _set_lazy_props(
+    table: LazyPropsTable,
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = (),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    postprocess: Optional[Callable[[dict], dict]] = None,
+    n_workers: int = 1,
+    projected: bool = False,
+    labels: Optional[np.ndarray] = None,
+):
+    """
+    Add columns to a table, that are measured when first requested.
+
+    Every property gets its own loader, the extra properties and the
+    projected properties are measured together. The loaders are
+    generators, which yield ProgressSteps (see LazyPropsTable).
+    :param table: LazyPropsTable
+    :param lbl: label image
+    :param intensity_image: intensity image or None
+    :param properties: list of properties (without 'label')
+    :param extra_properties: functions passed to regionprops_table
+    :param spacing: (Z)YX voxel size
+    :param postprocess: optional function applied to every computed table
+    :param n_workers: number of threads for the shape properties
+    :param projected: whether to add the projected properties
+    :param labels: optional labels of the table rows, for label images
+                   that do not contain all of them (missing rows are NaN)
+    :return:
+    """
+    multichannel = (
+        intensity_image is not None and intensity_image.ndim == lbl.ndim + 1
+    )
+
+    def _loaded(measured):
+        if postprocess is not None:
+            measured = postprocess(measured)
+        if labels is not None:
+            measured = _align_rows(measured, labels)
+        return measured
+
+    def _measure(props, extra=None):
+        measured = yield from iter_measure_props(
+            lbl,
+            intensity_image=intensity_image,
+            properties=props,
+            extra_properties=extra,
+            spacing=spacing,
+            n_workers=n_workers,
+        )
+        return _loaded(measured)
+
+    def _measure_projected():
+        measured = yield from iter_measure_projected_props(
+            lbl, n_workers=n_workers
+        )
+        return _loaded(measured)
+
+    for p in properties:
+        keys = [p]
+        if multichannel and p.startswith("intensity"):
+            keys = [f"{p}-{c}" for c in range(intensity_image.shape[-1])]
+        table.set_lazy(keys, lambda p=p: _measure(["label", p]))
+    if extra_properties:
+        keys = [f.__name__ for f in extra_properties]
+        table.set_lazy(
+            keys, lambda: _measure(["label"], extra=extra_properties)
+        )
+    if projected:
+        table.set_lazy(
+            __projected_props__,
+            _measure_projected,
+        )
+
+
+def _align_rows(
+    table: Dict[str, np.ndarray], labels: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """
+    Reorder the rows of a table to the given labels.
+
+    :param table: props table with a label column
+    :param labels: sorted labels of the new rows
+    :return: table with one row per label, NaN for missing labels
+    """
+    if len(table["label"]) == len(labels) and np.array_equal(
+        table["label"], labels
+    ):
+        return table
+    rows = np.searchsorted(labels, table["label"])
+    aligned = {"label": labels}
+    for k, v in table.items():
+        if k == "label":
+            continue
+        aligned[k] = np.full(len(labels), np.nan)
+        aligned[k][rows] = v
+    return aligned
+
+
+def label_bboxes(
+    lbl: np.ndarray, offset: Optional[Tuple[slice, ...]] = None
+) -> Dict[int, Tuple[slice, ...]]:
+    """
+    Bounding boxes of the labels of a label image.
+
+    Uses scipy's find_objects, or the voxel coordinates of every label
+    for sparse label IDs (larger than the number of voxels).
+    :param lbl: label image
+    :param offset: position of lbl in a larger image (tuple of slices),
+                   default is the origin
+    :return: dict of {label: tuple of slices}
+    """
+    lbl = np.asarray(lbl)
+    if offset is None:
+        offset = tuple(slice(0, s) for s in lbl.shape)
+    max_label = int(lbl.max()) if lbl.size > 0 else 0
+    if max_label <= lbl.size:
+        starts = [sl.start or 0 for sl in offset]
+        return {
+            label: tuple(
+                slice(s.start + a, s.stop + a) for s, a in zip(sl, starts)
+            )
+            for label, sl in enumerate(
+                find_objects(lbl, max_label=max_label), start=1
+            )
+            if sl is not None
+        }
+    stats = _block_stats(lbl, None, offset)
+    return {
+        int(label): tuple(slice(int(a), int(b)) for a, b in zip(_min, _max))
+        for label, _min, _max in zip(
+            stats["label"], stats["bbox_min"], stats["bbox_max"]
+        )
+    }
+
+
+def measure_objects(
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label",),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    n_workers: Optional[int] = None,
+    backend: str = "thread",
+) -> Dict[str, np.ndarray]:
+    """
+    Measure label properties per object, in parallel.
+
+    The objects are located with scipy's find_objects and measured with
+    regionprops on their bounding box crops. The labels are split into
+    batches, which are measured in a thread (or process) pool.
+    The returned table is in label order, like regionprops_table, with
+    coordinates (e.g. centroid) in image coordinates.
+
+    :param lbl: label image
+    :param intensity_image: intensity image of same shape as lbl,
+                            optionally with channels on the last axis
+    :param properties: list of properties to measure
+    :param extra_properties: functions passed to regionprops_table
+                             (must be picklable for the process backend)
+    :param spacing: (Z)YX voxel size
+    :param n_workers: number of workers, default is the number of CPUs
+    :param backend: 'thread' or 'process'
+    :return: dict of {property: array}
+    """
+    return exhaust(
+        iter_measure_objects(
+            lbl,
+            intensity_image=intensity_image,
+            properties=properties,
+            extra_properties=extra_properties,
+            spacing=spacing,
+            n_workers=n_workers,
+            backend=backend,
+        )
+    )
+
+
+def iter_measure_objects(
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label",),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    n_workers: Optional[int] = None,
+    backend: str = "thread",
+) -> Generator[ProgressStep, None, Dict[str, np.ndarray]]:
+    """
+    Measure label properties per object, in parallel, batch by batch.
+
+    Generator version of measure_objects, which yields a ProgressStep per
+    measured batch of objects.
+    :return: yields ProgressSteps, returns dict of {property: array}
+    """
+    if backend not in ("thread", "process"):
+        raise ValueError(
+            f"Backend must be 'thread' or 'process'. Got: {backend}"
+        )
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    slices = find_objects(lbl)
+    labels = [i + 1 for i, sl in enumerate(slices) if sl is not None]
+    slices = [sl for sl in slices if sl is not None]
+    batches = _batches(len(labels), n_workers)
+    measure_crops = partial(
+        _measure_crops,
+        properties=properties,
+        extra_properties=extra_properties,
+        spacing=spacing,
+    )
+
+    if backend == "thread":
+        # Threads share the arrays, crops are created in the workers
+        def _batch(start_stop):
+            start, stop = start_stop
+            return measure_crops(
+                _iter_crops(
+                    lbl,
+                    intensity_image,
+                    labels[start:stop],
+                    slices[start:stop],
+                )
+            )
+
+        results = uts.pool_imap(_batch, batches, n_workers=n_workers)
+    else:
+        # Only the crops are sent to the processes
+        crops = (
+            list(
+                _iter_crops(
+                    lbl,
+                    intensity_image,
+                    labels[start:stop],
+                    slices[start:stop],
+                )
+            )
+            for start, stop in batches
+        )
+        results = uts.pool_imap(
+            measure_crops,
+            crops,
+            n_workers=n_workers,
+            executor=ProcessPoolExecutor,
+        )
+    tables = []
+    for table in results:
+        tables.append(table)
+        yield ProgressStep(len(tables), len(batches))
+    tables = [t for t in tables if len(t) > 0]
+    if len(tables) == 0:
+        return {p: np.zeros(0) for p in properties}
+    return {k: np.concatenate([t[k] for t in tables]) for k in tables[0]}
+
+
+def measure_projected_props(
+    lbl: np.ndarray, n_workers: int = 1
+) -> Dict[str, np.ndarray]:
+    """
+    Measure the properties of the Z-projected objects of a 3D label image.
+
+    Every object is projected once (on its bounding box crop) and all
+    projected properties (see __projected_props__) are measured on the
+    projection together. Same values as passing the single projected_*
+    functions of utils as extra_properties to regionprops_table.
+    For lazy label images, the bounding boxes are found block by block.
+
+    :param lbl: 3D (lazy) label image
+    :param n_workers: number of threads
+    :return: dict of {property: array}, including the label column
+    """
+    return exhaust(iter_measure_projected_props(lbl, n_workers=n_workers))
+
+
+def iter_measure_projected_props(
+    lbl: np.ndarray, n_workers: int = 1
+) -> Generator[ProgressStep, None, Dict[str, np.ndarray]]:
+    """
+    Measure the projected properties batch by batch.
+
+    Generator version of measure_projected_props, which yields a
+    ProgressStep per batch of objects.
+    :return: yields ProgressSteps, returns dict of {property: array}
+    """
+    if lbl.ndim != 3:
+        raise ValueError("Input must be a 3D label image.")
+    with profiler.stage("projected_props"):
+        if uts.is_lazy(lbl):
+            stats = _merge_block_stats(
+                [
+                    _block_stats(np.asarray(lbl[sl]), None, sl)
+                    for sl in uts.chunk_slices(lbl.shape, lbl.chunks)
+                ]
+            )
+            labels = list(stats["label"])
+            slices = [
+                tuple(slice(a, b) for a, b in zip(_min, _max))
+                for _min, _max in zip(stats["bbox_min"], stats["bbox_max"])
+            ]
+        else:
+            slices = find_objects(lbl)
+            labels = [i + 1 for i, sl in enumerate(slices) if sl is not None]
+            slices = [sl for sl in slices if sl is not None]
+
+        def _batch(start_stop):
+            start, stop = start_stop
+            return [
+                uts.projected_props(np.asarray(lbl[sl]) == label)
+                for label, sl in zip(labels[start:stop], slices[start:stop])
+            ]
+
+        batches = _batches(len(labels), n_workers)
+        rows = []
+        for i, batch in enumerate(
+            uts.pool_imap(_batch, batches, n_workers=n_workers)
+        ):
+            rows.extend(batch)
+            yield ProgressStep(i + 1, len(batches))
+        table = {"label": np.asarray(labels, dtype=int)}
+        for p in __projected_props__:
+            table[p] = np.asarray([row[p] for row in rows], dtype=float)
+        return table
+
+
+def _batches(n_items: int, n_workers: int) -> List[Tuple[int, int]]:
+    """
+    Split items into (start, stop) batches, a few per worker.
+
+    :param n_items: number of items
+    :param n_workers: number of workers
+    :return: list of (start, stop)
+    """
+    # A few batches per worker, to balance the load
+    n_batches = max(min(n_items, (n_workers or 1) * 4), 1)
+    bounds = np.linspace(0, n_items, n_batches + 1).astype(int)
+    return [(bounds[i], bounds[i + 1]) for i in range(n_batches)]
+
+
+def _iter_crops(
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray],
+    labels: Sequence[int],
+    slices: Sequence[Tuple[slice, ...]],
+) -> Iterable[Tuple[int, np.ndarray, Optional[np.ndarray]]]:
+    """
+    Iterate over the bounding box crops of objects.
+
+    :param lbl: label image
+    :param intensity_image: intensity image or None
+    :param labels: labels of the objects
+    :param slices: bounding boxes of the objects
+    :return: iterator of (label, object mask, intensity crop, crop start)
+    """
+    for label, sl in zip(labels, slices):
+        # view as uint8 for regionprops, without copying the mask
+        mask = (lbl[sl] == label).view(np.uint8)
+        img_crop = None if intensity_image is None else intensity_image[sl]
+        yield label, mask, img_crop, tuple(s.start for s in sl)
+
+
+def _measure_crops(
+    crops: Iterable[
+        Tuple[int, np.ndarray, Optional[np.ndarray], Tuple[int, ...]]
+    ],
+    properties: Sequence[str],
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Measure the properties of single objects.
+
+    Coordinates (e.g. centroid and bbox) are in image coordinates, i.e.
+    offset by the crop start (see _offset_coordinates).
+    :param crops: iterable of (label, object mask, intensity crop,
+                  crop start)
+    :param properties: list of properties to measure
+    :param extra_properties: functions passed to regionprops_table
+    :param spacing: (Z)YX voxel size
+    :return: dict of {property: array}, one row per crop
+    """
+    names = list(properties) + [f.__name__ for f in extra_properties or ()]
+    rows = {}
+    starts = []
+    for label, mask, img_crop, start in crops:
+        starts.append(start)
+        # regionprops_table has a large overhead for single objects
+        region = regionprops(
+            mask,
+            intensity_image=img_crop,
+            extra_properties=extra_properties,
+            spacing=spacing,
+        )[0]
+        for name in names:
+            if name == "label":
+                rows.setdefault(name, []).append(label)
+                continue
+            value = getattr(region, name)
+            if np.ndim(value) == 0:
+                rows.setdefault(name, []).append(value)
+                continue
+            # Array values get one column per element, like regionprops_table
+            value = np.asarray(value)
+            for index in np.ndindex(value.shape):
+                key = "-".join([name] + [str(i) for i in index])
+                rows.setdefault(key, []).append(value[index])
+    table = {k: np.asarray(v) for k, v in rows.items()}
+    if len(starts) > 0:
+        _offset_coordinates(table, np.asarray(starts), spacing)
+    return table
+
+
+def _offset_coordinates(
+    table: Dict[str, np.ndarray],
+    starts: np.ndarray,
+    spacing: Union[float, tuple] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Shift coordinate properties measured on crops to image coordinates.
+
+    See __coordinate_props__, e.g. 'centroid-0' is offset by the crop
+    start times the voxel size, 'bbox-2' (of a 2D image) by the crop
+    start on axis 0. Local coordinates (e.g. centroid_local) are kept.
+    :param table: dict of {property: array}, changed in place
+    :param starts: crop start per row, array of shape (n_rows, ndim)
+    :param spacing: (Z)YX voxel size
+    :return: table
+    """
+    starts = np.asarray(starts)
+    ndim = starts.shape[1]
+    scale = np.broadcast_to(
+        np.asarray(1.0 if spacing is None else spacing, dtype=float), ndim
+    )
+    for key in list(table):
+        name, *index = key.split("-")
+        if name not in __coordinate_props__:
+            continue
+        offsets = starts * scale if __coordinate_props__[name] else starts
+        if len(index) > 0:
+            # bbox-{axis (modulo ndim)}, centroid-{axis}(-{channel}),
+            # coords-{voxel}-{axis}, slice-{axis}
+            axis = int(index[-1] if name.startswith("coords") else index[0])
+            offsets = offsets[:, axis % ndim]
+            if name != "slice":
+                table[key] = table[key] + offsets
+                continue
+        # Object columns, e.g. coords (one array per row) or slice
+        values = np.empty(len(table[key]), dtype=object)
+        for i, (value, offset) in enumerate(zip(table[key], offsets)):
+            if isinstance(value, slice):
+                values[i] = slice(value.start + offset, value.stop + offset)
+            elif name == "slice":
+                values[i] = tuple(
+                    slice(sl.start + o, sl.stop + o)
+                    for sl, o in zip(value, offset)
+                )
+            else:
+                values[i] = np.asarray(value) + offset
+        table[key] = values
+    return table
+
+
+def reduce_props(
+    lbl: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label", "area"),
+    spacing: Union[float, tuple] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Compute reduction properties for all labels in one vectorized pass.
+
+    :param lbl: label image
+    :param intensity_image: intensity image of same shape as lbl,
+                            optionally with channels on the last axis
+    :param properties: list of properties, from __reduction_props__
+    :param spacing: (Z)YX voxel size
+    :return: dict of {property: array}, ordered like properties
+    """
+    for p in properties:
+        if p not in __reduction_props__:
+            raise ValueError(f"Property '{p}' is not a reduction property.")
+    # Only consider the foreground voxels
+    flat = np.ravel(lbl)
+    fg = flat > 0
+    index = flat[fg].astype(np.intp, copy=False)
+    labels, index, counts = _compact_index(index)
+
+    table = {}
+    for p in properties:
+        if p == "label":
+            table[p] = labels
+        elif p == "area":
+            table[p] = counts * _voxel_volume(spacing, lbl.ndim)
+    intensity_props = [p for p in properties if p.startswith("intensity")]
+    if len(intensity_props) == 0:
+        return table
+    if intensity_image is None:
+        raise ValueError("Intensity properties require an intensity image.")
+    # Intensity values of the foreground, one column per channel
+    multichannel = intensity_image.ndim == lbl.ndim + 1
+    values = np.reshape(intensity_image, (flat.size, -1))[fg]
+    stats = {}
+    for c in range(values.shape[1]):
+        channel_stats = reduce_intensity(
+            index, values[:, c], counts, intensity_props
+        )
+        for p, v in channel_stats.items():
+            stats[f"{p}-{c}" if multichannel else p] = v
+    # Add the intensity columns in order of the properties
+    for p in intensity_props:
+        for k, v in stats.items():
+            if k == p or k.startswith(f"{p}-"):
+                table[k] = v
+    return _ordered_table(properties, table)
+
+
+def reduce_compartment_props(
+    nuclei: np.ndarray,
+    cells: np.ndarray,
+    intensity_image: Optional[np.ndarray] = None,
+    properties: Sequence[str] = ("label", "area"),
+    spacing: Union[float, tuple] = None,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Compute reduction properties of nuclei, cells and cytoplasm at once.
+
+    Cells are the union of nucleus and cytoplasm with the same label, so
+    every cell voxel is counted for its label and its compartment
+    (nucleus or cytoplasm) in one bincount pass. The cell statistics are
+    combined from the two compartments (means and variances with the
+    parallel variance algorithm).
+
+    :param nuclei: nuclei label image
+    :param cells: cell label image (nuclei expanded, same label values)
+    :param intensity_image: intensity image of same shape as the labels,
+                            optionally with channels on the last axis
+    :param properties: list of properties, from __reduction_props__
+    :param spacing: (Z)YX voxel size
+    :return: dict of {'Nucleus' | 'Cell' | 'Cyto': props table}, all with
+             one row per cell label (area 0 and NaN intensities for empty
+             compartments)
+    """
+    for p in properties:
+        if p not in __reduction_props__:
+            raise ValueError(f"Property '{p}' is not a reduction property.")
+    if nuclei.shape != cells.shape:
+        raise ValueError(
+            f"Nuclei and cells must have the same shape. "
+            f"Got: {nuclei.shape} and {cells.shape}"
+        )
+    flat = np.ravel(cells)
+    fg = flat > 0
+    labels, index, cell_counts = _compact_index(
+        flat[fg].astype(np.intp, copy=False)
+    )
+    n = len(labels)
+    # Group of each voxel: 2 * label index + compartment (0: nucleus, 1: cyto)
+    group = 2 * index + (np.ravel(nuclei)[fg] == 0)
+    counts = np.bincount(group, minlength=2 * n)
+
+    names = ("Nucleus", "Cyto")
+    tables = {name: {} for name in ("Nucleus", "Cell", "Cyto")}
+    voxel_volume = _voxel_volume(spacing, cells.ndim)
+    for p in properties:
+        if p == "label":
+            for table in tables.values():
+                table[p] = labels
+        elif p == "area":
+            tables["Cell"][p] = cell_counts * voxel_volume
+            for c, name in enumerate(names):
+                tables[name][p] = counts[c::2] * voxel_volume
+    intensity_props = [p for p in properties if p.startswith("intensity")]
+    if len(intensity_props) == 0:
+        return tables
+    if intensity_image is None:
+        raise ValueError("Intensity properties require an intensity image.")
+    multichannel = intensity_image.ndim == cells.ndim + 1
+    values = np.reshape(intensity_image, (flat.size, -1))[fg]
+    all_stats = [
+        "intensity_max",
+        "intensity_mean",
+        "intensity_min",
+        "intensity_std",
+    ]
+    for c in range(values.shape[1]):
+        suffix = f"-{c}" if multichannel else ""
+        # Empty compartments result in NaN
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats = reduce_intensity(group, values[:, c], counts, all_stats)
+        comp = {}
+        for name, offset in zip(names, (0, 1)):
+            comp[name] = {k: v[offset::2] for k, v in stats.items()}
+            comp[name]["count"] = counts[offset::2]
+        nuc, cyt = comp["Nucleus"], comp["Cyto"]
+        # Combine the compartments to the cell statistics
+        cell_mean = (
+            np.nan_to_num(nuc["intensity_mean"]) * nuc["count"]
+            + np.nan_to_num(cyt["intensity_mean"]) * cyt["count"]
+        ) / cell_counts
+        m2 = (
+            np.nan_to_num(nuc["intensity_std"]) ** 2 * nuc["count"]
+            + np.nan_to_num(cyt["intensity_std"]) ** 2 * cyt["count"]
+            + nuc["count"]
+            * cyt["count"]
+            / cell_counts
+            * np.square(
+                np.nan_to_num(nuc["intensity_mean"])
+                - np.nan_to_num(cyt["intensity_mean"])
+            )
+        )
+        comp["Cell"] = {
+            "intensity_max": np.fmax(
+                nuc["intensity_max"], cyt["intensity_max"]
+            ),
+            "intensity_mean": cell_mean,
+            "intensity_min": np.fmin(
+                nuc["intensity_min"], cyt["intensity_min"]
+            ),
+            "intensity_std": np.sqrt(m2 / cell_counts),
+        }
+        for name, table in tables.items():
+            channel = comp[name]
+            for p in intensity_props:
+                value = channel[p]
+                if name != "Cell":
+                    # min/max of empty compartments are +/-inf
+                    value = np.where(channel["count"] > 0, value, np.nan)
+                table[p + suffix] = value
+    return {
+        name: _ordered_table(properties, table)
+        for name, table in tables.items()
+    }
+
+
+def reduce_intensity(
+    index: np.ndarray,
+    values: np.ndarray,
+    counts: np.ndarray,
+    properties: Sequence[str],
+) -> Dict[str, np.ndarray]:
+    """
+    Compute intensity statistics per label index.
+
+    :param index: compact label index (0..n-1) of each voxel
+    :param values: intensity value of each voxel
+    :param counts: number of voxels per label index
+    :param properties: intensity properties to compute
+    :return: dict of {property: array}
+    """
+    n = len(counts)
+    # ufunc.at is only fast if the values match the output dtype
+    values = values.astype(np.float64, copy=False)
+    stats = {}
+    mean = None
+    if "intensity_mean" in properties or "intensity_std" in properties:
+        mean = np.bincount(index, weights=values, minlength=n) / counts
+    if "intensity_max" in properties:
+        _max = np.full(n, -np.inf)
+        np.maximum.at(_max, index, values)
+        stats["intensity_max"] = _max
+    if "intensity_mean" in properties:
+        stats["intensity_mean"] = mean
+    if "intensity_min" in properties:
+        _min = np.full(n, np.inf)
+        np.minimum.at(_min, index, values)
+        stats["intensity_min"] = _min
+    if "intensity_std" in properties:
+        # Two passes (like np.std) for numerical stability
+        squares = np.square(values - mean[index])
+        stats["intensity_std"] = np.sqrt(
+            np.bincount(index, weights=squares, minlength=n) / counts
+        )
+    return stats
+
+
+def _compact_index(
+    index: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Map label values to a compact index 0..n-1.
+
+    Uses bincount directly if the label values are dense enough,
+    otherwise np.unique (i.e. for very large, sparse label IDs).
+    :param index: label value per voxel (without background)
+    :return: labels, compact index per voxel, voxel counts per label
+    """
+    if index.size == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty, empty
+    max_label = int(index.max())
+    if max_label <= max(index.size, 2**20):
+        counts = np.bincount(index, minlength=max_label + 1)
+        labels = np.flatnonzero(counts)
+        # Translate the label values into positions in labels
+        lut = np.zeros(max_label + 1, dtype=np.intp)
+        lut[labels] = np.arange(len(labels))
+        return labels, lut[index], counts[labels]
+    labels, index, counts = np.unique(
+        index, return_inverse=True, return_counts=True
+    )
+    return labels, index.ravel(), counts
+
+
+def _split_props(
+    properties: Sequence[str], intensity_image=None
+) -> Tuple[List[str], List[str]]:
+    """
+    Split properties into reduction and other (shape) properties.
+
+    Intensity properties without intensity image are passed on as shape
+    properties, so that regionprops raises the usual error.
+    :param properties: list of properties
+    :param intensity_image: intensity image or None
+    :return: list of reduction properties, list of other properties
+    """
+    fast = [
+        p
+        for p in properties
+        if p in __reduction_props__
+        and (intensity_image is not None or not p.startswith("intensity"))
+    ]
+    slow = [p for p in properties if p not in fast]
+    return fast, slow
+
+
+def _voxel_volume(spacing: Union[float, tuple, None], ndim: int) -> float:
+    """
+    Volume of a single voxel.
+
+    :param spacing: (Z)YX voxel size, or a single value for all axes
+    :param ndim: number of dimensions
+    :return: voxel volume
+    """
+    if spacing is None:
+        return 1.0
+    spacing = np.broadcast_to(np.asarray(spacing, dtype=float), (ndim,))
+    return float(np.prod(spacing))
+
+
+def _ordered_table(
+    properties: Sequence[str], *tables: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    """
+    Merge property tables, ordered like the properties list.
+
+    Multichannel columns ('<property>-<channel>') follow their property,
+    columns not in properties (i.e. extra properties) are added last.
+    :param properties: ordered list of properties
+    :param tables: property tables to merge
+    :return: merged table
+    """
+    columns = {}
+    for t in tables:
+        columns.update(t)
+    ordered: List[str] = []
+    for p in properties:
+        ordered += [
+            k
+            for k in columns
+            if (k == p or k.startswith(f"{p}-")) and k not in ordered
+        ]
+    ordered += [k for k in columns if k not in ordered]
+    return {k: columns[k] for k in ordered}
+
+
+def measure_props_chunked(
+    lbl,
+    intensity_image=None,
+    properties: Sequence[str] = ("label",),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    chunks: Optional[tuple] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Measure label properties block by block.
+
+    Only one block of the label (and intensity) image is loaded at a time.
+    A first pass collects partial statistics per label and block
+    (voxel count, intensity mean/M2/min/max and bounding box), which are
+    merged over the blocks. If shape properties are requested, a second
+    pass measures them with regionprops: objects that lie within a single
+    block are measured on that block, objects that span block boundaries
+    on a crop of their bounding box.
+
+    :param lbl: (lazy) label image, e.g. dask or zarr array
+    :param intensity_image: (lazy) intensity image of same shape as lbl,
+                            optionally with channels on the last axis
+    :param properties: list of properties to measure
+    :param extra_properties: functions passed to regionprops_table
+    :param spacing: (Z)YX voxel size
+    :param chunks: block shape or dask style chunks,
+                   default is the chunking of the label (or intensity) image
+    :return: dict of {property: array}, same layout as measure_props
+    """
+    return exhaust(
+        iter_measure_props_chunked(
+            lbl,
+            intensity_image=intensity_image,
+            properties=properties,
+            extra_properties=extra_properties,
+            spacing=spacing,
+            chunks=chunks,
+        )
+    )
+
+
+def iter_measure_props_chunked(
+    lbl,
+    intensity_image=None,
+    properties: Sequence[str] = ("label",),
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+    chunks: Optional[tuple] = None,
+) -> Generator[ProgressStep, None, Dict[str, np.ndarray]]:
+    """
+    Measure label properties block by block, step by step.
+
+    Generator version of measure_props_chunked, which yields a
+    ProgressStep per block in the first pass, and per block and spanning
+    object in the second pass (every pass counts its own steps).
+    :return: yields ProgressSteps, returns dict of {property: array}
+    """
+    if chunks is None:
+        chunks = getattr(lbl, "chunks", None)
+        if chunks is None:
+            chunks = getattr(intensity_image, "chunks", None)
+            chunks = None if chunks is None else chunks[: lbl.ndim]
+    blocks = list(uts.chunk_slices(lbl.shape, chunks))
+    fast, slow = _split_props(properties, intensity_image)
+    intensity_props = [p for p in fast if p.startswith("intensity")]
+
+    # First pass: partial statistics per block
+    partials = []
+    for sl in blocks:
+        lbl_block = np.asarray(lbl[sl])
+        img_block = None
+        if intensity_image is not None:
+            img_block = np.asarray(intensity_image[sl])
+        partials.append(_block_stats(lbl_block, img_block, sl))
+        yield ProgressStep(len(partials), len(blocks))
+    stats = _merge_block_stats(partials)
+
+    table = {}
+    for p in fast:
+        if p == "label":
+            table[p] = stats["label"]
+        elif p == "area":
+            table[p] = stats["count"] * _voxel_volume(spacing, lbl.ndim)
+    if len(intensity_props) > 0:
+        multichannel = intensity_image.ndim == lbl.ndim + 1
+        for c in range(stats["mean"].shape[1]):
+            suffix = f"-{c}" if multichannel else ""
+            channel = {
+                "intensity_max": stats["max"][:, c],
+                "intensity_mean": stats["mean"][:, c],
+                "intensity_min": stats["min"][:, c],
+                "intensity_std": np.sqrt(stats["m2"][:, c] / stats["count"]),
+            }
+            for p in intensity_props:
+                table[p + suffix] = channel[p]
+    if len(slow) == 0 and not extra_properties:
+        return _ordered_table(properties, table)
+
+    # Second pass: shape properties
+    slow_table = yield from _iter_measure_shape_chunked(
+        lbl,
+        intensity_image,
+        blocks,
+        stats,
+        properties=slow,
+        extra_properties=extra_properties,
+        spacing=spacing,
+    )
+    return _ordered_table(properties, table, slow_table)
+
+
+def _block_stats(
+    lbl_block: np.ndarray,
+    img_block: Optional[np.ndarray],
+    block: Tuple[slice, ...],
+) -> Dict[str, np.ndarray]:
+    """
+    Partial statistics of the labels in one block.
+
+    :param lbl_block: label image block
+    :param img_block: intensity image block (or None)
+    :param block: position of the block in the full image
+    :return: dict with label, count, mean, m2, min, max, bbox_min, bbox_max
+    """
+    flat = lbl_block.ravel()
+    fg = flat > 0
+    labels, index, counts = _compact_index(flat[fg].astype(np.intp))
+    n = len(labels)
+    stats = {"label": labels, "count": counts}
+    # Bounding boxes in full image coordinates
+    coords = np.nonzero(lbl_block)
+    stats["bbox_min"] = np.empty((n, lbl_block.ndim), dtype=np.intp)
+    stats["bbox_max"] = np.empty((n, lbl_block.ndim), dtype=np.intp)
+    for d, (c, sl) in enumerate(zip(coords, block)):
+        _min = np.full(n, np.iinfo(np.intp).max)
+        _max = np.full(n, -1)
+        np.minimum.at(_min, index, c)
+        np.maximum.at(_max, index, c)
+        stats["bbox_min"][:, d] = _min + sl.start
+        stats["bbox_max"][:, d] = _max + sl.start + 1
+    if img_block is None:
+        return stats
+    values = np.reshape(img_block, (flat.size, -1))[fg]
+    n_channels = values.shape[1]
+    for k in ("mean", "m2", "min", "max"):
+        stats[k] = np.empty((n, n_channels))
+    for c in range(n_channels):
+        channel = reduce_intensity(
+            index,
+            values[:, c],
+            counts,
+            [
+                "intensity_max",
+                "intensity_mean",
+                "intensity_min",
+                "intensity_std",
+            ],
+        )
+        stats["mean"][:, c] = channel["intensity_mean"]
+        stats["m2"][:, c] = channel["intensity_std"] ** 2 * counts
+        stats["min"][:, c] = channel["intensity_min"]
+        stats["max"][:, c] = channel["intensity_max"]
+    return stats
+
+
+def _merge_block_stats(
+    partials: List[Dict[str, np.ndarray]],
+) -> Dict[str, np.ndarray]:
+    """
+    Merge the partial statistics of labels found in several blocks.
+
+    Means and M2 (sum of squared deviations) are combined with the
+    parallel variance algorithm (Chan et al.).
+    :param partials: list of _block_stats outputs
+    :return: dict of merged statistics, one row per label
+    """
+    merged = {k: np.concatenate([p[k] for p in partials]) for k in partials[0]}
+    labels, inverse = np.unique(merged["label"], return_inverse=True)
+    inverse = inverse.ravel()
+    n = len(labels)
+    counts = np.bincount(inverse, weights=merged["count"], minlength=n)
+    stats = {"label": labels, "count": counts}
+    ndim = merged["bbox_min"].shape[1]
+    stats["bbox_min"] = np.empty((n, ndim), dtype=np.intp)
+    stats["bbox_max"] = np.empty((n, ndim), dtype=np.intp)
+    for d in range(ndim):
+        _min = np.full(n, np.iinfo(np.intp).max)
+        _max = np.full(n, -1)
+        np.minimum.at(_min, inverse, merged["bbox_min"][:, d])
+        np.maximum.at(_max, inverse, merged["bbox_max"][:, d])
+        stats["bbox_min"][:, d] = _min
+        stats["bbox_max"][:, d] = _max
+    if "mean" not in merged:
+        return stats
+    n_channels = merged["mean"].shape[1]
+    for k in ("mean", "m2", "min", "max"):
+        stats[k] = np.empty((n, n_channels))
+    for c in range(n_channels):
+        block_mean = merged["mean"][:, c]
+        mean = (
+            np.bincount(
+                inverse, weights=merged["count"] * block_mean, minlength=n
+            )
+            / counts
+        )
+        m2 = merged["m2"][:, c] + merged["count"] * np.square(
+            block_mean - mean[inverse]
+        )
+        stats["mean"][:, c] = mean
+        stats["m2"][:, c] = np.bincount(inverse, weights=m2, minlength=n)
+        _min = np.full(n, np.inf)
+        _max = np.full(n, -np.inf)
+        np.minimum.at(_min, inverse, merged["min"][:, c])
+        np.maximum.at(_max, inverse, merged["max"][:, c])
+        stats["min"][:, c] = _min
+        stats["max"][:, c] = _max
+    return stats
+
+
+def _iter_measure_shape_chunked(
+    lbl,
+    intensity_image,
+    blocks: List[Tuple[slice, ...]],
+    stats: Dict[str, np.ndarray],
+    properties: Sequence[str],
+    extra_properties: Optional[Sequence[Callable]] = None,
+    spacing: Union[float, tuple] = None,
+) -> Generator[ProgressStep, None, Dict[str, np.ndarray]]:
+    """
+    Measure shape properties of a lazy label image.
+
+    Objects within a single block are measured on the block,
+    objects spanning several blocks on their own bounding box crop.
+    :param lbl: (lazy) label image
+    :param intensity_image: (lazy) intensity image or None
+    :param blocks: list of block slices
+    :param stats: merged block statistics (labels and bounding boxes)
+    :param properties: shape properties to measure
+    :param extra_properties: functions passed to regionprops_table
+    :param spacing: (Z)YX voxel size
+    :return: yields a ProgressStep per block and spanning object,
+             returns dict of {property: array}, including the label column
+    """
+    labels = stats["label"]
+    bbox_min = stats["bbox_min"]
+    bbox_max = stats["bbox_max"]
+    table = {}
+    done = np.zeros(len(labels), dtype=bool)
+
+    def _fill(rows: np.ndarray, block_table: dict):
+        for k, v in block_table.items():
+            if k == "label":
+                continue
+            if k not in table:
+                # (every row is filled, in the dtype of regionprops_table)
+                table[k] = np.zeros(len(labels), dtype=np.asarray(v).dtype)
+            table[k][rows] = v
+        done[rows] = True
+
+    for i, sl in enumerate(blocks):
+        yield ProgressStep(i, len(blocks))
+        start = np.array([s.start for s in sl])
+        stop = np.array([s.stop for s in sl])
+        inside = np.all(bbox_min >= start, axis=1) & np.all(
+            bbox_max <= stop, axis=1
+        )
+        if not np.any(inside):
+            continue
+        lbl_block = np.asarray(lbl[sl])
+        img_block = None
+        if intensity_image is not None:
+            img_block = np.asarray(intensity_image[sl])
+        # Remove the objects that span the block boundaries
+        keep = np.isin(lbl_block, labels[inside])
+        block_table = regionprops_table(
+            np.where(keep, lbl_block, 0),
+            intensity_image=img_block,
+            properties=["label"] + list(properties),
+            extra_properties=extra_properties,
+            spacing=spacing,
+        )
+        rows = np.searchsorted(labels, block_table["label"])
+        _offset_coordinates(
+            block_table, np.broadcast_to(start, (len(rows), lbl.ndim)), spacing
+        )
+        _fill(rows, block_table)
+
+    # Objects that span blocks (only known once all blocks are done)
+    spanning = np.flatnonzero(~done)
+    total = len(blocks) + len(spanning)
+    for i, row in enumerate(spanning):
+        yield ProgressStep(len(blocks) + i, total)
+        bbox = tuple(slice(a, b) for a, b in zip(bbox_min[row], bbox_max[row]))
+        mask = np.asarray(lbl[bbox]) == labels[row]
+        img_crop = None
+        if intensity_image is not None:
+            img_crop = np.asarray(intensity_image[bbox])
+        obj_table = regionprops_table(
+            mask.astype(np.uint8),
+            intensity_image=img_crop,
+            properties=["label"] + list(properties),
+            extra_properties=extra_properties,
+            spacing=spacing,
+        )
+        _offset_coordinates(obj_table, bbox_min[row : row + 1], spacing)
+        _fill(np.array([row]), obj_table)
+    yield ProgressStep(total, total)
+    table = {"label": labels, **table}
+    return table
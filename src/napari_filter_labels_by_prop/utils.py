@@ -1,12 +1,31 @@
-from time import time
-from typing import Dict, List, Union
+import itertools
+import os
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import (
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
 import numpy as np
 from napari.utils import progress
 from skimage.measure import regionprops
-from skimage.segmentation import expand_labels, relabel_sequential
+from skimage.segmentation import expand_labels
 from skimage.util import map_array
 
+from napari_filter_labels_by_prop.CytoplasmLabels import CytoplasmLabels
+from napari_filter_labels_by_prop.LazyPropsTable import LazyPropsTable
+from napari_filter_labels_by_prop.ProgressStep import ProgressStep, exhaust
+from napari_filter_labels_by_prop.StageProfiler import profiler
+
 __calibrated_extra_props__ = [
     "projected_perimeter",
     "projected_convex_area",
@@ -14,30 +33,609 @@ __calibrated_extra_props__ = [
 ]
 
 
+def is_lazy(data) -> bool:
+    """
+    Check whether an array is lazily loaded (e.g. dask or zarr arrays).
+
+    Such arrays are chunked and should not be converted to numpy at once.
+    :param data: array-like
+    :return: boolean
+    """
+    return (
+        data is not None
+        and not isinstance(data, np.ndarray)
+        and hasattr(data, "chunks")
+    )
+
+
+def preview_level(shapes: List[Tuple[int, ...]], max_voxels: int) -> int:
+    """
+    Choose the level of a multiscale image to measure for the preview.
+
+    :param shapes: shapes of the levels, from full to low resolution
+    :param max_voxels: maximum number of voxels of the level
+    :return: index of the finest level with at most max_voxels voxels
+             (or the coarsest level)
+    """
+    for i, shape in enumerate(shapes):
+        if np.prod(shape, dtype=float) <= max_voxels:
+            return i
+    return len(shapes) - 1
+
+
+def matching_level(levels: List[np.ndarray], shape: Tuple[int, ...]):
+    """
+    Get the level of a multiscale image that matches a (label) shape.
+
+    :param levels: levels of a multiscale image
+    :param shape: shape to match (the image may have a channel axis more)
+    :return: matching level, or the full resolution level
+    """
+    for level in levels:
+        if tuple(level.shape[: len(shape)]) == tuple(shape):
+            return level
+    return levels[0]
+
+
+def level_factors(
+    levels: List[np.ndarray], level: int, ndim: int
+) -> Tuple[float, ...]:
+    """
+    Downsampling factors of a multiscale level, for the last ndim axes.
+
+    :param levels: levels of a multiscale image
+    :param level: level index
+    :param ndim: number of (spatial) axes
+    :return: tuple of factors (full resolution size / level size)
+    """
+    full = levels[0].shape[-ndim:]
+    shape = levels[level].shape[-ndim:]
+    return tuple(f / s for f, s in zip(full, shape))
+
+
+def chunk_slices(
+    shape: Tuple[int, ...], chunks: Optional[tuple] = None
+) -> Iterator[Tuple[slice, ...]]:
+    """
+    Iterate over the blocks of a chunked array.
+
+    :param shape: array shape
+    :param chunks: either the chunk shape (zarr style, e.g. (64, 256, 256)),
+                   or the chunk sizes per axis (dask style, e.g.
+                   ((64, 36), (256, 256), (256, 256))).
+                   Default (None) is a single chunk.
+    :return: iterator of tuples of slices, one per block
+    """
+    if chunks is None:
+        chunks = shape
+    sizes = []
+    for s, c in zip(shape, chunks):
+        if np.ndim(c) == 0:
+            # regular chunk shape
+            c = max(int(c), 1)
+            sizes.append([c] * (s // c) + ([s % c] if s % c else []))
+        else:
+            sizes.append(list(c))
+    edges = [np.cumsum([0] + c) for c in sizes]
+    for index in itertools.product(*(range(len(c)) for c in sizes)):
+        yield tuple(
+            slice(int(e[i]), int(e[i + 1])) for e, i in zip(edges, index)
+        )
+
+
+def union_slices(
+    boxes: List[Tuple[slice, ...]], shape: Tuple[int, ...]
+) -> Tuple[slice, ...]:
+    """
+    Bounding box of several bounding boxes.
+
+    :param boxes: tuples of slices (step 1), missing axes are whole axes
+    :param shape: array shape
+    :return: tuple of slices, one per axis
+    """
+    starts = list(shape)
+    stops = [0] * len(shape)
+    for box in boxes:
+        for d, n in enumerate(shape):
+            start, stop = 0, n
+            if d < len(box):
+                start, stop, _ = box[d].indices(n)
+            starts[d] = min(starts[d], start)
+            stops[d] = max(stops[d], stop)
+    return tuple(slice(a, max(a, b)) for a, b in zip(starts, stops))
+
+
+def painted_labels(
+    atoms: list, shape: Tuple[int, ...]
+) -> Tuple[Tuple[slice, ...], np.ndarray]:
+    """
+    Region and labels changed by an edit of a labels layer.
+
+    The edit is the list of history atoms of the napari paint event:
+    (slice_key, mask, old_values, new_value) of paint, fill and polygon
+    edits, or (indices, old_values, new_values) of other data changes.
+    The changed labels are the ones that were overwritten and the ones
+    that were painted (without the background).
+
+    :param atoms: paint event value
+    :param shape: label image shape
+    :return: bounding box of the edit (tuple of slices), sorted labels
+    """
+    boxes = []
+    values = [np.zeros(0, dtype=np.intp)]
+    for atom in atoms:
+        if hasattr(atom, "slice_key"):
+            boxes.append(tuple(atom.slice_key))
+            values += [np.ravel(atom.old_values), np.ravel(atom.new_value)]
+            continue
+        indices, old_values, new_values = atom
+        box = []
+        for index in indices:
+            if isinstance(index, slice):
+                box.append(index)
+                continue
+            index = np.asarray(index)
+            if index.size == 0:
+                break
+            box.append(slice(int(index.min()), int(index.max()) + 1))
+        else:
+            boxes.append(tuple(box))
+            values += [np.ravel(old_values), np.ravel(new_values)]
+    if len(boxes) == 0:
+        return tuple(slice(0, 0) for _ in shape), values[0]
+    labels = np.unique(np.concatenate(values))
+    return union_slices(boxes, shape), labels[labels > 0]
+
+
 def remove_labels(
-    img: np.ndarray, label_map: Dict[int, int], relabel: bool = False
+    img: np.ndarray,
+    label_map: Dict[int, int],
+    relabel: bool = False,
+    out: Optional[np.ndarray] = None,
 ) -> np.ndarray:
     """
     Returns a new label image wih label removed.
 
-    Uses skimage.util.map_array, which is fast.
-    map_array requires a list of input_val = ALL label indices, and
-    output_vals, which is a list of same length as input_val and maps,
-    the values (e.g. same label value for labels to keep, or 0 for the ones to remove).
+    The label_map maps ALL label indices to the same label value for labels
+    to keep, or 0 for the ones to remove. The new image is created in a
+    single pass with a lookup table (see label_lut and apply_lut),
+    also when relabelling. For very sparse label ids (where a lookup
+    table would be bigger than the image), skimage's map_array is used.
     :param img: label image
     :param label_map: dict of {label: [label or 0]}
     :param relabel: whether to relabel the new image or keep the original label ids.
                     Default is False.
+    :param out: optional output array (same shape as img)
     :return: new label image with labels removed
     """
-    in_vals = np.array(list(label_map.keys()), dtype=int)
-    out_vals = np.array(list(label_map.values()), dtype=int)
-    new_labels = map_array(
-        input_arr=img, input_vals=in_vals, output_vals=out_vals
+    n = len(label_map)
+    labels = np.fromiter(label_map.keys(), dtype=np.int64, count=n)
+    keep = np.fromiter((v != 0 for v in label_map.values()), bool, count=n)
+    max_label = labels.max() if len(labels) > 0 else 0
+    if max_label < max(2**20, np.size(img)):
+        return apply_lut(img, label_lut(labels, keep, relabel), out=out)
+    # Sparse label ids
+    kept = np.sort(labels[keep])
+    new_vals = np.arange(1, len(kept) + 1) if relabel else kept
+    new_vals = new_vals.astype(_label_dtype(new_vals))
+    if out is None:
+        out = np.empty(np.shape(img), dtype=new_vals.dtype)
+    for sl in slab_slices(img):
+        map_array(
+            np.asarray(img[sl]),
+            input_vals=kept,
+            output_vals=new_vals,
+            out=out[sl],
+        )
+    return out
+
+
+def label_lut(
+    labels: np.ndarray, keep: np.ndarray, relabel: bool = False
+) -> np.ndarray:
+    """
+    Create a lookup table to remove (and relabel) labels.
+
+    The table is indexed by label value and maps the labels to keep to
+    themselves (or to 1..n in label order if relabel), all others to 0.
+    It has an additional last entry of 0, labels above the largest label
+    are clipped to it (see apply_lut).
+    The smallest dtype that holds the new label values is used.
+
+    :param labels: label values
+    :param keep: boolean array (same order as labels), True = keep
+    :param relabel: whether to relabel sequentially
+    :return: lookup table array of length max(labels) + 2
+    """
+    labels = np.asarray(labels)
+    keep = np.asarray(keep, dtype=bool)
+    max_label = int(labels.max()) if len(labels) > 0 else 0
+    kept = np.sort(labels[keep & (labels > 0)])
+    new_vals = np.arange(1, len(kept) + 1) if relabel else kept
+    lut = np.zeros(max_label + 2, dtype=_label_dtype(new_vals))
+    lut[kept] = new_vals
+    return lut
+
+
+def keep_unmeasured(
+    lut: np.ndarray,
+    labels: np.ndarray,
+    max_label: int,
+    relabel: bool = False,
+) -> np.ndarray:
+    """
+    Extend a lookup table (see label_lut) to keep unmeasured labels.
+
+    E.g. labels of the full resolution level of a multiscale image that
+    are too small to appear on the measured level. Labels up to max_label
+    that are not in labels map to themselves, or (if relabel) to their
+    value plus the largest relabelled value, so that they do not collide
+    with the relabelled labels.
+
+    :param lut: lookup table of the measured labels
+    :param labels: measured label values
+    :param max_label: largest label value of the images to map
+    :param relabel: whether the lookup table relabels sequentially
+    :return: lookup table of length max(max_label, len(lut) - 2) + 2
+    """
+    labels = np.asarray(labels)
+    n = max(int(max_label) + 1, len(lut) - 1)
+    unmeasured = np.ones(n, dtype=bool)
+    unmeasured[0] = False
+    unmeasured[labels[(labels > 0) & (labels < n)]] = False
+    ids = np.flatnonzero(unmeasured)
+    values = ids + (int(lut.max()) if relabel and len(lut) > 0 else 0)
+    dtype = np.promote_types(lut.dtype, _label_dtype(values))
+    new_lut = np.zeros(n + 1, dtype=dtype)
+    new_lut[: len(lut)] = lut
+    new_lut[ids] = values
+    return new_lut
+
+
+def max_label(img: np.ndarray) -> int:
+    """
+    Largest label value of a (lazy) label image.
+
+    Lazy images are read chunk by chunk.
+    :param img: label image
+    :return: int
+    """
+    if np.prod(img.shape) == 0:
+        return 0
+    if not is_lazy(img):
+        return int(np.max(img))
+    return max(
+        int(np.max(np.asarray(img[sl])))
+        for sl in chunk_slices(img.shape, img.chunks)
+    )
+
+
+def apply_lut(
+    img: np.ndarray,
+    lut: np.ndarray,
+    out: Optional[np.ndarray] = None,
+    n_workers: int = 1,
+) -> np.ndarray:
+    """
+    Map a label image through a lookup table (see label_lut).
+
+    The image is processed in slabs along the first axis, so temporary
+    arrays stay small. Label values outside the table are set to 0.
+
+    :param img: label image (can be lazy)
+    :param lut: lookup table
+    :param out: optional output array (same shape as img), default is a
+                new array with the dtype of the lookup table
+    :param n_workers: number of threads processing the slabs
+    :return: mapped label image
+    """
+    return apply_lut_many([img], lut, outs=[out], n_workers=n_workers)[0]
+
+
+def apply_lut_many(
+    images: List[np.ndarray],
+    lut: np.ndarray,
+    outs: Optional[List[Optional[np.ndarray]]] = None,
+    n_workers: int = 1,
+) -> List[np.ndarray]:
+    """
+    Map several label images through the same lookup table.
+
+    E.g. nuclei, cell and cytoplasm masks, which therefore keep matching
+    label values when relabelling. The slabs of all images are processed
+    in one thread pool.
+
+    :param images: list of label images (can be lazy)
+    :param lut: lookup table (see label_lut)
+    :param outs: optional output arrays (one per image, or None), can be
+                 on disk (see create_output), whose chunks should not span
+                 several slabs (see slab_slices)
+    :param n_workers: number of threads
+    :return: list of mapped label images
+    """
+    return exhaust(
+        iter_apply_lut_many(images, lut, outs=outs, n_workers=n_workers)
+    )
+
+
+def iter_apply_lut_many(
+    images: List[np.ndarray],
+    lut: np.ndarray,
+    outs: Optional[List[Optional[np.ndarray]]] = None,
+    n_workers: int = 1,
+) -> Generator[ProgressStep, None, List[np.ndarray]]:
+    """
+    Map several label images through the same lookup table, slab by slab.
+
+    Generator version of apply_lut_many, which yields a ProgressStep per
+    slab (e.g. for a background job).
+    :return: yields ProgressStep, returns the list of mapped label images
+    """
+    if outs is None:
+        outs = [None] * len(images)
+    outs = [
+        np.empty(np.shape(img), dtype=lut.dtype) if out is None else out
+        for img, out in zip(images, outs)
+    ]
+    luts = {lut.dtype: lut}
+    for out in outs:
+        if out.dtype not in luts:
+            luts[out.dtype] = lut.astype(out.dtype)
+
+    def _apply(img_out_sl):
+        img, out, sl = img_out_sl
+        # 'clip' maps values > max label to the last entry (0)
+        if isinstance(out, np.ndarray):
+            np.take(
+                luts[out.dtype], np.asarray(img[sl]), out=out[sl], mode="clip"
+            )
+        else:
+            # e.g. zarr arrays, written slab by slab
+            out[sl] = np.take(
+                luts[out.dtype], np.asarray(img[sl]), mode="clip"
+            )
+
+    tasks = [
+        (img, out, sl)
+        for img, out in zip(images, outs)
+        for sl in slab_slices(img)
+    ]
+    for i, _ in enumerate(pool_imap(_apply, tasks, n_workers=n_workers)):
+        yield ProgressStep(i + 1, len(tasks))
+    return outs
+
+
+def pool_imap(
+    func: Callable,
+    items: Iterable,
+    n_workers: int = 1,
+    executor: Type[Executor] = ThreadPoolExecutor,
+) -> Iterator:
+    """
+    Map a function over items in a worker pool, results in item order.
+
+    Unlike Executor.map, only a few items per worker are submitted ahead,
+    and the ones not started yet are dropped when the iteration stops
+    early (e.g. a cancelled job). With n_workers <= 1, the items are
+    mapped in the calling thread.
+    :param func: function of one item
+    :param items: iterable of items
+    :param n_workers: number of workers
+    :param executor: executor class (thread or process pool)
+    :return: iterator of the results
+    """
+    if n_workers is None or n_workers <= 1:
+        yield from map(func, items)
+        return
+    pool = executor(max_workers=n_workers)
+    try:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def frame_rows(
+    table: Dict[str, np.ndarray], frame: Optional[int] = None
+) -> Union[slice, np.ndarray]:
+    """
+    Rows of a time-lapse props table that belong to a frame.
+
+    :param table: props table, with a 'frame' column for time-lapses
+    :param frame: frame index, None for all rows
+    :return: row indices, or slice of all rows if the table has no
+             frame column
+    """
+    if frame is None or "frame" not in table:
+        return slice(None)
+    return np.flatnonzero(np.asarray(table["frame"]) == frame)
+
+
+def frame_luts(
+    frames: np.ndarray,
+    labels: np.ndarray,
+    keep: np.ndarray,
+    relabel: bool = False,
+) -> Dict[int, np.ndarray]:
+    """
+    Create a lookup table per frame of a time-lapse (see label_lut).
+
+    Every row is a label in a frame, so a label can be kept in some
+    frames and removed in others. When relabelling, a label value gets
+    the same new value in all frames (e.g. for tracked labels).
+    All tables have the same dtype.
+
+    :param frames: frame of every row
+    :param labels: label values
+    :param keep: boolean array (same order as labels), True = keep
+    :param relabel: whether to relabel sequentially
+    :return: dict of {frame: lookup table}
+    """
+    frames = np.asarray(frames)
+    labels = np.asarray(labels)
+    keep = np.asarray(keep, dtype=bool)
+    kept = np.unique(labels[keep & (labels > 0)])
+    new_vals = np.arange(1, len(kept) + 1) if relabel else kept
+    dtype = _label_dtype(new_vals)
+    luts = {}
+    for t in np.unique(frames):
+        rows = frames == t
+        lut = label_lut(labels[rows], keep[rows])
+        if relabel:
+            new_lut = np.zeros(len(lut), dtype=dtype)
+            nonzero = lut > 0
+            new_lut[nonzero] = np.searchsorted(kept, lut[nonzero]) + 1
+            lut = new_lut
+        luts[int(t)] = lut.astype(dtype, copy=False)
+    return luts
+
+
+def apply_frame_luts(
+    img: np.ndarray,
+    luts: Dict[int, np.ndarray],
+    out: Optional[np.ndarray] = None,
+    n_workers: int = 1,
+) -> np.ndarray:
+    """
+    Map the frames of a time-lapse label image through their lookup table.
+
+    :param img: time-lapse label image (can be lazy), time on first axis
+    :param luts: dict of {frame: lookup table} (see frame_luts),
+                 frames without table are set to 0
+    :param out: optional output array (same shape as img), default is a
+                new array with the dtype of the lookup tables
+    :param n_workers: number of threads processing a frame
+    :return: mapped label image
+    """
+    return exhaust(iter_apply_frame_luts(img, luts, out, n_workers))
+
+
+def iter_apply_frame_luts(
+    img: np.ndarray,
+    luts: Dict[int, np.ndarray],
+    out: Optional[np.ndarray] = None,
+    n_workers: int = 1,
+) -> Generator[ProgressStep, None, np.ndarray]:
+    """
+    Map the frames of a time-lapse label image, frame by frame.
+
+    Generator version of apply_frame_luts, which yields a ProgressStep
+    per frame.
+    :return: yields ProgressStep, returns the mapped label image
+    """
+    if out is None:
+        dtype = next(iter(luts.values())).dtype if luts else np.uint8
+        out = np.empty(np.shape(img), dtype=dtype)
+    n_frames = np.shape(img)[0]
+    for t in range(n_frames):
+        if t not in luts:
+            out[t] = 0
+        elif isinstance(out, np.ndarray):
+            apply_lut(img[t], luts[t], out=out[t], n_workers=n_workers)
+        else:
+            # e.g. zarr arrays, written frame by frame
+            out[t] = apply_lut(img[t], luts[t], n_workers=n_workers)
+        yield ProgressStep(t + 1, n_frames)
+    return out
+
+
+def slab_slices(
+    img: np.ndarray, slab_bytes: int = 64 * 2**20
+) -> Iterator[Tuple[slice, ...]]:
+    """
+    Split an image into slabs along the first axis.
+
+    :param img: image (or anything with shape and dtype)
+    :param slab_bytes: approximate size of a slab
+    :return: iterator of slices
+    """
+    shape = np.shape(img)
+    step = slab_step(img, slab_bytes=slab_bytes)
+    for start in range(0, shape[0], step):
+        yield (slice(start, min(start + step, shape[0])),)
+
+
+def slab_step(img: np.ndarray, slab_bytes: int = 64 * 2**20) -> int:
+    """
+    Number of rows (along the first axis) of the slabs of an image.
+
+    :param img: image (or anything with shape and dtype)
+    :param slab_bytes: approximate size of a slab
+    :return: number of rows
+    """
+    shape = np.shape(img)
+    row_bytes = int(np.prod(shape[1:])) * np.dtype(img.dtype).itemsize
+    return max(slab_bytes // max(row_bytes, 1), 1)
+
+
+def create_output(
+    shape: Tuple[int, ...],
+    dtype: np.dtype,
+    path: Optional[str] = None,
+    chunks: Optional[Tuple[int, ...]] = None,
+):
+    """
+    Create an (empty) output array, in memory or on disk.
+
+    Arrays on disk are filled chunk by chunk (e.g. by apply_lut_many),
+    so the output does not need to fit into memory.
+
+    :param shape: array shape
+    :param dtype: array dtype
+    :param path: None for a numpy array, a path ending with '.zarr' for
+                 a zarr directory store (requires zarr), any other path
+                 for a memory-mapped .npy file
+    :param chunks: chunk shape of zarr arrays, default is zarr's choice
+    :return: array
+    """
+    if path is None:
+        return np.empty(shape, dtype=dtype)
+    if str(path).endswith(".zarr"):
+        try:
+            import zarr
+        except ImportError as e:
+            raise ImportError(
+                "Writing zarr outputs requires zarr: pip install zarr"
+            ) from e
+        kwargs = {} if chunks is None else {"chunks": chunks}
+        return zarr.open_array(
+            str(path), mode="w", shape=shape, dtype=dtype, **kwargs
+        )
+    return np.lib.format.open_memmap(
+        str(path), mode="w+", dtype=dtype, shape=shape
     )
-    if relabel:
-        new_labels, _, _ = relabel_sequential(new_labels)
-    return new_labels
+
+
+def unique_path(path: str) -> str:
+    """
+    Add a number to a file name, if the file exists already.
+
+    E.g. 'labels_1.npy' becomes 'labels_1-2.npy'.
+    :param path: file (or directory) path
+    :return: path that does not exist
+    """
+    root, ext = os.path.splitext(path)
+    i = 1
+    while os.path.exists(path):
+        i += 1
+        path = f"{root}-{i}{ext}"
+    return path
+
+
+def _label_dtype(values: np.ndarray) -> np.dtype:
+    """
+    Smallest unsigned integer dtype for label values.
+
+    :param values: label values
+    :return: dtype
+    """
+    max_value = int(values.max()) if len(values) > 0 else 0
+    return np.min_scalar_type(max_value)
 
 
 def remove_label_objects(
@@ -159,45 +757,99 @@ def projected_area(region_mask: np.ndarray) -> int:
     return props[0].area
 
 
+def projected_props(region_mask: np.ndarray) -> Dict[str, float]:
+    """
+    Calculate all projected shape properties of a region at once.
+
+    The region is projected and measured only once, instead of once per
+    property (as with the single projected_* functions).
+    Circularity uses perimeter_crofton, see projected_circularity.
+
+    :param region_mask: mask of a region
+    :return: dict with projected area, convex area, circularity and perimeter
+    """
+    img_proj = project_mask(region_mask)
+    props = regionprops(img_proj)[0]
+    area = props.area
+    return {
+        "projected_area": area,
+        "projected_convex_area": props.area_convex,
+        "projected_circularity": (4 * np.pi * area)
+        / (props.perimeter_crofton**2),
+        "projected_perimeter": props.perimeter,
+    }
+
+
 def project_mask(region_mask: np.ndarray) -> np.ndarray:
     if len(region_mask.shape) != 3:
         raise ValueError("Input must be a 3D label image.")
-    # Project along the first (Z) axis
-    img_proj = np.max(region_mask, axis=0)
-    return np.asarray(img_proj, dtype=np.uint8)
+    # Project along the first (Z) axis,
+    # the boolean projection can be viewed as uint8 without a copy
+    img_proj = np.any(region_mask, axis=0)
+    return img_proj.view(np.uint8)
 
 
 def create_cell_cyto_masks(
-    lbl: np.ndarray, expansion: float, voxel_size: Union[float, tuple] = 1
+    lbl: np.ndarray,
+    expansion: float,
+    voxel_size: Union[float, tuple] = 1,
+    max_tile_voxels: Optional[int] = 2**24,
 ) -> (np.ndarray, np.ndarray):
     """
     Create cell and cyto masks from the labels.
 
     Allows expansion for anisotropic data.
+    Label images with more than max_tile_voxels voxels are expanded tile
+    by tile (see cell_expansion), to limit the memory usage.
     :param lbl: nuclear label mask
     :param expansion: desired expansion in microns
     :param voxel_size: (Z)YX voxel size
-    :return: cell mask, cytoplasm mask
+    :param max_tile_voxels: maximum number of voxels of an expansion tile,
+                            None to expand the whole image at once
+    :return: cell mask, cytoplasm mask (see CytoplasmLabels)
+    """
+    return exhaust(
+        iter_create_cell_cyto_masks(
+            lbl, expansion, voxel_size, max_tile_voxels=max_tile_voxels
+        )
+    )
+
+
+def iter_create_cell_cyto_masks(
+    lbl: np.ndarray,
+    expansion: float,
+    voxel_size: Union[float, tuple] = 1,
+    max_tile_voxels: Optional[int] = 2**24,
+) -> Generator[ProgressStep, None, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Create cell and cyto masks from the labels, tile by tile.
+
+    Generator version of create_cell_cyto_masks, which yields a
+    ProgressStep per expansion tile.
+    :return: yields ProgressStep, returns cell mask, cytoplasm mask
     """
     if voxel_size[-1] != voxel_size[-2]:
         raise ValueError(
             f"Voxel size in Y and X must be equal. Got: {voxel_size[-2:]}"
         )
-    # skimage has anisotropic expand labels from v0.23.0 on
-    # (also requires scipy>=1.8, but I don't think this will be a problem)
-    pbr = progress(total=2)
-    pbr.set_description("Expanding cells...")
-    start = time()
-    cells = cell_expansion(lbl, spacing=voxel_size, expansion=expansion)
-    pbr.update(1)
-    pbr.set_description("Creating cytoplasm...")
-    print("Creating cells took:", time() - start)
-    start = time()
-    # create cyto mask
-    cyto = np.subtract(cells, lbl)
-    pbr.update(2)
-    print("Creating cytoplasm took:", time() - start)
-    pbr.close()
+    tile_shape = None
+    if max_tile_voxels is not None and lbl.size > max_tile_voxels:
+        tile_shape = expansion_tile_shape(lbl.shape, max_tile_voxels)
+    with profiler.stage("compartments", tiled=tile_shape is not None):
+        with profiler.stage("cells"):
+            if tile_shape is not None:
+                cells = yield from _iter_tiled_cell_expansion(
+                    lbl, voxel_size, expansion, tile_shape
+                )
+            else:
+                # skimage has anisotropic expand labels from v0.23.0 on
+                cells = cell_expansion(
+                    lbl, spacing=voxel_size, expansion=expansion
+                )
+                yield ProgressStep(1, 1)
+        with profiler.stage("cyto"):
+            # create cyto mask (computed when read, not a third label image)
+            cyto = CytoplasmLabels(cells, lbl)
     return cells, cyto
 
 
@@ -205,6 +857,7 @@ def cell_expansion(
     label_image: np.ndarray,
     spacing: Union[float, tuple] = 1,
     expansion: float = 1,
+    tile_shape: Optional[Tuple[int, ...]] = None,
 ) -> np.ndarray:
     """
     Basically skimage's expand_labels.
@@ -212,12 +865,27 @@ def cell_expansion(
     But since anisotropic expansion is only available since skimage v0.23.0,
     re-implement it here: copied from:
     https://github.com/scikit-image/scikit-image/blob/v0.25.1/skimage/segmentation/_expand_labels.py
+
+    With a tile_shape, the image is expanded tile by tile. Every tile is
+    expanded together with a halo of the expansion distance (in voxels
+    per axis), which contains all labels that can reach the tile, and
+    only the tile itself is kept. So the memory usage depends on the tile
+    size, and the result is the same as expanding the whole image (except
+    for background voxels at exactly the same distance to two labels,
+    which may be assigned to the other label).
     :param label_image:
     :param spacing: usually a tuple of the voxel-size,
                     used to calculate the distance map with anisotropy
     :param expansion: distance in microns (if the spacing tuple is in microns)
+    :param tile_shape: optional shape of the tiles (without halo)
     :return:
     """
+    if tile_shape is not None:
+        return exhaust(
+            _iter_tiled_cell_expansion(
+                label_image, spacing, expansion, tile_shape
+            )
+        )
     if check_skimage_version(0, 22, 9):
         return expand_labels(label_image, distance=expansion, spacing=spacing)
     # Re-implementation
@@ -240,6 +908,188 @@ def cell_expansion(
     return labels_out
 
 
+def _iter_tiled_cell_expansion(
+    label_image: np.ndarray,
+    spacing: Union[float, tuple],
+    expansion: float,
+    tile_shape: Tuple[int, ...],
+) -> Generator[ProgressStep, None, np.ndarray]:
+    """
+    Expand labels tile by tile (see cell_expansion).
+
+    :param label_image: label image (can be lazy)
+    :param spacing: voxel size
+    :param expansion: expansion distance
+    :param tile_shape: shape of the tiles (without halo)
+    :return: yields a ProgressStep per tile, returns the expanded labels
+    """
+    ndim = label_image.ndim
+    spacing = np.broadcast_to(np.asarray(spacing, dtype=float), (ndim,))
+    # Labels further away than the halo are not within expansion distance
+    halo = np.ceil(expansion / spacing).astype(int)
+    shape = label_image.shape
+    labels_out = np.zeros(shape, dtype=label_image.dtype)
+    tiles = list(chunk_slices(shape, tile_shape))
+    for i, core in enumerate(tiles):
+        outer = tuple(
+            slice(max(c.start - h, 0), min(c.stop + h, n))
+            for c, h, n in zip(core, halo, shape)
+        )
+        expanded = cell_expansion(
+            np.asarray(label_image[outer]),
+            spacing=tuple(spacing),
+            expansion=expansion,
+        )
+        # Position of the core within the expanded tile
+        inner = tuple(
+            slice(c.start - o.start, c.stop - o.start)
+            for c, o in zip(core, outer)
+        )
+        labels_out[core] = expanded[inner]
+        yield ProgressStep(i + 1, len(tiles))
+    return labels_out
+
+
+def expansion_tile_shape(
+    shape: Tuple[int, ...], max_voxels: int
+) -> Tuple[int, ...]:
+    """
+    Tile shape with at most max_voxels voxels.
+
+    The longest axis is halved until the tile is small enough.
+    :param shape: image shape
+    :param max_voxels: maximum number of voxels of a tile
+    :return: tile shape
+    """
+    tile = list(shape)
+    while np.prod(tile) > max_voxels and max(tile) > 1:
+        axis = int(np.argmax(tile))
+        tile[axis] = -(-tile[axis] // 2)
+    return tuple(tile)
+
+
+def histogram(
+    values: np.ndarray, max_bins: int = 256
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Histogram of property values with an adaptive, bounded bin count.
+
+    The number of bins follows numpy's 'auto' estimator (the maximum of
+    the Freedman-Diaconis and Sturges estimates), but is limited to
+    max_bins, so that it does not grow with the number of objects.
+    Non-finite values (e.g. NaN) are ignored.
+
+    :param values: property values
+    :param max_bins: maximum number of bins
+    :return: counts, bin edges
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return np.zeros(1, dtype=np.intp), np.array([0.0, 1.0])
+    _min, _max = values.min(), values.max()
+    # Sturges
+    n_bins = np.log2(values.size) + 1
+    # Freedman-Diaconis (computed here, numpy would create all the edges)
+    q25, q75 = np.percentile(values, [25, 75])
+    width = 2 * (q75 - q25) * values.size ** (-1 / 3)
+    if width > 0:
+        n_bins = max(n_bins, (_max - _min) / width)
+    n_bins = int(np.clip(np.ceil(n_bins), 1, max_bins))
+    return np.histogram(values, bins=n_bins, range=(_min, _max))
+
+
+def patch_histogram(
+    counts: np.ndarray,
+    bins: np.ndarray,
+    removed: np.ndarray,
+    added: np.ndarray,
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Update a histogram (see histogram) after some values changed.
+
+    The bins are kept, so values outside of them cannot be added.
+    Non-finite values are ignored.
+
+    :param counts: histogram counts
+    :param bins: bin edges
+    :param removed: values to remove (e.g. of re-measured labels)
+    :param added: values to add
+    :return: counts, bin edges, or None if an added value is outside of
+             the bins (i.e. the histogram has to be computed again)
+    """
+    removed = np.asarray(removed, dtype=float)
+    removed = removed[np.isfinite(removed)]
+    added = np.asarray(added, dtype=float)
+    added = added[np.isfinite(added)]
+    if added.size > 0 and (added.min() < bins[0] or added.max() > bins[-1]):
+        return None
+    counts = (
+        counts
+        - np.histogram(removed, bins=bins)[0]
+        + np.histogram(added, bins=bins)[0]
+    )
+    return counts, bins
+
+
+@profiler.stage("calibrate")
+def calibrate_extra_props(table: dict, voxel_size: tuple) -> dict:
+    """
+    Calibrate the projected (extra) properties of a props table.
+
+    The projected properties are measured in pixels, multiply them with
+    the XY pixel size (squared for areas).
+    :param table: props table
+    :param voxel_size: (Z)YX voxel size the table was measured with
+    :return: calibrated props table
+    """
+    # check that the keys are in the props table
+    for p in __calibrated_extra_props__:
+        if p not in table:
+            return table
+    # if x != y size, raise not implemented error
+    if voxel_size[-2] != voxel_size[-1]:
+        raise NotImplementedError(
+            f"Different XY pixel size is not implemented. Got "
+            f"({voxel_size[-2]}, {voxel_size[-1]})."
+        )
+    # multiply the values
+    for prop in __calibrated_extra_props__:
+        if "area" in prop:
+            table[prop] = table[prop] * voxel_size[-1] ** 2
+        else:
+            table[prop] = table[prop] * voxel_size[-1]
+    return table
+
+
+def keep_in_range(
+    values: np.ndarray,
+    min_value: float = None,
+    max_value: float = None,
+    keep_nan: bool = True,
+) -> np.ndarray:
+    """
+    Which labels to keep, given their property values and a range.
+
+    Written as 'not outside the range', so that NaN values are kept,
+    unless keep_nan is False.
+    :param values: property values
+    :param min_value: minimum value, None for no minimum
+    :param max_value: maximum value, None for no maximum
+    :param keep_nan: whether NaN values are kept, default True
+    :return: boolean array, True = keep
+    """
+    values = np.asarray(values)
+    outside = np.zeros(values.shape, dtype=bool)
+    if min_value is not None:
+        outside |= values < min_value
+    if max_value is not None:
+        outside |= values > max_value
+    if not keep_nan and values.dtype.kind in "fc":
+        outside |= np.isnan(values)
+    return ~outside
+
+
 def rename_dict_keys(d: dict, prefix: str, exclude: str = "label") -> dict:
     """
     Rename the keys of a dictionary with a prefix.
@@ -250,6 +1100,9 @@ def rename_dict_keys(d: dict, prefix: str, exclude: str = "label") -> dict:
     :param exclude: str, single dict key to exclude from renaming
     :return: dict
     """
+    # Lazy tables are renamed without computing the columns
+    if isinstance(d, LazyPropsTable):
+        return d.renamed(prefix, exclude=exclude)
     return_dict = {}
     for k, v in d.items():
         # Add exclude-key without renaming
@@ -279,6 +1132,10 @@ def merge_dict(dict1: dict, dict2: dict, exclude: str = "label") -> dict:
         raise KeyError(
             f'Expected "{exclude}" in second dictionary, but was not found.'
         )
+    # Lazy tables are merged without computing the columns
+    if isinstance(dict1, LazyPropsTable):
+        dict1.merge(dict2, exclude=exclude)
+        return dict1
     # Add key-value pairs to first dict
     for k, v in dict2.items():
         if k == exclude: